@@ -0,0 +1,345 @@
+#!/usr/bin/env -S uv run
+# /// script
+# dependencies = [
+#   "Pillow>=10.0.0",
+#   "imagehash>=4.3.1",
+#   "numpy>=1.24.0",
+# ]
+# ///
+"""
+Reproducible benchmark for the image scanner.
+Generates a deterministic synthetic corpus with known duplicates, times the
+main scanner stages and checks precision/recall against the ground truth.
+
+Usage:
+    uv run benchmark.py [--scales 1000,10000,100000] [options]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from image_scanner import FeatureMatrix, ImageScanner
+
+# Base image sizes; every downscale ratio below keeps their aspect ratio exact
+BASE_SIZES = [(640, 480), (480, 640), (512, 512), (720, 240), (600, 400)]
+SCALE_RATIOS = [0.5, 0.25, 0.75]
+JPEG_QUALITIES = [40, 60, 75]
+
+# Roles that the scanner is expected to discard (the rest should be kept)
+DISCARD_ROLES = {'copy', 'scaled'}
+
+MANIFEST = "manifest.json"
+
+# Command-line tools whose start-up is checked, and the budget for `--help`
+# (median wall time including interpreter start-up). NumPy is the only
+# heavy import they are allowed to make before touching an image.
+STARTUP_SCRIPTS = ["image_scanner.py", "image_index.py", "compare_images.py", "review_discarded.py"]
+STARTUP_BUDGET_S = 0.5
+
+# Modules that may only be imported once an image is opened or hashed
+LAZY_MODULES = ["PIL.Image", "imagehash", "scipy", "pywt"]
+
+
+def _base_image(rng: np.random.Generator, size) -> Image.Image:
+    """Smooth random background with a few solid shapes, distinct per seed."""
+    width, height = size
+    field = (rng.random((6, 6, 3)) * 255).astype(np.uint8)
+    img = Image.fromarray(field).resize((width, height), Image.BICUBIC)
+    draw = ImageDraw.Draw(img)
+    for _ in range(6):
+        x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        x1 = x0 + int(rng.integers(width // 10, width // 2))
+        y1 = y0 + int(rng.integers(height // 10, height // 2))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        if rng.random() < 0.5:
+            draw.ellipse([x0, y0, x1, y1], fill=color)
+        else:
+            draw.rectangle([x0, y0, x1, y1], fill=color)
+    return img
+
+
+def _near_miss(rng: np.random.Generator, img: Image.Image) -> Image.Image:
+    """Same scene with a large region replaced; should not count as a duplicate."""
+    width, height = img.size
+    other = _base_image(rng, (width // 2, height))
+    miss = img.copy()
+    miss.paste(other, (int(rng.integers(0, 2)) * (width // 2), 0))
+    return miss
+
+
+def generate_corpus(directory: Path, count: int, seed: int = 0) -> Dict[str, Dict]:
+    """
+    Write about count images into directory and return the ground truth.
+
+    Images come in families: an original plus any of exact copies, downscaled
+    variants, re-encoded JPEG-quality variants and an unrelated near-miss.
+    Some originals are left without variants.
+
+    Returns:
+        Dict mapping each file name to {'family', 'role', 'pixels'}
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    truth: Dict[str, Dict] = {}
+    family = 0
+
+    def save(img: Image.Image, name: str, role: str, fam: int, **kwargs):
+        img.save(directory / name, **kwargs)
+        truth[name] = {'family': fam, 'role': role, 'pixels': img.size[0] * img.size[1]}
+
+    while len(truth) < count:
+        size = BASE_SIZES[int(rng.integers(len(BASE_SIZES)))]
+        img = _base_image(rng, size)
+        prefix = f"f{family:06d}"
+        save(img, f"{prefix}_original.jpg", 'original', family, quality=90)
+
+        if rng.random() < 0.6:
+            if rng.random() < 0.4:
+                shutil.copyfile(directory / f"{prefix}_original.jpg", directory / f"{prefix}_copy.jpg")
+                truth[f"{prefix}_copy.jpg"] = dict(truth[f"{prefix}_original.jpg"], role='copy')
+            for ratio in SCALE_RATIOS:
+                if rng.random() < 0.5:
+                    scaled = img.resize((int(size[0] * ratio), int(size[1] * ratio)), Image.LANCZOS)
+                    save(scaled, f"{prefix}_scaled{int(ratio * 100)}.jpg", 'scaled', family, quality=90)
+            if rng.random() < 0.3:
+                quality = JPEG_QUALITIES[int(rng.integers(len(JPEG_QUALITIES)))]
+                save(img, f"{prefix}_q{quality}.jpg", 'quality', family, quality=quality)
+            if rng.random() < 0.2:
+                family += 1
+                save(_near_miss(rng, img).resize((size[0] // 2, size[1] // 2)),
+                     f"{prefix}_nearmiss.jpg", 'near_miss', family, quality=90)
+        family += 1
+
+    with open(directory / MANIFEST, 'w') as f:
+        json.dump({'count': count, 'seed': seed, 'files': truth}, f)
+    return truth
+
+
+def load_or_generate(directory: Path, count: int, seed: int) -> Dict[str, Dict]:
+    """Reuse a corpus generated earlier with the same parameters, else build it."""
+    manifest = directory / MANIFEST
+    if manifest.exists():
+        with open(manifest) as f:
+            data = json.load(f)
+        if data.get('count') == count and data.get('seed') == seed:
+            return data['files']
+        shutil.rmtree(directory)
+    return generate_corpus(directory, count, seed)
+
+
+def expected_discards(truth: Dict[str, Dict]) -> Counter:
+    """Number of files per family that a perfect run would move to discarded/."""
+    expected: Counter = Counter()
+    for entry in truth.values():
+        if entry['role'] in DISCARD_ROLES:
+            expected[entry['family']] += 1
+    return expected
+
+
+def precision_recall(truth: Dict[str, Dict], moved: List[str]) -> Dict[str, float]:
+    """
+    Score the moved file names against the ground truth.
+
+    Identical copies are interchangeable and a family may lose its variants
+    to any larger member, so moves are counted per family: up to the expected
+    number are true positives, any beyond that (or from a family that should
+    lose nothing) are false positives.
+    """
+    expected = expected_discards(truth)
+    actual = Counter(truth[name]['family'] for name in moved if name in truth)
+    tp = sum(min(actual[fam], expected[fam]) for fam in actual)
+    fp = sum(max(0, actual[fam] - expected[fam]) for fam in actual)
+    fn = sum(max(0, expected[fam] - actual[fam]) for fam in expected)
+    return {
+        'true_positives': tp,
+        'false_positives': fp,
+        'false_negatives': fn,
+        'precision': tp / (tp + fp) if tp + fp else 1.0,
+        'recall': tp / (tp + fn) if tp + fn else 1.0,
+    }
+
+
+def bench_get_image_info(scanner: ImageScanner, paths: List[Path]) -> Dict[str, float]:
+    start = time.perf_counter()
+    for path in paths:
+        scanner.get_image_info(path)
+    elapsed = time.perf_counter() - start
+    return {'files': len(paths), 'seconds': elapsed, 'ms_per_file': elapsed * 1000 / len(paths)}
+
+
+def bench_compare_images(scanner: ImageScanner, infos: List[Dict], pairs: int, seed: int) -> Dict[str, float]:
+    rng = random.Random(seed)
+    index_pairs = [(rng.randrange(len(infos)), rng.randrange(len(infos))) for _ in range(pairs)]
+
+    start = time.perf_counter()
+    for i, j in index_pairs:
+        scanner.compare_images(infos[i], infos[j])
+    scalar = time.perf_counter() - start
+
+    features = FeatureMatrix(infos)
+    rows = np.array([i for i, _ in index_pairs])
+    cols = np.array([j for _, j in index_pairs])
+    start = time.perf_counter()
+    scanner.compare_batch(features, rows, cols)
+    batch = time.perf_counter() - start
+
+    return {
+        'pairs': pairs,
+        'scalar_us_per_pair': scalar * 1e6 / pairs,
+        'batch_us_per_pair': batch * 1e6 / pairs,
+    }
+
+
+def bench_scan(directory: Path, truth: Dict[str, Dict], threshold: int, workers: int) -> Dict:
+    """Run a dry-run scan and score the moves it would make."""
+    scanner = ImageScanner(str(directory), threshold=threshold, dry_run=True,
+                           use_cache=False, workers=workers, json_log=True)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        scanner.scan_for_duplicates()
+    elapsed = time.perf_counter() - start
+    scanner.logger.close()
+
+    moved = []
+    with open(scanner.jsonl_file) as f:
+        for line in f:
+            record = json.loads(line)
+            if record['action'] == 'move':
+                moved.append(Path(record['source']).name)
+    scanner.log_file.unlink()
+    scanner.jsonl_file.unlink()
+
+    result = {'seconds': elapsed, 'files_per_s': len(truth) / elapsed, 'moved': len(moved)}
+    result.update(precision_recall(truth, moved))
+    return result
+
+
+def bench_startup(runs: int = 5) -> Dict:
+    """
+    Time `--help` of each command-line tool and list the lazily imported
+    modules that importing it loads anyway. Either failing the budget or
+    loading such a module counts as a regression.
+    """
+    here = Path(__file__).resolve().parent
+    results = {}
+    for script in STARTUP_SCRIPTS:
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, str(here / script), "--help"], cwd=here,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            times.append(time.perf_counter() - start)
+        probe = (f"import sys, json, {Path(script).stem}; "
+                 f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))")
+        loaded = json.loads(subprocess.run([sys.executable, "-c", probe], cwd=here, capture_output=True,
+                                           text=True, check=True).stdout)
+        median = sorted(times)[len(times) // 2]
+        results[script] = {'help_seconds': median, 'eager_imports': loaded,
+                           'ok': median <= STARTUP_BUDGET_S and not loaded}
+    return results
+
+
+def run_scale(count: int, args) -> Dict:
+    corpus = Path(args.corpus_dir) / f"corpus_{count}_{args.seed}"
+    start = time.perf_counter()
+    truth = load_or_generate(corpus, count, args.seed)
+    generated = time.perf_counter() - start
+    roles = Counter(entry['role'] for entry in truth.values())
+    print(f"\n=== {len(truth)} images ({dict(roles)}), corpus ready in {generated:.1f}s ===")
+
+    scanner = ImageScanner(str(corpus), threshold=args.threshold, use_cache=False)
+    sample = sorted(corpus / name for name in truth)[:args.sample]
+    info_stats = bench_get_image_info(scanner, sample)
+    print(f"get_image_info:     {info_stats['ms_per_file']:.2f} ms/file over {info_stats['files']} files")
+
+    infos = [scanner.get_image_info(path) for path in sample]
+    compare_stats = bench_compare_images(scanner, infos, args.pairs, args.seed)
+    print(f"compare_images:     {compare_stats['scalar_us_per_pair']:.2f} us/pair scalar, "
+          f"{compare_stats['batch_us_per_pair']:.3f} us/pair batched")
+
+    scan_stats = bench_scan(corpus, truth, args.threshold, args.workers)
+    print(f"scan (dry run):     {scan_stats['seconds']:.2f}s ({scan_stats['files_per_s']:.1f} files/s), "
+          f"{scan_stats['moved']} moves")
+    print(f"accuracy:           precision {scan_stats['precision']:.4f}, recall {scan_stats['recall']:.4f} "
+          f"(TP {scan_stats['true_positives']}, FP {scan_stats['false_positives']}, "
+          f"FN {scan_stats['false_negatives']})")
+
+    if not args.keep:
+        shutil.rmtree(corpus)
+    return {'images': len(truth), 'roles': dict(roles), 'get_image_info': info_stats,
+            'compare_images': compare_stats, 'scan': scan_stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the image scanner on a synthetic corpus with known duplicates",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  # Quick run at 1k images
+  uv run benchmark.py
+
+  # Full run, keeping the generated corpora for the next run
+  uv run benchmark.py --scales 1000,10000,100000 --corpus-dir ~/bench --keep
+
+  # Save results for comparison between releases
+  uv run benchmark.py --json results.json
+        """
+    )
+    parser.add_argument("--scales", default="1000",
+                        help="Comma-separated corpus sizes to benchmark (default: 1000)")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus random seed (default: 0)")
+    parser.add_argument("--threshold", type=int, default=10, help="Scanner similarity threshold (default: 10)")
+    parser.add_argument("--workers", type=int, default=1, help="Scanner worker processes (default: 1)")
+    parser.add_argument("--sample", type=int, default=200,
+                        help="Files used to time get_image_info (default: 200)")
+    parser.add_argument("--pairs", type=int, default=20000,
+                        help="Random pairs used to time compare_images (default: 20000)")
+    parser.add_argument("--corpus-dir", default=None,
+                        help="Where to generate corpora (default: a temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="Keep generated corpora for reuse")
+    parser.add_argument("--json", metavar="FILE", help="Write results as JSON to FILE")
+    args = parser.parse_args()
+
+    temp_dir = None
+    if args.corpus_dir is None:
+        temp_dir = tempfile.mkdtemp(prefix="image_scanner_bench_")
+        args.corpus_dir = temp_dir
+
+    print(f"=== start-up (budget {STARTUP_BUDGET_S * 1000:.0f} ms for --help) ===")
+    startup = bench_startup()
+    for script, result in startup.items():
+        eager = f", imports {', '.join(result['eager_imports'])} eagerly" if result['eager_imports'] else ""
+        status = "ok" if result['ok'] else "REGRESSION"
+        print(f"{script + ':':22}{result['help_seconds'] * 1000:.0f} ms{eager} [{status}]")
+
+    try:
+        results = {str(count): run_scale(count, args) for count in
+                   (int(value) for value in args.scales.split(","))}
+    finally:
+        if temp_dir and not args.keep:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'startup': startup, 'results': results}, f, indent=2)
+        print(f"\nResults written to {args.json}")
+    return 0 if all(result['ok'] for result in startup.values()) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
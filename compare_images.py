@@ -10,25 +10,45 @@
 Quick tool to compare two specific images and see their similarity scores.
 Useful for testing threshold values and understanding false positives/negatives.
 
+In batch mode every image of a folder (or list) is hashed once and all pairs
+are compared at once, which gives a distance matrix and a suggested threshold.
+
 Usage:
     uv run compare_images.py <image1> <image2>
+    uv run compare_images.py --batch <directory or list file> [options]
 """
 
 import sys
+import csv
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from PIL import Image
-import imagehash
+from typing import Dict, List, Optional, Tuple
 import numpy as np
 
+from image_scanner import (ASPECT_TOLERANCE, EXTRACT_CHUNKSIZE, HASH_FIELDS, HEIF_EXTENSIONS, FeatureMatrix,
+                           enable_heif, get_image_info, popcount64)
+
+# Rows of the distance matrices computed at a time, bounding the temporaries
+BLOCK_ROWS = 256
+
+# The scanner's default --threshold, reported next to the suggestion
+DEFAULT_THRESHOLD = 10
+
 
 def compare_two_images(img1_path: str, img2_path: str):
     """Compare two images and show detailed similarity analysis."""
+    from PIL import Image
+    import imagehash
+    
     path1 = Path(img1_path)
     path2 = Path(img2_path)
     
     if not path1.exists() or not path2.exists():
         print("Error: One or both image files don't exist")
         return
+    if path1.suffix.lower() in HEIF_EXTENSIONS or path2.suffix.lower() in HEIF_EXTENSIONS:
+        enable_heif()
     
     print(f"Comparing images:")
     print(f"  Image 1: {path1.name}")
@@ -118,11 +138,239 @@ def compare_two_images(img1_path: str, img2_path: str):
         print(f"Error comparing images: {e}")
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
+def collect_images(source: Path, recursive: bool = False) -> List[Path]:
+    """
+    Images to compare: the PNG/JPEG files in a directory, or the paths listed
+    one per line in a text file (relative paths are taken from its directory).
+    """
+    if source.is_dir():
+        files = source.rglob("*") if recursive else source.iterdir()
+        return sorted(path for path in files
+                      if path.is_file() and path.suffix.lower() in ('.png', '.jpg', '.jpeg'))
+    with open(source) as f:
+        return [source.parent / line.strip() for line in f if line.strip()]
+
+
+def _info_or_error(path: Path, full_decode: bool) -> Tuple[Optional[Dict], Optional[str]]:
+    try:
+        return get_image_info(path, full_decode), None
+    except Exception as e:
+        return None, str(e)
+
+
+def hash_images(paths: List[Path], workers: int = 1, full_decode: bool = False
+                ) -> Tuple[List[Path], FeatureMatrix]:
+    """Hash every image once; returns the readable images and their features."""
+    heif = any(path.suffix.lower() in HEIF_EXTENSIONS for path in paths) and enable_heif()
+    if workers > 1:
+        # Spawned workers don't inherit the parent's HEIF registration
+        with ProcessPoolExecutor(max_workers=workers, initializer=enable_heif if heif else None) as executor:
+            results = list(executor.map(_info_or_error, paths, [full_decode] * len(paths),
+                                        chunksize=EXTRACT_CHUNKSIZE))
+    else:
+        results = [_info_or_error(path, full_decode) for path in paths]
+    
+    hashed, infos = [], []
+    for path, (info, error) in zip(paths, results):
+        if error is not None:
+            print(f"Error reading {path.name}: {error}")
+            continue
+        hashed.append(path)
+        infos.append(info)
+    return hashed, FeatureMatrix(infos)
+
+
+def distance_matrices(features: FeatureMatrix) -> Dict[str, np.ndarray]:
+    """
+    All pairwise distances: Hamming distance of each hash type (uint8) and
+    the summed absolute difference of the average colors (uint16), as n x n
+    matrices.
+    """
+    n = len(features)
+    distances = {field: np.zeros((n, n), dtype=np.uint8) for field in HASH_FIELDS}
+    distances['color'] = np.zeros((n, n), dtype=np.uint16)
+    colors = features.avg_color.astype(np.int16)
+    for start in range(0, n, BLOCK_ROWS):
+        block = slice(start, min(start + BLOCK_ROWS, n))
+        diffs = popcount64(features.hashes[block, None, :] ^ features.hashes[None, :, :])
+        for k, field in enumerate(HASH_FIELDS):
+            distances[field][block] = diffs[..., k]
+        distances['color'][block] = np.abs(colors[block, None, :] - colors[None, :, :]).sum(axis=-1)
+    return distances
+
+
+def min_thresholds(distances: Dict[str, np.ndarray], features: FeatureMatrix) -> np.ndarray:
+    """
+    For every pair, the smallest --threshold at which the scanner's decision
+    rule calls it similar, or 255 if no threshold does (different aspect
+    ratios or colors).
+    
+    The rule is pHash distance <= threshold and dHash distance <= 1.5 *
+    threshold, plus the aspect ratio and color checks.
+    """
+    dhash = distances['dhash'].astype(np.int16)
+    needed = np.maximum(distances['phash'], (2 * dhash + 2) // 3)
+    aspect_ok = np.abs(features.aspect_ratio[:, None] - features.aspect_ratio[None, :]) <= ASPECT_TOLERANCE
+    color_ok = (1.0 - distances['color'] / 765.0) > 0.7
+    return np.where(aspect_ok & color_ok, needed, 255).astype(np.uint8)
+
+
+def read_labels(path: Path) -> Dict[str, str]:
+    """file name -> label from a CSV of (file, label) rows; a header row is skipped."""
+    with open(path, newline='') as f:
+        rows = [row for row in csv.reader(f) if len(row) >= 2]
+    if rows and rows[0][0].strip().lower() in ('file', 'filename', 'path', 'image'):
+        rows = rows[1:]
+    return {Path(row[0].strip()).name: row[1].strip() for row in rows}
+
+
+def suggest_threshold(needed: np.ndarray, labels: Optional[List[str]] = None
+                      ) -> Tuple[int, str, Optional[Dict[int, Tuple[float, float]]]]:
+    """
+    Suggest a --threshold from the per-pair minimum thresholds.
+    
+    With labels (one per image; images with the same label are versions of
+    the same picture) the threshold with the best F1 score is chosen, the
+    middle one when several thresholds tie. Without labels, each image's distance to its
+    nearest neighbour is split into a near and a far group with Otsu's
+    method and the middle of the gap between them is taken, which works
+    when the folder has a fair share of versions.
+    
+    Returns:
+        Tuple of (threshold, method description, {threshold: (precision,
+        recall)} when labels were given, else None)
+    """
+    n = len(needed)
+    if labels is not None:
+        i, j = np.triu_indices(n, 1)
+        label_ids = np.unique(labels, return_inverse=True)[1]
+        positive = label_ids[i] == label_ids[j]
+        pair_needed = needed[i, j].astype(np.int64)
+        tp = np.cumsum(np.bincount(pair_needed[positive], minlength=256))[:65]
+        fp = np.cumsum(np.bincount(pair_needed[~positive], minlength=256))[:65]
+        total = max(int(positive.sum()), 1)
+        precision = np.where(tp + fp > 0, tp / np.maximum(tp + fp, 1), 1.0)
+        recall = tp / total
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / np.maximum(precision + recall, 1e-12), 0.0)
+        plateau = np.flatnonzero(f1 == f1.max())
+        best = int(plateau[0] + plateau[-1]) // 2
+        scores = {t: (float(precision[t]), float(recall[t])) for t in range(65)}
+        return best, f"best F1 over {int(positive.sum())} labelled pairs", scores
+    
+    masked = needed.astype(np.int64)
+    np.fill_diagonal(masked, 255)
+    nearest = masked.min(axis=1)
+    nearest = nearest[nearest <= 64]
+    if len(np.unique(nearest)) < 2:
+        return DEFAULT_THRESHOLD, "default (too few comparable images to estimate)", None
+    histogram = np.bincount(nearest, minlength=65).astype(np.float64)
+    values = np.arange(65)
+    split, best_variance = 0, -1.0
+    for t in range(64):
+        near, far = histogram[:t + 1].sum(), histogram[t + 1:].sum()
+        if near == 0 or far == 0:
+            continue
+        mean_near = (histogram[:t + 1] * values[:t + 1]).sum() / near
+        mean_far = (histogram[t + 1:] * values[t + 1:]).sum() / far
+        variance = near * far * (mean_near - mean_far) ** 2
+        if variance > best_variance:
+            split, best_variance = t, variance
+    # Middle of the gap between the two groups
+    threshold = (int(nearest[nearest <= split].max()) + int(nearest[nearest > split].min())) // 2
+    return threshold, "middle of the gap in nearest-neighbour distances (no labels given)", None
+
+
+def write_distances(output: Path, paths: List[Path], distances: Dict[str, np.ndarray],
+                    features: FeatureMatrix, needed: np.ndarray):
+    """Write the matrices as compressed NPZ, or as CSV with one row per pair."""
+    if output.suffix.lower() == '.csv':
+        i, j = np.triu_indices(len(paths), 1)
+        with open(output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['image1', 'image2', *HASH_FIELDS, 'color', 'aspect_diff', 'min_threshold'])
+            aspect_diff = np.abs(features.aspect_ratio[i] - features.aspect_ratio[j])
+            columns = [distances[field][i, j] for field in HASH_FIELDS] + [distances['color'][i, j]]
+            for k in range(len(i)):
+                writer.writerow([paths[i[k]], paths[j[k]], *(int(column[k]) for column in columns),
+                                 round(float(aspect_diff[k]), 3), int(needed[i[k], j[k]])])
+    else:
+        np.savez_compressed(
+            output, paths=np.array([str(path) for path in paths]),
+            aspect_ratio=features.aspect_ratio, pixels=features.pixels,
+            min_threshold=needed, **distances,
+        )
+
+
+def batch_compare(args) -> int:
+    """Hash a set of images once, compare all pairs and suggest a threshold."""
+    paths = collect_images(Path(args.batch), args.recursive)
+    print(f"Hashing {len(paths)} images...")
+    paths, features = hash_images(paths, args.workers, args.full_decode)
+    if len(paths) < 2:
+        print("Error: need at least two readable images")
+        return 1
+    
+    distances = distance_matrices(features)
+    needed = min_thresholds(distances, features)
+    print(f"Compared {len(paths) * (len(paths) - 1) // 2:,} pairs")
+    if args.output:
+        write_distances(Path(args.output), paths, distances, features, needed)
+        print(f"Wrote distance matrices to {args.output}")
+    
+    labels = None
+    if args.labels:
+        known = read_labels(Path(args.labels))
+        # Unlabelled images count as unique
+        labels = [known.get(path.name, f"\0{path}") for path in paths]
+    threshold, method, scores = suggest_threshold(needed, labels)
+    print(f"\nSuggested threshold: --threshold {threshold} ({method})")
+    if scores is not None:
+        for t in sorted({threshold, DEFAULT_THRESHOLD}):
+            precision, recall = scores[t]
+            print(f"  --threshold {t}: precision {precision:.3f}, recall {recall:.3f}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare two images, or all pairs of a set of images",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  uv run compare_images.py photo.jpg photo_small.jpg
+  uv run compare_images.py --batch ~/Pictures/sample -o distances.npz --workers 8
+  uv run compare_images.py --batch ~/Pictures/sample --labels labels.csv
+        """
+    )
+    parser.add_argument("images", nargs="*", help="Two images to compare")
+    parser.add_argument("--batch", metavar="SOURCE",
+                        help="Compare all pairs of the images in a directory or listed in a text file")
+    parser.add_argument("--output", "-o", help="Write the distance matrices to a .npz or .csv file")
+    parser.add_argument("--labels", help="CSV of (file name, label) rows; images sharing a label are versions "
+                                         "of the same picture")
+    parser.add_argument("--workers", "-j", type=int, default=1,
+                        help="Number of processes used to hash images (default: 1)")
+    parser.add_argument("--recursive", "-r", action="store_true", help="Also include subdirectories")
+    parser.add_argument("--full-decode", action="store_true",
+                        help="Hash images at full resolution instead of a reduced working size")
+    args = parser.parse_args()
+    
+    if args.batch:
+        if not Path(args.batch).exists():
+            print(f"Error: '{args.batch}' does not exist")
+            return 1
+        return batch_compare(args)
+    
+    if len(args.images) != 2:
         print("Usage: uv run compare_images.py <image1> <image2>")
+        print("       uv run compare_images.py --batch <directory or list file> [options]")
         print("\nExample:")
         print("  uv run compare_images.py photo.jpg photo_small.jpg")
-        sys.exit(1)
+        return 1
     
-    compare_two_images(sys.argv[1], sys.argv[2])
\ No newline at end of file
+    compare_two_images(args.images[0], args.images[1])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,200 @@
+#!/usr/bin/env -S uv run
+# /// script
+# dependencies = [
+#   "Pillow>=10.0.0",
+#   "imagehash>=4.3.1",
+#   "numpy>=1.24.0",
+# ]
+# ///
+"""
+Feature index for checking new images against a reference archive.
+Builds a compact, memory-mapped index of an archive's image hashes once, so
+other directories can be checked against it without reading the archive.
+
+Usage:
+    uv run image_index.py build <archive> -o <index> [options]
+    uv run image_index.py query <index> <directory> [options]
+    uv run image_index.py info <index>
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+from image_scanner import FeatureIndex, ImageScanner, INDEX_RECORD, HASH_ALGORITHMS
+
+
+def work_dir_for(directory: Path) -> Path:
+    """
+    Folder for the scanner's log, checkpoint and hash cache of a directory.
+    It is kept in the user's cache directory, so indexing or querying never
+    writes into the directory being read (which may be read-only).
+    """
+    base = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "image-duplicate-scanner"
+    key = hashlib.sha1(str(directory.resolve()).encode('utf-8', 'surrogateescape')).hexdigest()[:16]
+    path = base / key
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def build_index(args) -> int:
+    """Analyze every image under the archive directory and write the index."""
+    root = Path(args.directory).resolve()
+    scanner = ImageScanner(
+        str(root),
+        use_cache=not args.no_cache,
+        workers=args.workers,
+        full_decode=args.full_decode,
+        hash_algorithm=args.hash_algorithm,
+        recursive=args.recursive,
+        extra_extensions=args.extensions,
+        work_dir=work_dir_for(root),
+    )
+
+    started = time.perf_counter()
+    print(f"Analyzing images in {root}...")
+    store = scanner.analyze_images(scanner.iter_images())
+
+    print(f"Hashing file contents ({args.hash_algorithm})...")
+    entries = scanner.index_entries(store)
+
+    count = FeatureIndex.write(Path(args.output), root, entries, args.hash_algorithm,
+                               "full" if args.full_decode else "draft")
+    size = os.path.getsize(args.output)
+    print(f"Wrote {count} images to {args.output} ({size / 1024 / 1024:.1f} MB, "
+          f"{INDEX_RECORD.itemsize} bytes per record) in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+def query_index(args) -> int:
+    """Report the images in a directory that are copies or smaller versions of indexed images."""
+    index = FeatureIndex(Path(args.index))
+    scanner = ImageScanner(
+        args.directory,
+        threshold=args.threshold,
+        use_cache=not args.no_cache,
+        workers=args.workers,
+        full_decode=index.variant == "full",
+        recursive=args.recursive,
+        extra_extensions=args.extensions,
+        work_dir=work_dir_for(Path(args.directory)),
+    )
+    # Keep the scanner's progress messages out of --json output
+    with contextlib.redirect_stdout(sys.stderr):
+        store = scanner.analyze_images(scanner.iter_images())
+
+    results = []
+    for img_path, info in store.items():
+        match = scanner.find_in_index(index, img_path, info)
+        if match is None:
+            continue
+        record, exact, confidence, reason = match
+        results.append({
+            'path': str(img_path),
+            'match': str(index.path_of(record)),
+            'kind': 'exact duplicate' if exact else 'smaller version',
+            'confidence': round(confidence, 4),
+            'reason': reason,
+        })
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return 0
+
+    for result in results:
+        print(f"{result['path']}")
+        print(f"  {result['kind']} of {result['match']} (confidence: {result['confidence']:.0%})")
+    print(f"\n{len(results)} of {len(store)} images found in the index ({len(index)} images)")
+    return 0
+
+
+def show_info(args) -> int:
+    """Print the index header."""
+    index = FeatureIndex(Path(args.index))
+    print(f"Index:          {index.path}")
+    print(f"Images:         {len(index)}")
+    print(f"Root:           {index.root}")
+    print(f"Content hash:   {index.hash_algorithm}")
+    print(f"Decoding:       {index.variant}")
+    if 'shard' in index.header:
+        print(f"Shard:          {index.header['shard'][0]}/{index.header['shard'][1]} (for image_scanner.py --merge)")
+    print(f"Created:        {index.header['created']}")
+    print(f"File size:      {os.path.getsize(index.path) / 1024 / 1024:.1f} MB")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build and query feature indexes of image archives",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  # Index an archive once (subdirectories included)
+  uv run image_index.py build /archive -o archive.idx --recursive --workers 8
+
+  # List the downloads that the archive already has
+  uv run image_index.py query archive.idx ~/Downloads
+
+  # Move them to discarded instead
+  uv run image_scanner.py ~/Downloads --against archive.idx
+        """
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_scan_options(subparser):
+        subparser.add_argument("--recursive", "-r", action="store_true", help="Also include subdirectories")
+        subparser.add_argument(
+            "--extensions",
+            type=lambda value: [ext.strip() for ext in value.split(",") if ext.strip()],
+            default=[],
+            help="Comma-separated extra extensions to include, e.g. webp,tiff"
+        )
+        subparser.add_argument("--workers", "-j", type=int, default=1,
+                               help="Number of processes used to analyze images (default: 1)")
+        subparser.add_argument("--no-cache", action="store_true",
+                               help="Ignore and don't update the hash cache of the analyzed directory "
+                                    "(kept in ~/.cache/image-duplicate-scanner, not in the directory)")
+
+    build = subparsers.add_parser("build", help="Index the images in a directory")
+    build.add_argument("directory", help="Archive directory to index")
+    build.add_argument("--output", "-o", required=True, help="Index file to write")
+    build.add_argument("--full-decode", action="store_true",
+                       help="Hash images at full resolution instead of a reduced working size")
+    build.add_argument("--hash-algorithm", choices=HASH_ALGORITHMS, default="md5",
+                       help="Content hash used to recognize identical files (default: md5)")
+    add_scan_options(build)
+    build.set_defaults(func=build_index)
+
+    query = subparsers.add_parser("query", help="Find images in a directory that are already indexed")
+    query.add_argument("index", help="Index file")
+    query.add_argument("directory", nargs="?", default=".", help="Directory to check (default: current directory)")
+    query.add_argument("--threshold", type=int, default=10,
+                       help="Similarity threshold for perceptual hashing (default: 10, lower = more similar)")
+    query.add_argument("--json", action="store_true", help="Print the matches as JSON")
+    add_scan_options(query)
+    query.set_defaults(func=query_index)
+
+    info = subparsers.add_parser("info", help="Describe an index file")
+    info.add_argument("index", help="Index file")
+    info.set_defaults(func=show_info)
+
+    args = parser.parse_args()
+
+    if getattr(args, "directory", None) and not os.path.isdir(args.directory):
+        print(f"Error: '{args.directory}' is not a valid directory")
+        return 1
+    if getattr(args, "index", None) and not os.path.isfile(args.index):
+        print(f"Error: '{args.index}' is not an index file")
+        return 1
+
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    exit(main())
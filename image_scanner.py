@@ -14,26 +14,1613 @@ Usage:
     uv run image_scanner.py [directory] [options]
 """
 
+import io
 import os
 import shutil
 import hashlib
 import re
+import sys
+import json
+import time
+import atexit
+import sqlite3
+import select
+import struct
+import zlib
+import ctypes
+import ctypes.util
 from pathlib import Path
-from typing import Dict, List, Tuple, Set, Optional
-from PIL import Image
-import imagehash
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Sequence, Tuple, Set, Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from itertools import chain, repeat
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager, nullcontext
+from array import array
 import argparse
 import numpy as np
 from datetime import datetime
 import warnings
 
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Pillow and imagehash are imported where images are first opened, so that
+# --help, --undo and fully cached runs start without them
+if TYPE_CHECKING:
+    from PIL import Image
+
 # Suppress the specific PIL warning about palette images
 warnings.filterwarnings("ignore", message="Palette images with Transparency expressed in bytes should be converted to RGBA images")
 
 
+# Order of the fields in the compact tuples sent back by worker processes
+INFO_FIELDS = (
+    'width', 'height', 'aspect_ratio', 'mode', 'file_size',
+    'phash', 'dhash', 'whash', 'ahash', 'avg_color', 'pixels'
+)
+
+# Perceptual hashes in the column order used by FeatureMatrix
+HASH_FIELDS = ('phash', 'dhash', 'whash', 'ahash')
+
+# Hashes that decide whether two images are similar (see compare_images); the
+# others only contribute to the confidence score and can be left out (--hashes)
+GATE_HASHES = ('phash', 'dhash')
+
+# Weight of each hash in the confidence score, in HASH_FIELDS order
+HASH_WEIGHTS = (0.4, 0.3, 0.2, 0.1)
+
+# Shorter-side size of the shared buffer that hashes are computed from. The
+# largest input any hash needs is pHash's 32x32, so this leaves a wide margin.
+# On a mixed corpus of 0.06-24 megapixel JPEG/PNG files (RGB, RGBA, L and P
+# modes) every hash stayed within 2 bits of full-resolution hashing
+# (--full-decode) and each avg_color channel within 1. Use a threshold of at
+# least 2 when comparing against features extracted with --full-decode.
+WORKING_SIZE = 256
+
+
+# Bytes hashed from each end of a file when pre-filtering exact duplicates
+PARTIAL_HASH_BYTES = 64 * 1024
+
+# Read size for full-file hashing; large reads keep network round-trips down
+READ_BUFFER_SIZE = 1024 * 1024
+
+# Files sent to a worker process per task when analyzing with --workers
+EXTRACT_CHUNKSIZE = 16
+
+# Write buffer for the run logs; RunLogger flushes it periodically
+LOG_BUFFER_SIZE = 64 * 1024
+
+# Default cap on file bytes held in memory by the read-ahead stage (--prefetch)
+PREFETCH_MEMORY = 256 * 1024 * 1024
+
+# Bytes of a content hash kept per image for exact-duplicate grouping
+DIGEST_BYTES = 16
+
+# hashlib algorithms offered for exact-duplicate detection
+HASH_ALGORITHMS = ('md5', 'sha1', 'blake2b')
+
+# Format version written to the header of file-operation journals
+JOURNAL_VERSION = 1
+
+# Minimum seconds between checkpoints of a running scan; slower saves are spaced
+# further apart so checkpointing stays a small fraction of the run
+CHECKPOINT_INTERVAL = 30.0
+
+
+def get_file_hash(filepath: Path, algorithm: str = 'md5') -> str:
+    """Calculate a content hash of a file for exact duplicate detection."""
+    hasher = hashlib.new(algorithm)
+    buffer = bytearray(READ_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(filepath, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            hasher.update(view[:n])
+    return hasher.hexdigest()
+
+
+def get_partial_hash(filepath: Path, file_size: int, algorithm: str = 'md5') -> str:
+    """
+    Hash only the first and last PARTIAL_HASH_BYTES of a file.
+    
+    Files of at most 2 * PARTIAL_HASH_BYTES are hashed whole, so for them
+    the result is already a full content hash.
+    """
+    hasher = hashlib.new(algorithm)
+    with open(filepath, "rb") as f:
+        if file_size <= 2 * PARTIAL_HASH_BYTES:
+            hasher.update(f.read())
+        else:
+            hasher.update(f.read(PARTIAL_HASH_BYTES))
+            f.seek(-PARTIAL_HASH_BYTES, os.SEEK_END)
+            hasher.update(f.read(PARTIAL_HASH_BYTES))
+    return hasher.hexdigest()
+
+
+def _working_image(img: 'Image.Image') -> 'Image.Image':
+    """
+    Decode img once at roughly WORKING_SIZE pixels on its shorter side.
+    
+    JPEGs are scaled by 1/2, 1/4 or 1/8 inside the decoder via draft(); any
+    remaining excess is removed with a box-filter reduce(), which preserves
+    the mean color. Images already smaller than WORKING_SIZE are left as-is.
+    """
+    img.draft(None, (WORKING_SIZE, WORKING_SIZE))
+    factor = min(img.size) // WORKING_SIZE
+    if factor < 2:
+        img.load()
+        return img
+    if img.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+        img = img.convert('RGB')
+    return img.reduce(factor)
+
+
+def get_image_info(filepath: Path, full_decode: bool = False,
+                   timings: Optional[Dict[str, float]] = None, data: Optional[bytes] = None,
+                   hashes: Sequence[str] = HASH_FIELDS) -> Dict:
+    """
+    Get comprehensive image information including multiple hashes.
+    
+    By default the image is decoded once at a reduced working size (using
+    JPEG DCT scaling where possible) and all hashes and the average color
+    are computed from that shared buffer. full_decode=True hashes the image
+    at full resolution instead, which reproduces imagehash's reference values.
+    If data holds the file's bytes (already read by the prefetcher), the
+    image is decoded from memory and the file is not touched. Only the
+    perceptual hashes named in hashes are computed; the others are None.
+    
+    If a timings dict is given, the seconds spent in each step (decode,
+    phash, dhash, whash, ahash, color, stat) are added to it.
+    
+    Returns:
+        Dict containing image metadata and hashes
+    """
+    from PIL import Image
+    import imagehash
+    
+    last = time.perf_counter() if timings is not None else 0.0
+    
+    def lap(step: str):
+        nonlocal last
+        if timings is not None:
+            now = time.perf_counter()
+            timings[step] = timings.get(step, 0.0) + now - last
+            last = now
+    
+    hash_functions = {
+        'phash': imagehash.phash,
+        'dhash': imagehash.dhash,
+        'whash': imagehash.whash,
+        'ahash': imagehash.average_hash,
+    }
+    hash_values = dict.fromkeys(HASH_FIELDS)
+    
+    with Image.open(io.BytesIO(data) if data is not None else filepath) as img:
+        width, height = img.size
+        mode = img.mode
+        
+        if full_decode:
+            img.load()
+            lap('decode')
+            
+            # Calculate multiple hash types for better accuracy
+            for field in HASH_FIELDS:
+                if field in hashes:
+                    hash_values[field] = str(hash_functions[field](img))
+                    lap(field)
+            
+            # Convert to RGB for consistent comparison
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            
+            # Calculate average color for basic similarity check
+            img_array = np.array(img)
+            avg_color = tuple(int(c) for c in img_array.mean(axis=(0, 1)).astype(int))
+            lap('color')
+        else:
+            work = _working_image(img)
+            grey = work.convert('L')
+            lap('decode')
+            for field in HASH_FIELDS:
+                if field in hashes:
+                    hash_values[field] = str(hash_functions[field](grey))
+                    lap(field)
+            
+            rgb = work if work.mode == 'RGB' else work.convert('RGB')
+            avg_color = tuple(int(c) for c in np.asarray(rgb).mean(axis=(0, 1)).astype(int))
+            lap('color')
+    
+    file_size = len(data) if data is not None else filepath.stat().st_size
+    lap('stat')
+    
+    return {
+        'width': width,
+        'height': height,
+        'aspect_ratio': round(width / height, 3),
+        'mode': mode,
+        'file_size': file_size,
+        **hash_values,
+        'avg_color': avg_color,
+        'pixels': width * height
+    }
+
+
+def get_image_header(filepath: Path) -> Dict:
+    """
+    Read an image's dimensions and mode from its header, without decoding it.
+    
+    Returns:
+        Dict with the same keys as get_image_info, where the hashes and
+        avg_color are None
+    """
+    from PIL import Image
+    
+    with Image.open(filepath) as img:
+        width, height = img.size
+        mode = img.mode
+    info = dict.fromkeys(INFO_FIELDS)
+    info.update(width=width, height=height, aspect_ratio=round(width / height, 3), mode=mode,
+                file_size=filepath.stat().st_size, pixels=width * height)
+    return info
+
+
+# Extensions that need the pillow-heif plugin
+HEIF_EXTENSIONS = ('.heic', '.heif')
+
+
+def enable_heif() -> bool:
+    """
+    Register the pillow-heif opener with Pillow, returning False if the
+    package is missing. Worker processes started with spawn (macOS) or
+    forkserver don't inherit the registration, so pools that may open
+    HEIC files pass this as their initializer.
+    """
+    try:
+        from pillow_heif import register_heif_opener
+    except ImportError:
+        return False
+    register_heif_opener()
+    return True
+
+
+def _extract_worker(path: str, full_decode: bool = False, profile: bool = False,
+                    data: Optional[bytes] = None, algorithm: str = 'md5',
+                    hashes: Sequence[str] = HASH_FIELDS
+                    ) -> Tuple[Optional[tuple], Optional[str], Optional[Dict], Optional[str]]:
+    """
+    Worker-process entry point for parallel analysis.
+    
+    Returns (info tuple in INFO_FIELDS order, None, timings, digest) on
+    success or (None, error message, timings, None) on failure, which
+    pickles far smaller than a dict. timings is None unless profile is True.
+    When the file's bytes are passed in data, the content hash is computed
+    from the same buffer and returned as digest; otherwise digest is None.
+    """
+    timings = {} if profile else None
+    try:
+        info = get_image_info(Path(path), full_decode, timings, data, hashes)
+        digest = hashlib.new(algorithm, data).hexdigest() if data is not None else None
+        return tuple(info[field] for field in INFO_FIELDS), None, timings, digest
+    except Exception as e:
+        return None, str(e), timings, None
+
+
+def _read_file(path: Path) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class Prefetcher:
+    """
+    Reads whole files ahead of their consumer on a thread pool.
+    
+    Up to concurrency reads run at once, which hides the round-trip latency
+    of network file systems. Files are handed out in input order, and the
+    bytes read ahead but not yet handed out stay within memory_budget (a
+    single larger file is still read, on its own).
+    """
+
+    def __init__(self, concurrency: int, memory_budget: int = PREFETCH_MEMORY):
+        self.concurrency = max(1, concurrency)
+        self.memory_budget = memory_budget
+
+    def read(self, items: Iterable[Tuple[Path, int]]
+             ) -> Iterator[Tuple[Path, Optional[bytes], Optional[str]]]:
+        """Yield (path, data, error) for each (path, expected size) pair."""
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            window: deque = deque()
+            held = 0
+            
+            def take():
+                nonlocal held
+                path, size, future = window.popleft()
+                held -= size
+                try:
+                    return path, future.result(), None
+                except OSError as e:
+                    return path, None, str(e)
+            
+            for path, size in items:
+                while window and (held + size > self.memory_budget
+                                  or len(window) >= 4 * self.concurrency):
+                    yield take()
+                window.append((path, size, executor.submit(_read_file, path)))
+                held += size
+            while window:
+                yield take()
+
+
+def hamming_distance(hash1: int, hash2: int) -> int:
+    """Number of differing bits between two integer hashes."""
+    return bin(hash1 ^ hash2).count('1')
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over integer hashes under the Hamming distance.
+    
+    search() only visits subtrees that the triangle inequality cannot rule
+    out, so a radius query touches a small fraction of the stored hashes.
+    """
+
+    def __init__(self):
+        # Each node is [hash, items, {distance: child node}]
+        self.root: Optional[list] = None
+
+    def add(self, key: int, item):
+        """Insert an item under the given hash."""
+        if self.root is None:
+            self.root = [key, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(key, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, [item], {}]
+                return
+            node = child
+
+    def search(self, key: int, radius: int) -> List:
+        """Return all items whose hash is within radius of key."""
+        found = []
+        if self.root is None or radius < 0:
+            return found
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(key, node[0])
+            if distance <= radius:
+                found.extend(node[1])
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+# Largest aspect ratio difference for two images to be scaled versions
+ASPECT_TOLERANCE = 0.01
+
+
+# Bit flags returned by ImageScanner.compare_batch
+REASON_SIMILAR = 1
+REASON_NOT_SIMILAR = 2
+REASON_ASPECT_RATIO = 4
+REASON_PHASH = 8
+REASON_DHASH = 16
+REASON_COLOR = 32
+
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount64(values: np.ndarray) -> np.ndarray:
+    """Number of set bits in each element of a uint64 array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    shape = np.shape(values)
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(shape + (8,)).sum(axis=-1)
+
+
+class FeatureMatrix:
+    """
+    Columnar copy of image info dicts for vectorized scoring.
+    
+    The four perceptual hashes are packed into an (n, 4) uint64 array in
+    HASH_FIELDS order and the average colors into an (n, 3) uint8 array.
+    Hashes left out with --hashes are zero, as in ImageStore.
+    """
+
+    def __init__(self, infos: List[Dict]):
+        self.hashes = np.array(
+            [[int(info[field], 16) if info[field] is not None else 0 for field in HASH_FIELDS]
+             for info in infos], dtype=np.uint64
+        ).reshape(len(infos), len(HASH_FIELDS))
+        self.avg_color = np.array(
+            [info['avg_color'] for info in infos], dtype=np.uint8
+        ).reshape(len(infos), 3)
+        self.aspect_ratio = np.array([info['aspect_ratio'] for info in infos], dtype=np.float64)
+        self.pixels = np.array([info['pixels'] for info in infos], dtype=np.int64)
+
+    @classmethod
+    def from_arrays(cls, hashes: np.ndarray, avg_color: np.ndarray, aspect_ratio: np.ndarray,
+                    pixels: np.ndarray) -> 'FeatureMatrix':
+        """Build a matrix directly from columns, e.g. records read from a FeatureIndex."""
+        features = cls.__new__(cls)
+        features.hashes = np.ascontiguousarray(hashes, dtype=np.uint64)
+        features.avg_color = np.ascontiguousarray(avg_color, dtype=np.uint8)
+        features.aspect_ratio = np.ascontiguousarray(aspect_ratio, dtype=np.float64)
+        features.pixels = np.ascontiguousarray(pixels, dtype=np.int64)
+        return features
+
+    def __len__(self) -> int:
+        return len(self.pixels)
+
+
+# Per-image record kept by ImageStore (104 bytes). The file name is
+# name_length bytes of UTF-8 at name_offset in the store's name table, and
+# digest is the start of the content hash when it is known (else empty).
+# known has bit k set when HASH_FIELDS[k] was computed and COLOR_KNOWN when
+# avg_color was; fields that are not known are zero. Images only read up to
+# their header have none, hashes left out by --hashes or --cascade are missing.
+# HEADER_KNOWN is set once the dimensions and mode are; rows added with
+# add_file before their header is read only have a path, size and mtime.
+COLOR_KNOWN = 1 << len(HASH_FIELDS)
+HEADER_KNOWN = COLOR_KNOWN << 1
+
+IMAGE_RECORD = np.dtype([
+    ('hashes', '<u8', (len(HASH_FIELDS),)),
+    ('file_size', '<u8'),
+    ('mtime_ns', '<i8'),
+    ('aspect_ratio', '<f8'),
+    ('name_offset', '<u8'),
+    ('width', '<u4'),
+    ('height', '<u4'),
+    ('directory', '<u4'),
+    ('name_length', '<u2'),
+    ('avg_color', 'u1', (3,)),
+    ('mode', 'u1'),
+    ('live', '?'),
+    ('digest', 'S%d' % DIGEST_BYTES),
+    ('known', 'u1'),
+    ('reserved', 'u1', (4,)),
+])
+
+
+class ImageStore:
+    """
+    Columnar store of image info, addressed by integer row.
+    
+    Each image is one IMAGE_RECORD row with the hashes packed as uint64.
+    Paths are split into a directory id and a file name kept in a shared
+    UTF-8 name table, so an image costs the record plus its name's bytes
+    instead of a dict of strings and a Path. Removed rows are only marked
+    dead; rows() lists the live ones in order.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.records = np.zeros(max(1, capacity), dtype=IMAGE_RECORD)
+        self.count = 0
+        self.live = 0
+        self.names = bytearray()
+        self.directories: List[str] = []
+        self._directory_ids: Dict[str, int] = {}
+        self.modes: List[str] = []
+
+    def __len__(self) -> int:
+        return self.live
+
+    def __bool__(self) -> bool:
+        return self.live > 0
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the records and the name table."""
+        return self.count * IMAGE_RECORD.itemsize + len(self.names)
+
+    def _set_path(self, row: int, path: Path):
+        directory = str(path.parent)
+        directory_id = self._directory_ids.get(directory)
+        if directory_id is None:
+            directory_id = self._directory_ids[directory] = len(self.directories)
+            self.directories.append(directory)
+        name = path.name.encode('utf-8', 'surrogateescape')
+        record = self.records[row:row + 1]
+        record['directory'] = directory_id
+        record['name_offset'] = len(self.names)
+        record['name_length'] = len(name)
+        self.names += name
+
+    def append(self, path: Path, info: Dict, mtime_ns: int = 0, digest: Optional[str] = None) -> int:
+        """Add an image, with its hex content hash if known, and return its row."""
+        row = self.add_file(path, info['file_size'], mtime_ns, digest)
+        self.update(row, info)
+        return row
+
+    def add_file(self, path: Path, file_size: int, mtime_ns: int = 0, digest: Optional[str] = None) -> int:
+        """Add an image whose header has not been read yet and return its row; update() fills it in."""
+        if self.count == len(self.records):
+            self.records = np.concatenate([self.records, np.zeros(len(self.records), dtype=IMAGE_RECORD)])
+        row = self.count
+        record = self.records[row:row + 1]
+        record['file_size'] = file_size
+        record['mtime_ns'] = mtime_ns
+        record['live'] = True
+        self.set_digest(row, digest)
+        self._set_path(row, Path(path))
+        self.count += 1
+        self.live += 1
+        return row
+
+    def set_digest(self, row: int, digest: Optional[str]):
+        """Record the image's hex content hash; None leaves it as it is."""
+        if digest:
+            self.records['digest'][row] = bytes.fromhex(digest)[:DIGEST_BYTES]
+
+    def update(self, row: int, info: Dict):
+        """Store the header fields (when info has them), hashes and average color that info has for the image."""
+        record = self.records[row:row + 1]
+        known = int(record['known'][0])
+        if info['width'] is not None:
+            if info['mode'] not in self.modes:
+                self.modes.append(info['mode'])
+            record['width'] = info['width']
+            record['height'] = info['height']
+            record['aspect_ratio'] = info['aspect_ratio']
+            record['mode'] = self.modes.index(info['mode'])
+            known |= HEADER_KNOWN
+        for k, field in enumerate(HASH_FIELDS):
+            if info[field] is not None:
+                record['hashes'][0, k] = int(info[field], 16)
+                known |= 1 << k
+        if info['avg_color'] is not None:
+            record['avg_color'] = info['avg_color']
+            known |= COLOR_KNOWN
+        record['known'] = known
+
+    def rows(self) -> np.ndarray:
+        """Live rows in order."""
+        return np.flatnonzero(self.records['live'][:self.count])
+
+    def path(self, row: int) -> Path:
+        record = self.records[row]
+        offset, length = int(record['name_offset']), int(record['name_length'])
+        name = self.names[offset:offset + length].decode('utf-8', 'surrogateescape')
+        return Path(self.directories[record['directory']]) / name
+
+    def info(self, row: int) -> Dict:
+        """
+        The info dict get_image_info returned for the image, with None for
+        the hashes (and for an image only read up to its header, the average
+        color) that were not computed.
+        """
+        record = self.records[row]
+        width, height = int(record['width']), int(record['height'])
+        info = {
+            'width': width,
+            'height': height,
+            'aspect_ratio': float(record['aspect_ratio']),
+            'mode': self.modes[record['mode']],
+            'file_size': int(record['file_size']),
+        }
+        known = int(record['known'])
+        info.update((field, f"{int(value):016x}" if known >> k & 1 else None)
+                    for k, (field, value) in enumerate(zip(HASH_FIELDS, record['hashes'])))
+        info['avg_color'] = tuple(int(c) for c in record['avg_color']) if known & COLOR_KNOWN else None
+        info['pixels'] = width * height
+        return info
+
+    def items(self) -> Iterator[Tuple[Path, Dict]]:
+        """(path, info) for every live image, in order."""
+        for row in self.rows():
+            yield self.path(row), self.info(row)
+
+    def pixels(self, rows) -> np.ndarray:
+        return self.records['width'][rows].astype(np.int64) * self.records['height'][rows]
+
+    def remove(self, row: int):
+        if self.records['live'][row]:
+            self.records['live'][row] = False
+            self.live -= 1
+
+    def rename(self, row: int, path: Path):
+        self._set_path(row, Path(path))
+
+    def compact(self) -> np.ndarray:
+        """Drop the removed rows, renumbering the others in order; returns the old row of each."""
+        kept = self.rows()
+        self.records[:len(kept)] = self.records[kept]
+        self.records[len(kept):self.count] = np.zeros(1, dtype=IMAGE_RECORD)
+        self.count = len(kept)
+        return kept
+
+    def features(self, rows) -> FeatureMatrix:
+        """FeatureMatrix of the given rows, without going through info dicts."""
+        records = self.records[rows]
+        return FeatureMatrix.from_arrays(records['hashes'], records['avg_color'],
+                                         records['aspect_ratio'], self.pixels(rows))
+
+
+# First bytes of a feature index file
+INDEX_MAGIC = b"IMGIDX\0\1"
+
+# Fixed-width feature index record (88 bytes). hashes are in HASH_FIELDS
+# order, digest is the start of the file's content hash, mode indexes the
+# header's list of image modes and the path is path_length bytes of UTF-8
+# at path_offset in the string table.
+INDEX_RECORD = np.dtype([
+    ('hashes', '<u8', (len(HASH_FIELDS),)),
+    ('file_size', '<u8'),
+    ('aspect_ratio', '<f8'),
+    ('path_offset', '<u8'),
+    ('width', '<u4'),
+    ('height', '<u4'),
+    ('path_length', '<u4'),
+    ('digest', 'S16'),
+    ('avg_color', 'u1', (3,)),
+    ('mode', 'u1'),
+])
+
+# Index of INDEX_RECORD rows sorted by file size, for exact-duplicate lookups
+INDEX_SIZE_ENTRY = np.dtype([('file_size', '<u8'), ('record', '<u8')])
+
+
+class FeatureIndex:
+    """
+    Read-only feature index file, memory-mapped so opening it costs nothing.
+    
+    Layout: INDEX_MAGIC, a little-endian uint32 header length and a JSON
+    header, then (8-byte aligned) the INDEX_RECORD rows sorted by aspect
+    ratio and pixel count, the INDEX_SIZE_ENTRY rows sorted by file size,
+    each record's mtime_ns and the path string table. Lookups bisect the
+    mapped columns, so only the pages they touch are read. Indexes written
+    before mtimes and modes were recorded have neither (mtime_ns is None).
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._map = np.memmap(self.path, dtype=np.uint8, mode='r')
+        if bytes(self._map[:len(INDEX_MAGIC)]) != INDEX_MAGIC:
+            raise ValueError(f"{self.path} is not a feature index")
+        header_length = int(np.frombuffer(self._map, '<u4', 1, len(INDEX_MAGIC))[0])
+        start = len(INDEX_MAGIC) + 4
+        self.header = json.loads(bytes(self._map[start:start + header_length]))
+        if self.header['version'] != self.VERSION:
+            raise ValueError(f"{self.path} has unsupported index version {self.header['version']}")
+        
+        count = self.header['count']
+        self.root = Path(self.header['root'])
+        self.hash_algorithm = self.header['hash_algorithm']
+        self.variant = self.header['variant']
+        self.records = np.frombuffer(self._map, INDEX_RECORD, count, self.header['records_offset'])
+        self.sizes = np.frombuffer(self._map, INDEX_SIZE_ENTRY, count, self.header['sizes_offset'])
+        self.strings = self._map[self.header['strings_offset']:]
+        self.modes = self.header.get('modes', [])
+        self.mtime_ns = (np.frombuffer(self._map, '<i8', count, self.header['mtimes_offset'])
+                         if 'mtimes_offset' in self.header else None)
+        self._aspect_ratio = self.records['aspect_ratio']
+        self._file_size = self.sizes['file_size']
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @staticmethod
+    def digest(hex_digest: str) -> bytes:
+        """
+        The part of a content hash stored in each record, as NumPy reads it
+        back (fixed-width bytes fields drop trailing NUL bytes).
+        """
+        return bytes.fromhex(hex_digest)[:INDEX_RECORD['digest'].itemsize].rstrip(b"\0")
+
+    def name(self, record: int) -> str:
+        """Path of an indexed image as stored: relative to the index root when it was under it."""
+        offset = int(self.records['path_offset'][record])
+        length = int(self.records['path_length'][record])
+        return bytes(self.strings[offset:offset + length]).decode('utf-8', 'surrogateescape')
+
+    def path_of(self, record: int) -> Path:
+        """Path of an indexed image; relative paths are resolved against the index root."""
+        return self.root / self.name(record)
+
+    def info(self, record: int) -> Dict:
+        """The image info dict of an indexed image, as get_image_info would return it."""
+        row = self.records[record]
+        width, height = int(row['width']), int(row['height'])
+        info = {field: f"{int(value):016x}" for field, value in zip(HASH_FIELDS, row['hashes'])}
+        info.update(width=width, height=height, aspect_ratio=float(row['aspect_ratio']),
+                    mode=self.modes[row['mode']] if self.modes else None,
+                    file_size=int(row['file_size']), avg_color=tuple(int(c) for c in row['avg_color']),
+                    pixels=width * height)
+        return info
+
+    def same_size(self, file_size: int) -> List[int]:
+        """Records of files with exactly this size."""
+        lo = bisect_left(self._file_size, file_size)
+        hi = bisect_right(self._file_size, file_size, lo)
+        return [int(record) for record in self.sizes['record'][lo:hi]]
+
+    def candidates(self, aspect_ratio: float, phash: int, radius: int) -> np.ndarray:
+        """Records within ASPECT_TOLERANCE of aspect_ratio whose pHash is within radius of phash."""
+        lo = bisect_left(self._aspect_ratio, aspect_ratio - ASPECT_TOLERANCE - 1e-9)
+        hi = bisect_right(self._aspect_ratio, aspect_ratio + ASPECT_TOLERANCE + 1e-9, lo)
+        if lo == hi:
+            return np.empty(0, dtype=np.int64)
+        block = self.records[lo:hi]
+        keep = ((np.abs(block['aspect_ratio'] - aspect_ratio) <= ASPECT_TOLERANCE)
+                & (popcount64(block['hashes'][:, 0] ^ np.uint64(phash)) <= radius))
+        return lo + np.flatnonzero(keep)
+
+    def features(self, records: np.ndarray) -> FeatureMatrix:
+        rows = self.records[records]
+        return FeatureMatrix.from_arrays(
+            rows['hashes'], rows['avg_color'], rows['aspect_ratio'],
+            rows['width'].astype(np.int64) * rows['height']
+        )
+
+    @classmethod
+    def write(cls, path: Path, root: Path, entries: Iterable[Tuple[Path, Dict, str, int]],
+              hash_algorithm: str, variant: str, extra: Optional[Dict] = None) -> int:
+        """
+        Write an index of (path, info, hex content digest, mtime_ns) entries atomically.
+        
+        Paths under root are stored relative to it, and extra is added to
+        the header. Returns the number of records.
+        """
+        entries = sorted(entries, key=lambda entry: (entry[1]['aspect_ratio'], entry[1]['pixels'], str(entry[0])))
+        records = np.zeros(len(entries), dtype=INDEX_RECORD)
+        mtimes = np.zeros(len(entries), dtype='<i8')
+        strings = bytearray()
+        modes: List[str] = []
+        for k, (img_path, info, hex_digest, mtime_ns) in enumerate(entries):
+            try:
+                name = str(Path(img_path).relative_to(root))
+            except ValueError:
+                name = str(img_path)
+            encoded = name.encode('utf-8', 'surrogateescape')
+            if info['mode'] not in modes:
+                modes.append(info['mode'])
+            records[k] = (
+                [int(info[field], 16) for field in HASH_FIELDS], info['file_size'], info['aspect_ratio'],
+                len(strings), info['width'], info['height'], len(encoded), cls.digest(hex_digest),
+                info['avg_color'], modes.index(info['mode']),
+            )
+            mtimes[k] = mtime_ns
+            strings += encoded
+        
+        sizes = np.zeros(len(entries), dtype=INDEX_SIZE_ENTRY)
+        order = np.argsort(records['file_size'], kind='stable')
+        sizes['file_size'] = records['file_size'][order]
+        sizes['record'] = order
+        
+        def align(offset: int) -> int:
+            return (offset + 7) & ~7
+        
+        header = {'version': cls.VERSION, 'count': len(entries), 'root': str(root),
+                  'hash_algorithm': hash_algorithm, 'variant': variant, 'modes': modes,
+                  'created': datetime.now().isoformat(timespec='seconds')}
+        header.update(extra or {})
+        # Offsets depend on the header length, so size the header with placeholders first
+        for key in ('records_offset', 'sizes_offset', 'mtimes_offset', 'strings_offset'):
+            header[key] = 0
+        for _ in range(2):
+            header_bytes = json.dumps(header).encode('utf-8')
+            header['records_offset'] = align(len(INDEX_MAGIC) + 4 + len(header_bytes) + 32)
+            header['sizes_offset'] = align(header['records_offset'] + records.nbytes)
+            header['mtimes_offset'] = align(header['sizes_offset'] + sizes.nbytes)
+            header['strings_offset'] = align(header['mtimes_offset'] + mtimes.nbytes)
+        header_bytes = json.dumps(header).encode('utf-8')
+        
+        tmp_path = Path(str(path) + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(INDEX_MAGIC)
+            f.write(struct.pack('<I', len(header_bytes)))
+            f.write(header_bytes)
+            for offset, data in ((header['records_offset'], records.tobytes()),
+                                 (header['sizes_offset'], sizes.tobytes()),
+                                 (header['mtimes_offset'], mtimes.tobytes()),
+                                 (header['strings_offset'], bytes(strings))):
+                f.write(b"\0" * (offset - f.tell()))
+                f.write(data)
+        os.replace(tmp_path, path)
+        return len(entries)
+
+
+def shard_of(relative_path: Path, count: int) -> int:
+    """
+    Shard (0 to count - 1) of a file, from a CRC-32 of its path relative to
+    the scanned directory, so every host assigns files to the same shards.
+    """
+    return zlib.crc32(relative_path.as_posix().encode('utf-8', 'surrogateescape')) % count
+
+
+def open_shards(paths: Sequence[Path]) -> List[FeatureIndex]:
+    """
+    Open the shard files written by --shard for merging, in shard order.
+    
+    Raises:
+        ValueError: If a file is not a shard file, shards are missing or
+            repeated, or they were made with different settings
+    """
+    shards = [FeatureIndex(path) for path in paths]
+    for shard in shards:
+        if 'shard' not in shard.header:
+            raise ValueError(f"{shard.path} is a feature index, not a shard file (see --shard)")
+    shards.sort(key=lambda shard: shard.header['shard'])
+    
+    count = shards[0].header['shard'][1]
+    numbers = [shard.header['shard'][0] for shard in shards]
+    if any(shard.header['shard'][1] != count for shard in shards):
+        raise ValueError("the shard files split the directory into different numbers of shards")
+    if len(set(numbers)) != len(numbers):
+        raise ValueError(f"shard {next(n for n in numbers if numbers.count(n) > 1)}/{count} is given more than once")
+    missing = [f"{n}/{count}" for n in range(1, count + 1) if n not in numbers]
+    if missing:
+        raise ValueError(f"missing shard {', '.join(missing)}")
+    for key in ('hash_algorithm', 'variant', 'recursive', 'extensions'):
+        if any(shard.header[key] != shards[0].header[key] for shard in shards):
+            raise ValueError(f"the shards were made with different settings ({key})")
+    return shards
+
+
+class AspectRatioIndex:
+    """
+    Candidate index that buckets images by aspect ratio.
+    
+    Buckets are ASPECT_TOLERANCE wide, so every image whose aspect ratio is
+    within tolerance of another lies in the same or a neighbouring bucket.
+    Members of each bucket are sorted by pixel count, which lets partners()
+    skip same-sized images with a bisect, and each bucket keeps a BK-tree
+    over pHash for radius searches.
+    """
+
+    def __init__(self, aspect_ratios: Sequence[float], pixels: Sequence[int],
+                 phashes: Optional[Sequence[int]] = None):
+        self.aspect_ratios = list(aspect_ratios)
+        self.pixels = list(pixels)
+        self.buckets: Dict[int, List[Tuple[int, int]]] = {}
+        self.trees: Dict[int, BKTree] = {}
+        for idx, aspect_ratio in enumerate(self.aspect_ratios):
+            self.buckets.setdefault(self._key(aspect_ratio), []).append((self.pixels[idx], idx))
+            if phashes is not None:
+                self.trees.setdefault(self._key(aspect_ratio), BKTree()).add(phashes[idx], idx)
+        for members in self.buckets.values():
+            members.sort()
+
+    def add(self, aspect_ratio: float, pixels: int, phash: Optional[int] = None) -> int:
+        """Insert one more image and return its index."""
+        idx = len(self.pixels)
+        self.aspect_ratios.append(aspect_ratio)
+        self.pixels.append(pixels)
+        insort(self.buckets.setdefault(self._key(aspect_ratio), []), (pixels, idx))
+        if phash is not None:
+            self.trees.setdefault(self._key(aspect_ratio), BKTree()).add(phash, idx)
+        return idx
+
+    @staticmethod
+    def _key(aspect_ratio: float) -> int:
+        # Aspect ratios are rounded to 3 decimals, so work in exact thousandths
+        return round(aspect_ratio * 1000) // round(ASPECT_TOLERANCE * 1000)
+
+    def _compatible(self, i: int, j: int) -> bool:
+        """Same test compare_images applies, plus the different-size requirement."""
+        return (abs(self.aspect_ratios[i] - self.aspect_ratios[j]) <= ASPECT_TOLERANCE
+                and self.pixels[i] != self.pixels[j])
+
+    def partners(self, i: int) -> Iterator[int]:
+        """Yield every image with a compatible aspect ratio and a different pixel count."""
+        key = self._key(self.aspect_ratios[i])
+        pixels = self.pixels[i]
+        for bucket in (key - 1, key, key + 1):
+            members = self.buckets.get(bucket, [])
+            lo = bisect_left(members, (pixels, -1))
+            hi = bisect_right(members, (pixels, len(self.pixels)))
+            for _, j in chain(members[:lo], members[hi:]):
+                if self._compatible(i, j):
+                    yield j
+
+    def has_partner(self, i: int) -> bool:
+        """True if any other image could be a scaled version of image i."""
+        return next(self.partners(i), None) is not None
+
+    def search(self, i: int, phash: int, radius: int) -> List[int]:
+        """Compatible, differently sized images whose pHash is within radius of phash."""
+        key = self._key(self.aspect_ratios[i])
+        found = []
+        for bucket in (key - 1, key, key + 1):
+            tree = self.trees.get(bucket)
+            if tree is not None:
+                found.extend(j for j in tree.search(phash, radius) if self._compatible(i, j))
+        return found
+
+
+def have_partners(aspect_ratios: np.ndarray, pixels: np.ndarray) -> np.ndarray:
+    """
+    AspectRatioIndex.has_partner for every image at once, on arrays: True
+    where another image has a compatible aspect ratio and a different pixel
+    count. Needs a few bytes per image instead of Python objects.
+    """
+    order = np.lexsort((pixels, aspect_ratios))
+    ratios, sizes = aspect_ratios[order], pixels[order]
+    # Compatible images form a window of the sorted ratios; find its exact
+    # edges with the same comparison as compare_images
+    lo = np.searchsorted(ratios, ratios - ASPECT_TOLERANCE - 1e-9, 'left')
+    while True:
+        outside = np.abs(ratios - ratios[lo]) > ASPECT_TOLERANCE
+        if not outside.any():
+            break
+        lo[outside] = np.searchsorted(ratios, ratios[lo[outside]], 'right')
+    hi = np.searchsorted(ratios, ratios + ASPECT_TOLERANCE + 1e-9, 'right')
+    while True:
+        outside = np.abs(ratios[hi - 1] - ratios) > ASPECT_TOLERANCE
+        if not outside.any():
+            break
+        hi[outside] = np.searchsorted(ratios, ratios[hi[outside] - 1], 'left')
+    # A window has a partner unless all its pixel counts are equal
+    changes = np.concatenate([[0], np.cumsum(sizes[1:] != sizes[:-1])])
+    partnered = np.empty(len(order), dtype=bool)
+    partnered[order] = changes[hi - 1] > changes[lo]
+    return partnered
+
+
+class UnionFind:
+    """Disjoint-set forest with path halving and union by size."""
+
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+        self.size = [1] * size
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a: int, b: int):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+
+class FileOperationPlan:
+    """
+    Moves and renames collected before anything touches the disk.
+    
+    Name conflicts are resolved in memory against one listing per directory
+    plus the names already claimed by the plan, using the same "_N" suffix
+    scheme as before. A file that is renamed and later moved is moved
+    straight from its original path.
+    """
+
+    def __init__(self, discarded_dir: Path):
+        self.discarded_dir = discarded_dir
+        self.ops: Dict[Path, Dict] = {}
+        self._planned: Dict[Path, Path] = {}
+        self._listings: Dict[Path, Set[str]] = {}
+
+    def _names(self, directory: Path) -> Set[str]:
+        """Names present in (or claimed for) a directory; listed once per run."""
+        if directory not in self._listings:
+            try:
+                self._listings[directory] = set(os.listdir(directory))
+            except FileNotFoundError:
+                self._listings[directory] = set()
+        return self._listings[directory]
+
+    def _original(self, path: Path) -> Path:
+        return self._planned.get(path, path)
+
+    def source(self, path: Path) -> Path:
+        """Where the file planned to end up at path is until the plan is applied."""
+        return self._original(path)
+
+    def _unclaim(self, original: Path):
+        op = self.ops.pop(original, None)
+        if op is not None:
+            self._names(op['dest'].parent).discard(op['dest'].name)
+            del self._planned[op['dest']]
+
+    def move_to_discarded(self, path: Path, reason: str, **details) -> Path:
+        """Plan a move into the discarded directory and return the destination."""
+        original = self._original(path)
+        self._unclaim(original)
+        
+        names = self._names(self.discarded_dir)
+        dest = self.discarded_dir / original.name
+        if dest.name in names:
+            counter = 1
+            while dest.name in names:
+                dest = self.discarded_dir / f"{original.stem}_{counter}{original.suffix}"
+                counter += 1
+        names.add(dest.name)
+        
+        self.ops[original] = dict(details, op='move', source=original, dest=dest, reason=reason)
+        self._planned[dest] = original
+        return dest
+
+    def rename_with_dimensions(self, path: Path, width: int, height: int) -> Path:
+        """Plan a rename that adds the dimensions to the name and return the new path."""
+        original = self._original(path)
+        
+        # Remove existing dimension suffix if present (e.g., "-1200x800")
+        base = re.sub(r'-\d+x\d+$', '', original.stem)
+        ext = original.suffix
+        new_path = original.parent / f"{base}-{width}x{height}{ext}"
+        if new_path == original:
+            return path
+        if original in self.ops:
+            if self.ops[original]['dest'].name.startswith(f"{base}-{width}x{height}"):
+                return path
+            self._unclaim(original)
+        
+        names = self._names(original.parent)
+        if new_path.name in names:
+            counter = 1
+            while new_path.name in names:
+                new_path = original.parent / f"{base}-{width}x{height}_{counter}{ext}"
+                counter += 1
+        names.add(new_path.name)
+        
+        self.ops[original] = {'op': 'rename', 'source': original, 'dest': new_path,
+                              'width': width, 'height': height}
+        self._planned[new_path] = original
+        return new_path
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self.ops.values())
+
+    def to_records(self) -> List[Dict]:
+        """The planned operations as JSON-serializable dicts, in plan order."""
+        return [{key: str(value) if isinstance(value, Path) else value for key, value in op.items()}
+                for op in self.ops.values()]
+
+    def restore(self, records: List[Dict]):
+        """Replace the plan with operations previously returned by to_records()."""
+        self.ops.clear()
+        self._planned.clear()
+        for record in records:
+            op = dict(record)
+            for key in ('source', 'dest', 'keeper'):
+                if key in op:
+                    op[key] = Path(op[key])
+            self.ops[op['source']] = op
+            self._planned[op['dest']] = op['source']
+
+
+class ScanState:
+    """
+    Checkpoints of an interrupted scan, kept in a JSON file in the scanned directory.
+    
+    Paths are stored resolved and the settings include the resolved scanned
+    directory, so a scan can be resumed from anywhere under any spelling of
+    its directory.
+    
+    Each save writes a temporary file, fsyncs it and renames it over the
+    previous state, so the file on disk is always a complete checkpoint.
+    A saved state is only used again by a scan with the same settings.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path: Path, settings: Dict):
+        self.path = path
+        self.settings = settings
+        self.data: Dict = {}
+        self._interval = CHECKPOINT_INTERVAL
+        self._last_save = time.monotonic()
+
+    def load(self) -> Optional[Dict]:
+        """Return the saved state, or None if there is none usable for these settings."""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != self.VERSION or data.get('settings') != self.settings:
+            return None
+        self.data = data
+        return data
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def due(self) -> bool:
+        """True when enough time has passed since the last save for another checkpoint."""
+        return time.monotonic() - self._last_save >= self._interval
+
+    def save(self, phase: str, **fields):
+        """Atomically write a checkpoint of the given phase, merged with earlier fields."""
+        started = time.monotonic()
+        self.data.update(fields, version=self.VERSION, settings=self.settings, phase=phase)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._last_save = time.monotonic()
+        self._interval = max(CHECKPOINT_INTERVAL, 10 * (self._last_save - started))
+
+    def clear(self):
+        """Remove the state file once the scan has finished."""
+        self.data = {}
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def encode_images(store: 'ImageStore') -> List[List]:
+        """The live images of a store whose header was read, as compact [path, size, mtime_ns, *INFO_FIELDS] rows."""
+        rows = []
+        live = store.rows()
+        for row in live[store.records['known'][live] & HEADER_KNOWN != 0]:
+            info = store.info(row)
+            values = [list(info[field]) if field == 'avg_color' and info[field] else info[field]
+                      for field in INFO_FIELDS]
+            rows.append([str(store.path(row)), info['file_size'], int(store.records['mtime_ns'][row])] + values)
+        return rows
+
+    @staticmethod
+    def decode_images(rows: List[List]) -> Dict[Path, Tuple[Optional[int], Optional[int], Dict]]:
+        """Inverse of encode_images: path -> (size, mtime_ns, info)."""
+        images = {}
+        for row in rows:
+            info = dict(zip(INFO_FIELDS, row[3:]))
+            if info['avg_color'] is not None:
+                info['avg_color'] = tuple(info['avg_color'])
+            images[Path(row[0])] = (row[1], row[2], info)
+        return images
+
+
+class HashCache:
+    """
+    Persistent SQLite cache of get_image_info results.
+
+    Entries are keyed by (inode, size, mtime_ns), so a file that is renamed
+    (for example by rename_with_dimensions) keeps its cached hashes, while any
+    change to its contents invalidates them. The variant separates entries
+    produced by different extraction settings.
+    """
+
+    # Bump whenever the layout of the info dict changes
+    VERSION = 3
+
+    def __init__(self, db_path: Path, variant: str = ""):
+        self.db_path = db_path
+        self.variant = variant
+        self.hits = 0
+        self.misses = 0
+        self._seen: Set[Tuple[int, int, int]] = set()
+        self._pending = 0
+
+        self.conn = sqlite3.connect(str(db_path))
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS images")
+            self.conn.execute(f"PRAGMA user_version = {self.VERSION}")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                variant TEXT NOT NULL,
+                path TEXT NOT NULL,
+                info TEXT NOT NULL,
+                PRIMARY KEY (inode, size, mtime_ns, variant)
+            )
+        """)
+        self.conn.commit()
+
+    @staticmethod
+    def key(st: os.stat_result) -> Tuple[int, int, int]:
+        """The (inode, size, mtime_ns) key of a file's entry."""
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    @staticmethod
+    def _path_text(filepath: Path) -> str:
+        """The path as storable text; bytes of non-UTF-8 names are escaped (the column is informational)."""
+        return str(filepath).encode('utf-8', 'surrogateescape').decode('utf-8', 'backslashreplace')
+
+    def get(self, filepath: Path, key: Tuple[int, int, int]) -> Optional[Dict]:
+        """Return the cached info for a file with this key(), or None if it is missing or stale."""
+        self._seen.add(key)
+        row = self.conn.execute(
+            "SELECT path, info FROM images WHERE inode = ? AND size = ? AND mtime_ns = ? AND variant = ?",
+            key + (self.variant,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        path_text = self._path_text(filepath)
+        if row[0] != path_text:
+            self.conn.execute(
+                "UPDATE images SET path = ? WHERE inode = ? AND size = ? AND mtime_ns = ? AND variant = ?",
+                (path_text,) + key + (self.variant,)
+            )
+        info = json.loads(row[1])
+        info['avg_color'] = tuple(info['avg_color'])
+        return info
+
+    def put(self, filepath: Path, key: Tuple[int, int, int], info: Dict):
+        """Store freshly computed info for a file with this key()."""
+        self._seen.add(key)
+        record = dict(info, avg_color=[int(c) for c in info['avg_color']])
+        self.conn.execute(
+            "INSERT OR REPLACE INTO images (inode, size, mtime_ns, variant, path, info) VALUES (?, ?, ?, ?, ?, ?)",
+            key + (self.variant, self._path_text(filepath), json.dumps(record))
+        )
+        self._pending += 1
+        if self._pending >= 1000:
+            self.conn.commit()
+            self._pending = 0
+
+    def prune(self) -> int:
+        """Drop entries for files that were not seen during this run. Returns the number removed."""
+        stale = [key for key in self.conn.execute("SELECT DISTINCT inode, size, mtime_ns FROM images")
+                 if key not in self._seen]
+        self.conn.executemany(
+            "DELETE FROM images WHERE inode = ? AND size = ? AND mtime_ns = ?", stale
+        )
+        self.conn.commit()
+        return len(stale)
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+class Profiler:
+    """
+    Per-phase wall time, CPU time, throughput and latency instrumentation.
+    
+    CPU time includes finished child processes (the --workers pool), and
+    per-item latencies are kept so percentiles can be reported.
+    """
+
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self):
+        self.phases: Dict[str, Dict] = {}
+        self.started = time.perf_counter()
+
+    def _phase(self, name: str) -> Dict:
+        if name not in self.phases:
+            self.phases[name] = {'wall': 0.0, 'cpu': 0.0, 'items': 0, 'bytes': 0,
+                                 'latencies': array('d')}
+        return self.phases[name]
+
+    @staticmethod
+    def _cpu_time() -> float:
+        cpu = time.process_time()
+        if resource is not None:
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            cpu += children.ru_utime + children.ru_stime
+        return cpu
+
+    @contextmanager
+    def phase(self, name: str, items: int = 0, nbytes: int = 0):
+        """Time a block of work and attribute it to a phase."""
+        wall, cpu = time.perf_counter(), self._cpu_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, self._cpu_time() - cpu, items, nbytes)
+
+    def add(self, name: str, wall: float, cpu: float = 0.0, items: int = 0, nbytes: int = 0):
+        """Add already-measured time and counts to a phase."""
+        phase = self._phase(name)
+        phase['wall'] += wall
+        phase['cpu'] += cpu
+        phase['items'] += items
+        phase['bytes'] += nbytes
+
+    def sample(self, name: str, seconds: float, nbytes: int = 0):
+        """Record one item of a phase that took the given time."""
+        phase = self._phase(name)
+        phase['wall'] += seconds
+        phase['items'] += 1
+        phase['bytes'] += nbytes
+        phase['latencies'].append(seconds)
+
+    def timed(self, name: str, iterable: Iterable) -> Iterator:
+        """Yield from iterable, charging the time spent producing each item to a phase."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, time.perf_counter() - start)
+                return
+            self.add(name, time.perf_counter() - start, items=1)
+            yield item
+
+    @staticmethod
+    def peak_rss_mb() -> Dict[str, float]:
+        """Peak resident set size of this process and of its largest child, in MB."""
+        if resource is None:
+            return {}
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+        return {
+            'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+        }
+
+    def report(self) -> Dict:
+        """Machine-readable summary of all phases."""
+        phases = {}
+        for name, phase in self.phases.items():
+            entry = {
+                'wall_s': round(phase['wall'], 6),
+                'cpu_s': round(phase['cpu'], 6),
+                'items': phase['items'],
+                'bytes': phase['bytes'],
+                'items_per_s': round(phase['items'] / phase['wall'], 2) if phase['wall'] else None,
+                'bytes_per_s': round(phase['bytes'] / phase['wall'], 2) if phase['wall'] else None,
+            }
+            latencies = sorted(phase['latencies'])
+            if latencies:
+                for pct in self.PERCENTILES:
+                    index = min(len(latencies) - 1, int(len(latencies) * pct / 100))
+                    entry[f'p{pct}_ms'] = round(latencies[index] * 1000, 3)
+            phases[name] = entry
+        return {
+            'total_wall_s': round(time.perf_counter() - self.started, 6),
+            'peak_rss_mb': self.peak_rss_mb(),
+            'phases': phases,
+        }
+
+    def format_table(self) -> str:
+        """Human-readable summary table."""
+        report = self.report()
+        header = f"{'Phase':<32}{'Wall s':>10}{'CPU s':>10}{'Items':>9}{'Items/s':>10}{'MB/s':>9}" + \
+                 "".join(f"{f'p{pct} ms':>10}" for pct in self.PERCENTILES)
+        lines = [header, "-" * len(header)]
+        for name, entry in report['phases'].items():
+            rate = f"{entry['items_per_s']:.1f}" if entry['items'] and entry['items_per_s'] else "-"
+            mbps = f"{entry['bytes_per_s'] / 1e6:.1f}" if entry['bytes'] and entry['bytes_per_s'] else "-"
+            line = f"{name:<32}{entry['wall_s']:>10.3f}{entry['cpu_s']:>10.3f}{entry['items']:>9}{rate:>10}{mbps:>9}"
+            line += "".join(f"{entry[f'p{pct}_ms']:>10.2f}" if f'p{pct}_ms' in entry else f"{'-':>10}"
+                            for pct in self.PERCENTILES)
+            lines.append(line)
+        lines.append("-" * len(header))
+        lines.append(f"Total wall time: {report['total_wall_s']:.3f} s")
+        rss = report['peak_rss_mb']
+        if rss:
+            lines.append(f"Peak RSS: {rss['self']:.1f} MB (largest worker: {rss['children']:.1f} MB)")
+        return "\n".join(lines)
+
+
+class WatchIndex:
+    """
+    In-memory index of the images in a watched directory.
+    
+    Image info lives in an ImageStore whose rows double as index entries.
+    Images are added, renamed and removed one at a time; removed rows stay
+    in the underlying AspectRatioIndex, which cannot delete, and are
+    filtered out of results. Full content hashes are computed on first use
+    and kept.
+    """
+
+    def __init__(self):
+        self.store = ImageStore()
+        self.by_path: Dict[Path, int] = {}
+        self.by_size: Dict[int, List[int]] = {}
+        self.file_hashes: Dict[int, str] = {}
+        self.candidates = AspectRatioIndex([], [], [])
+
+    def __len__(self) -> int:
+        return len(self.by_path)
+
+    def __contains__(self, path: Path) -> bool:
+        return path in self.by_path
+
+    def path(self, idx: int) -> Path:
+        return self.store.path(idx)
+
+    def info(self, idx: int) -> Dict:
+        return self.store.info(idx)
+
+    def snapshot(self) -> Dict[Path, Tuple[int, int]]:
+        """{path: (size, mtime_ns)} of every live image."""
+        records = self.store.records
+        return {path: (int(records['file_size'][idx]), int(records['mtime_ns'][idx]))
+                for path, idx in self.by_path.items()}
+
+    def unchanged(self, path: Path, st: os.stat_result) -> bool:
+        """True if path is indexed with the same size and modification time."""
+        idx = self.by_path.get(path)
+        records = self.store.records
+        return (idx is not None and records['file_size'][idx] == st.st_size
+                and records['mtime_ns'][idx] == st.st_mtime_ns)
+
+    def add(self, path: Path, info: Dict, st: os.stat_result) -> int:
+        """Index an image, replacing any earlier entry for the same path."""
+        self.remove(path)
+        idx = self.store.append(path, info, st.st_mtime_ns)
+        self.candidates.add(info['aspect_ratio'], info['pixels'], int(info['phash'], 16))
+        self.by_path[path] = idx
+        self.by_size.setdefault(info['file_size'], []).append(idx)
+        return idx
+
+    def remove(self, path: Path):
+        idx = self.by_path.pop(path, None)
+        if idx is not None:
+            self.store.remove(idx)
+            self.by_size[int(self.store.records['file_size'][idx])].remove(idx)
+
+    def rename(self, old: Path, new: Path):
+        idx = self.by_path.pop(old, None)
+        if idx is not None:
+            self.store.rename(idx, new)
+            self.by_path[new] = idx
+
+    def same_size(self, idx: int) -> List[int]:
+        """Other live images with exactly the same file size."""
+        return [j for j in self.by_size.get(int(self.store.records['file_size'][idx]), []) if j != idx]
+
+    def file_hash(self, idx: int, hash_func) -> str:
+        if idx not in self.file_hashes:
+            self.file_hashes[idx] = hash_func(self.store.path(idx))
+        return self.file_hashes[idx]
+
+    def similar_candidates(self, idx: int, radius: int) -> List[int]:
+        """Live images that may be scaled versions of image idx."""
+        phash = int(self.store.records['hashes'][idx, 0])
+        return [j for j in self.candidates.search(idx, phash, radius) if self.store.records['live'][j]]
+
+
+class InotifyWatcher:
+    """
+    Directory change notifications from Linux inotify, called through ctypes.
+    
+    read() returns ('changed', path) once a file has been written and closed
+    or moved in, and ('removed', path) when it is deleted or moved out. New
+    subdirectories are reported as ('directory', path) and watched too.
+    """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories: Dict[int, Path] = {}
+
+    def add(self, directory: Path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"cannot watch {directory}")
+        self.directories[wd] = directory
+
+    def read(self, timeout: float) -> List[Tuple[str, Optional[Path]]]:
+        """Wait up to timeout seconds for events; ('overflow', None) means events were lost."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                events.append(("overflow", None))
+                continue
+            directory = self.directories.get(wd)
+            if directory is None or not name:
+                continue
+            path = directory / os.fsdecode(name)
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    events.append(("directory", path))
+            elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                events.append(("changed", path))
+            elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                events.append(("removed", path))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class RunLogger:
+    """
+    Buffered writer for the run log and an optional JSON Lines action log.
+    
+    Files are opened on first use and kept open; buffered lines are flushed
+    at most every flush_interval seconds, on flush()/close() and at exit.
+    """
+
+    def __init__(self, log_file: Path, jsonl_file: Optional[Path] = None,
+                 flush_interval: float = 2.0):
+        self.log_file = log_file
+        self.jsonl_file = jsonl_file
+        self.flush_interval = flush_interval
+        self._log = None
+        self._jsonl = None
+        self._last_flush = time.monotonic()
+        atexit.register(self.close)
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def write(self, message: str):
+        """Append a timestamped line to the text log."""
+        if self._log is None:
+            self._log = open(self.log_file, 'a', buffering=LOG_BUFFER_SIZE, errors='backslashreplace')
+        self._log.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {message}\n")
+        self._maybe_flush()
+
+    def record(self, action: str, **fields):
+        """Append a structured record (move, rename, skip, error, ...) to the JSON Lines log."""
+        if self.jsonl_file is None:
+            return
+        if self._jsonl is None:
+            self._jsonl = open(self.jsonl_file, 'a', buffering=LOG_BUFFER_SIZE)
+        entry = {'time': datetime.now().isoformat(timespec='seconds'), 'action': action}
+        entry.update(fields)
+        self._jsonl.write(json.dumps(entry, default=str) + "\n")
+        self._maybe_flush()
+
+    def flush(self):
+        for f in (self._log, self._jsonl):
+            if f is not None:
+                f.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        for f in (self._log, self._jsonl):
+            if f is not None:
+                f.close()
+        self._log = self._jsonl = None
+
+
 class ImageScanner:
     def __init__(self, directory: str, threshold: int = 10, dry_run: bool = False, 
-                 interactive: bool = False):
+                 interactive: bool = False, use_cache: bool = True, workers: int = 1,
+                 full_decode: bool = False, hash_algorithm: str = 'md5',
+                 recursive: bool = False, extra_extensions: Iterable[str] = (),
+                 json_log: bool = False, profile: bool = False, io_threads: int = 1,
+                 resume: bool = False, against: Optional[Path] = None, prefetch: int = 0,
+                 prefetch_memory: int = PREFETCH_MEMORY, hashes: Sequence[str] = HASH_FIELDS,
+                 cascade: bool = False, shard: Optional[Tuple[int, int]] = None,
+                 shards: Optional[Sequence[Path]] = None, work_dir: Optional[Path] = None):
         """
         Initialize the image scanner.
         
@@ -42,16 +1629,89 @@ class ImageScanner:
             threshold: Similarity threshold for perceptual hashing (lower = more similar)
             dry_run: If True, only show what would be done without moving files
             interactive: If True, ask for confirmation before moving scaled versions
+            use_cache: If True, reuse hashes from the on-disk cache in the scanned directory
+            workers: Number of processes used to analyze images (1 = in-process)
+            full_decode: If True, hash images at full resolution instead of a reduced working size
+            hash_algorithm: hashlib algorithm used to confirm exact duplicates
+            recursive: If True, also scan subdirectories
+            extra_extensions: Additional file extensions to treat as images (e.g. '.webp')
+            json_log: If True, also write a JSON Lines record for every action
+            profile: If True, collect per-phase timing and throughput statistics
+            io_threads: Number of threads used to apply the planned moves and renames
+            resume: If True, continue from the checkpoint of an interrupted scan with the same settings
+            against: Feature index (see image_index.py) of a reference archive; images that are
+                copies or smaller versions of an indexed image are discarded too
+            prefetch: Number of files read ahead concurrently (0 = read each file when it is analyzed)
+            prefetch_memory: Most bytes of read-ahead file data held in memory at once
+            hashes: Perceptual hashes to compute; must include GATE_HASHES, the others
+                only refine the confidence score
+            cascade: If True, compute the expensive hashes only for images that can still
+                pair up (see analyze_images)
+            shard: (i, N) to extract the features of the i-th of N shards of the
+                directory with write_shard (i counts from 1)
+            shards: Shard files to merge; scan_for_duplicates then reads the images'
+                features from them instead of analyzing the images
+            work_dir: Directory for the run log, journal, checkpoint and hash cache
+                (default: the scanned directory)
         """
-        self.directory = Path(directory)
+        # Resolved, so the journal and checkpoints hold paths that work from any directory
+        self.directory = Path(directory).resolve()
+        self.work_dir = Path(work_dir) if work_dir else self.directory
         self.discarded_dir = self.directory / "discarded"
         self.threshold = threshold
         self.dry_run = dry_run
         self.interactive = interactive
         self.image_extensions = {'.png', '.jpg', '.jpeg', '.PNG', '.JPG', '.JPEG'}
+        self.image_extensions.update(
+            ext if ext.startswith('.') else f'.{ext}' for ext in extra_extensions
+        )
+        self.heif = any(ext.lower() in HEIF_EXTENSIONS for ext in self.image_extensions)
+        self.recursive = recursive
+        self.use_cache = use_cache
+        self.shard = shard
+        self.shards = [Path(path) for path in shards] if shards else None
+        # Shards run concurrently, so each keeps its own cache, checkpoint and log
+        suffix = f"_shard_{shard[0]}_of_{shard[1]}" if shard else ""
+        self.cache_file = self.work_dir / f".image_scan_cache{suffix}.sqlite"
+        self.workers = max(1, workers)
+        self.full_decode = full_decode
+        self.hash_algorithm = hash_algorithm
+        self.io_threads = max(1, io_threads)
+        self.plan = FileOperationPlan(self.discarded_dir)
+        self.resume = resume
+        # Set when the user answers q in interactive mode: nothing more is planned
+        self.quit_requested = False
+        self.against = Path(against) if against else None
+        self.prefetch = max(0, prefetch)
+        self.prefetch_memory = prefetch_memory
+        self.hashes = tuple(field for field in HASH_FIELDS if field in hashes)
+        missing = [field for field in GATE_HASHES if field not in self.hashes]
+        if missing:
+            raise ValueError(f"hashes must include {', '.join(missing)}")
+        self.cascade = cascade
+        # Confidence weights, renormalized over the selected hashes in compare_batch
+        self.hash_weights = tuple(weight if field in self.hashes else 0.0
+                                  for field, weight in zip(HASH_FIELDS, HASH_WEIGHTS))
+        self.state = ScanState(self.work_dir / f".image_scan_state{suffix}.json", {
+            'directory': str(self.directory),
+            'threshold': threshold,
+            'full_decode': full_decode,
+            'hash_algorithm': hash_algorithm,
+            'recursive': recursive,
+            'extensions': sorted(self.image_extensions),
+            'against': str(self.against) if self.against else None,
+            'hashes': list(self.hashes),
+            'cascade': cascade,
+            'shard': list(shard) if shard else None,
+            'shards': [str(path) for path in self.shards] if self.shards else None,
+        })
         
         # Create log file
-        self.log_file = self.directory / f"image_scan_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+        self.log_file = self.work_dir / f"image_scan_{datetime.now().strftime('%Y%m%d_%H%M%S')}{suffix}.log"
+        self.jsonl_file = self.log_file.with_suffix(".jsonl") if json_log else None
+        self.journal_file = self.log_file.with_suffix(".journal")
+        self.logger = RunLogger(self.log_file, self.jsonl_file)
+        self.profiler = Profiler() if profile else None
         
     def setup_discarded_directory(self):
         """Create the discarded directory if it doesn't exist."""
@@ -60,18 +1720,257 @@ class ImageScanner:
     
     def log(self, message: str, also_print: bool = True):
         """Log message to file and optionally print."""
-        with open(self.log_file, 'a') as f:
-            f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {message}\n")
+        self.logger.write(message)
         if also_print:
             print(message)
         
     def get_file_hash(self, filepath: Path) -> str:
-        """Calculate MD5 hash of a file for exact duplicate detection."""
-        hash_md5 = hashlib.md5()
-        with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        """Calculate a content hash of a file for exact duplicate detection."""
+        return get_file_hash(filepath, self.hash_algorithm)
+    
+    def _group_by_hash(self, paths: List[Path], hash_func, phase: str = "",
+                       nbytes: int = 0) -> List[List[Path]]:
+        """
+        Split paths into groups of two or more sharing hash_func(path), keeping input order.
+        
+        When profiling, each call is recorded under phase as reading nbytes.
+        """
+        groups: Dict[str, List[Path]] = {}
+        for path in paths:
+            try:
+                start = time.perf_counter()
+                digest = hash_func(path)
+                if self.profiler:
+                    self.profiler.sample(phase, time.perf_counter() - start, nbytes)
+            except OSError as e:
+                self.log(f"Error hashing {path.name}: {e}")
+                self.logger.record("error", path=path, stage="hash", error=str(e))
+                continue
+            groups.setdefault(digest, []).append(path)
+        return [group for group in groups.values() if len(group) > 1]
+    
+    def find_exact_duplicates(self, store: ImageStore) -> List[List[int]]:
+        """
+        Find byte-identical files among the live images of a store.
+        
+        Only files sharing a size are read at all; within a size group the
+        first and last 64 KB are hashed, and only files that still collide are
+        hashed in full. Groups whose content hashes were already taken during
+        analysis (see --prefetch) are not read again.
+        
+        Returns:
+            Groups of identical rows, ordered by each group's first row, with
+            each group in row order
+        """
+        rows = store.rows()
+        return self._identical_groups(rows, store.records['file_size'][rows], store.path,
+                                      store.records['digest'][rows])
+    
+    def _identical_groups(self, ids: np.ndarray, sizes: np.ndarray, path_of,
+                          digests: Optional[np.ndarray] = None) -> List[List[int]]:
+        """
+        Group ascending ids of byte-identical files, given each file's size and
+        path_of(id). digests may hold content hashes already taken, empty
+        where unknown; a size group is only read if one of them is missing.
+        """
+        order = np.argsort(sizes, kind='stable')
+        ids, sizes = ids[order], sizes[order]
+        if digests is not None:
+            digests = digests[order]
+        starts = np.flatnonzero(np.diff(sizes)) + 1
+        
+        duplicate_groups: List[List[int]] = []
+        partial_hashed = full_hashed = 0
+        for same_size, begin in zip(np.split(ids, starts), chain([0], starts)):
+            if len(same_size) < 2:
+                continue
+            file_size = int(sizes[begin])
+            if digests is not None and all(digests[begin:begin + len(same_size)]):
+                # Content hashes were taken while the files were prefetched
+                by_digest: Dict[bytes, List[int]] = {}
+                for idx, digest in zip(same_size, digests[begin:begin + len(same_size)]):
+                    by_digest.setdefault(bytes(digest), []).append(int(idx))
+                duplicate_groups.extend(group for group in by_digest.values() if len(group) > 1)
+                continue
+            id_of = {path_of(idx): int(idx) for idx in same_size}
+            partial_hashed += len(id_of)
+            for group in self._group_by_hash(
+                    list(id_of), lambda p: get_partial_hash(p, file_size, self.hash_algorithm),
+                    "exact_duplicates.partial_hash", min(file_size, 2 * PARTIAL_HASH_BYTES)):
+                if file_size > 2 * PARTIAL_HASH_BYTES:
+                    full_hashed += len(group)
+                    groups = self._group_by_hash(group, self.get_file_hash,
+                                                 "exact_duplicates.full_hash", file_size)
+                else:
+                    groups = [group]
+                duplicate_groups.extend([id_of[path] for path in group] for group in groups)
+        
+        self.log(f"Exact duplicate check: {len(ids)} files, {partial_hashed} partially hashed, "
+                 f"{full_hashed} fully hashed ({self.hash_algorithm})", also_print=False)
+        duplicate_groups.sort(key=lambda group: group[0])
+        return duplicate_groups
+    
+    def analyze_unique_images(self, images: Iterable[Tuple[Path, os.stat_result]],
+                              resumed: Optional[Dict[Path, Tuple[Optional[int], Optional[int], Dict]]] = None
+                              ) -> Tuple[ImageStore, List[List[int]]]:
+        """
+        Find byte-identical files first, then analyze only one file of each
+        identical group (plus every unique file) with analyze_images.
+        
+        The identical copies get their representative's info, so they never
+        reach Pillow, and the rest are analyzed lazily (see analyze_images)
+        unless they are to be checked against an index.
+        
+        Returns:
+            Tuple of (store in walk order, groups of identical rows as
+            find_exact_duplicates would return them)
+        """
+        # The listing goes straight into the store, so no per-file objects are kept
+        store = ImageStore()
+        inodes = array('Q')
+        for img_path, st in images:
+            inodes.append(st.st_ino)
+            store.add_file(img_path, st.st_size, st.st_mtime_ns)
+        listed = np.arange(store.count)
+        with self._phase("exact_duplicates", items=store.count):
+            groups = self._identical_groups(listed, store.records['file_size'][:store.count], store.path)
+        is_copy = np.zeros(store.count, dtype=bool)
+        for group in groups:
+            is_copy[group[1:]] = True
+        copies = int(is_copy.sum())
+        if copies:
+            self.log(f"Found {copies} byte-identical copies; analyzing {store.count - copies} files")
+        
+        # The archive check needs the hashes of every image
+        self._analyze_rows(store, inodes, listed[~is_copy].tolist(), resumed, lazy=self.against is None)
+        
+        live = store.records['live']
+        for group in groups:
+            source = group[0]
+            if not live[source]:
+                for row in group[1:]:
+                    store.remove(row)
+                continue
+            info = store.info(source)
+            digest = bytes(store.records['digest'][source]).hex() or None
+            for row in group[1:]:
+                store.update(row, info)
+                store.set_digest(row, digest)
+        
+        # Renumber the rows without the files that failed to decode
+        kept = store.compact()
+        duplicate_groups = [np.searchsorted(kept, group).tolist() for group in groups
+                            if live[group[0]]]
+        return store, duplicate_groups
+    
+    def merge_shards(self) -> Tuple[ImageStore, List[List[int]]]:
+        """
+        Build the store from the shard files instead of analyzing the images.
+        
+        The directory is still walked, so the store is in the same order as
+        a single-process scan and decides ties the same way. Files that no
+        shard covers, or whose size or mtime changed since their shard was
+        made, are left out and never moved or kept. Exact duplicates are
+        grouped by the content hashes in the shards, so no file is read.
+        
+        Returns:
+            Tuple of (store in walk order, groups of identical rows as
+            find_exact_duplicates returns them)
+        """
+        shards = open_shards(self.shards)
+        records: Dict[str, Tuple[int, int]] = {}
+        for number, shard in enumerate(shards):
+            for record in range(len(shard)):
+                records[shard.name(record)] = (number, record)
+        
+        store = ImageStore(len(records))
+        uncovered = changed = 0
+        for img_path, st in self.iter_images():
+            name = str(img_path.relative_to(self.directory))
+            entry = records.pop(name, None)
+            if entry is None:
+                uncovered += 1
+                self.log(f"Not in any shard, left out: {name}", also_print=False)
+                continue
+            shard, record = shards[entry[0]], entry[1]
+            if (st.st_size != int(shard.records['file_size'][record])
+                    or (shard.mtime_ns is not None and st.st_mtime_ns != int(shard.mtime_ns[record]))):
+                changed += 1
+                self.log(f"Changed since shard {shard.header['shard'][0]} was made, left out: {name}",
+                         also_print=False)
+                continue
+            store.append(img_path, shard.info(record), st.st_mtime_ns,
+                         bytes(shard.records['digest'][record]).hex())
+        
+        self.log(f"Merged {len(store)} images from {len(shards)} shards")
+        if uncovered or changed:
+            self.log(f"Left out {uncovered} images that no shard covers and {changed} changed since "
+                     f"sharding (listed in {self.log_file.name}); extract the shards again to include them")
+        if records:
+            self.log(f"{len(records)} images in the shards no longer exist", also_print=False)
+        return store, self.find_exact_duplicates(store)
+    
+    def index_entries(self, store: ImageStore) -> List[Tuple[Path, Dict, str, int]]:
+        """
+        (path, info, hex content hash, mtime_ns) of every live image, as
+        FeatureIndex.write takes them. Content hashes taken during analysis
+        (see --prefetch) are reused; the other files are hashed now.
+        """
+        entries = []
+        for row in store.rows():
+            img_path = store.path(row)
+            digest = bytes(store.records['digest'][row]).hex()
+            if not digest:
+                try:
+                    digest = self.get_file_hash(img_path)
+                except OSError as e:
+                    self.log(f"Error hashing {img_path.name}: {e}")
+                    self.logger.record("error", path=img_path, stage="hash", error=str(e))
+                    continue
+            entries.append((img_path, store.info(row), digest, int(store.records['mtime_ns'][row])))
+        return entries
+    
+    def write_shard(self, output: Path) -> int:
+        """
+        Analyze this scanner's shard of the directory and write the features
+        and content hashes of its images to a shard file for --merge.
+        
+        Files are assigned with shard_of, so hosts that list the directory
+        with the same options split it the same way, and the shards can run
+        anywhere in any order. An interrupted shard continues from its own
+        checkpoint with --resume.
+        
+        Returns:
+            Number of images written
+        """
+        number, count = self.shard
+        self.log(f"Extracting shard {number}/{count} of {self.directory}")
+        state = self.state.load() if self.resume else None
+        if state is not None:
+            self.log(f"Resuming interrupted shard from {self.state.path.name}")
+        resumed = ScanState.decode_images(state['images']) if state and 'images' in state else None
+        
+        images = ((img_path, st) for img_path, st in self.iter_images()
+                  if shard_of(img_path.relative_to(self.directory), count) == number - 1)
+        if self.profiler:
+            images = self.profiler.timed("analyze.walk", images)
+        with self._phase("analyze"):
+            store = self.analyze_images(images, resumed)
+        with self._phase("shard.content_hash", items=len(store)):
+            entries = self.index_entries(store)
+        
+        written = FeatureIndex.write(output, self.directory, entries, self.hash_algorithm,
+                                     "full" if self.full_decode else "draft", extra={
+                                         'shard': [number, count],
+                                         'recursive': self.recursive,
+                                         'extensions': sorted(self.image_extensions),
+                                     })
+        self.state.clear()
+        self.log(f"Wrote {written} images to {output}")
+        if self.profiler:
+            self.log("\nProfile:\n" + self.profiler.format_table())
+        self.logger.flush()
+        return written
     
     def get_image_info(self, filepath: Path) -> Dict:
         """
@@ -80,41 +1979,302 @@ class ImageScanner:
         Returns:
             Dict containing image metadata and hashes
         """
-        with Image.open(filepath) as img:
-            width, height = img.size
-            mode = img.mode
+        return get_image_info(filepath, self.full_decode)
+    
+    def _phase(self, name: str, items: int = 0, nbytes: int = 0):
+        """Context manager timing a phase when profiling is enabled."""
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.phase(name, items, nbytes)
+    
+    def _extract(self, items: Iterable[Tuple[Path, int]], hashes: Optional[Sequence[str]] = None
+                 ) -> Iterator[Tuple[Path, Optional[Dict], Optional[str], Optional[str]]]:
+        """
+        Run get_image_info over (path, file size) pairs, yielding
+        (path, info, error, digest) in input order. hashes selects the
+        perceptual hashes to compute (default: the scanner's --hashes).
+        
+        With workers > 1 the work is spread over a process pool; results stream
+        back in chunks as compact tuples and are re-assembled into dicts here.
+        Work is submitted as paths arrive, so a lazy directory walk overlaps
+        with hashing.
+        
+        With prefetch > 0 a Prefetcher reads files ahead, each file is decoded
+        from memory, and digest is the content hash of the same bytes, so
+        the file is read once; otherwise digest is None.
+        """
+        profile = self.profiler is not None
+        hashes = tuple(hashes if hashes is not None else self.hashes)
+        if self.prefetch:
+            sources = Prefetcher(self.prefetch, self.prefetch_memory).read(items)
+        else:
+            sources = ((path, None, None) for path, _ in items)
+        
+        def finish(path: Path, result) -> Tuple[Path, Optional[Dict], Optional[str], Optional[str]]:
+            values, error, timings, digest = result
+            info = dict(zip(INFO_FIELDS, values)) if error is None else None
+            self._record_timings(timings, info)
+            return path, info, error, digest
+        
+        if self.workers <= 1:
+            for path, data, error in sources:
+                if error is not None:
+                    yield path, None, error, None
+                    continue
+                yield finish(path, _extract_worker(str(path), self.full_decode, profile, data,
+                                                   self.hash_algorithm, hashes))
+            return
+        
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 initializer=enable_heif if self.heif else None) as executor:
+            if not self.prefetch:
+                submitted: List[Path] = []
+                
+                def path_strings() -> Iterator[str]:
+                    for path, _, _ in sources:
+                        submitted.append(path)
+                        yield str(path)
+                
+                results = executor.map(
+                    _extract_worker, path_strings(), repeat(self.full_decode), repeat(profile),
+                    repeat(None), repeat(self.hash_algorithm), repeat(hashes),
+                    chunksize=EXTRACT_CHUNKSIZE
+                )
+                for path, result in zip(submitted, results):
+                    yield finish(path, result)
+                return
             
-            # Calculate multiple hash types for better accuracy
-            phash = str(imagehash.phash(img))
-            dhash = str(imagehash.dhash(img))
-            whash = str(imagehash.whash(img))
-            ahash = str(imagehash.average_hash(img))
+            # Buffers must not pile up in the pool's queue, so submit through a bounded window
+            window: deque = deque()
+            for path, data, error in sources:
+                if error is not None:
+                    window.append((path, None, error))
+                else:
+                    window.append((path, executor.submit(
+                        _extract_worker, str(path), self.full_decode, profile, data, self.hash_algorithm,
+                        hashes
+                    ), None))
+                while len(window) > 2 * self.workers:
+                    path, future, error = window.popleft()
+                    yield finish(path, future.result()) if future else (path, None, error, None)
+            while window:
+                path, future, error = window.popleft()
+                yield finish(path, future.result()) if future else (path, None, error, None)
+    
+    def _record_timings(self, timings: Optional[Dict[str, float]], info: Optional[Dict]):
+        """Add one file's get_image_info step timings to the profiler."""
+        if not timings:
+            return
+        for step, seconds in timings.items():
+            self.profiler.sample(f"analyze.{step}", seconds)
+        self.profiler.sample("analyze.per_file", sum(timings.values()),
+                             info['file_size'] if info else 0)
+    
+    def analyze_images(self, images: Iterable[Tuple[Path, os.stat_result]],
+                       resumed: Optional[Dict[Path, Tuple[Optional[int], Optional[int], Dict]]] = None,
+                       lazy: bool = False) -> ImageStore:
+        """
+        Collect image information for every (path, stat) pair, using the hash
+        cache when enabled and the checkpointed results of an interrupted scan
+        (resumed, as returned by ScanState.decode_images) for unchanged files.
+        Progress is checkpointed periodically and on Ctrl-C.
+        
+        With lazy=True only the headers are read at first. An image is then
+        decoded and hashed only if another image has a compatible aspect
+        ratio and a different pixel count, i.e. it could be a scaled version
+        of it or the other way round; the rest keep header-only info (see
+        get_image_header). This needs the whole listing before decoding starts.
+        
+        With --cascade, lazy analysis goes further: the possible pairs first
+        get only dHash and the average color, pHash is computed only for
+        images with a partner within the dHash limit of compare_images, and
+        the remaining hashes are left to find_similar_pairs.
+        
+        Returns:
+            ImageStore of the successfully analyzed images, in the same order
+            as images regardless of how the work completed
+        """
+        store = ImageStore()
+        inodes = array('Q')
+        
+        def listed() -> Iterator[int]:
+            for img_path, st in images:
+                inodes.append(st.st_ino)
+                yield store.add_file(img_path, st.st_size, st.st_mtime_ns)
+        
+        self._analyze_rows(store, inodes, listed(), resumed, lazy)
+        store.compact()
+        return store
+    
+    def _analyze_rows(self, store: ImageStore, inodes: array, rows: Iterable[int],
+                      resumed: Optional[Dict[Path, Tuple[Optional[int], Optional[int], Dict]]] = None,
+                      lazy: bool = False):
+        """
+        Fill in the store rows added with add_file, as analyze_images describes.
+        
+        The rows are analyzed in place, so the store stays in listing order,
+        and rows that fail to decode are removed. Everything known about a
+        pending image is kept in its row; inodes holds the inode of every row
+        for the hash cache.
+        """
+        variant = "full" if self.full_decode else "draft"
+        cache = HashCache(self.cache_file, variant) if self.use_cache else None
+        found = failures = 0
+        
+        def headed() -> np.ndarray:
+            """Live rows whose header is known; identical copies left out of the analysis have none."""
+            live = store.rows()
+            return live[store.records['known'][live] & HEADER_KNOWN != 0]
+        
+        def key(row: int) -> Tuple[int, int, int]:
+            return inodes[row], int(store.records['file_size'][row]), int(store.records['mtime_ns'][row])
+        
+        def complete(row: int) -> bool:
+            return self._complete(store.info(row))
+        
+        def failed(row: int, error: str):
+            nonlocal failures
+            failures += 1
+            img_path = store.path(row)
+            store.remove(row)
+            self.log(f"Error processing {img_path.name}: {error}")
+            self.logger.record("error", path=img_path, stage="analyze", error=error)
+        
+        def checkpoint():
+            if self.state.due():
+                self.state.save("analyze", images=ScanState.encode_images(store))
+        
+        def misses() -> Iterator[int]:
+            """The rows that still need decoding, after the cache and the checkpoint."""
+            nonlocal found
+            for row in rows:
+                found += 1
+                img_path = store.path(row)
+                if cache:
+                    info = cache.get(img_path, key(row))
+                    if info is not None:
+                        store.update(row, info)
+                        if complete(row):
+                            continue
+                if resumed and img_path in resumed:
+                    size, mtime_ns, info = resumed[img_path]
+                    if (size == int(store.records['file_size'][row])
+                            and mtime_ns == int(store.records['mtime_ns'][row])):
+                        store.update(row, info)
+                        if complete(row):
+                            if cache:
+                                cache.put(img_path, key(row), info)
+                            continue
+                yield row
+        
+        def extract(pending: Iterable[int], hashes: Optional[Sequence[str]] = None
+                    ) -> Iterator[Tuple[int, Optional[Dict], Optional[str], Optional[str]]]:
+            """_extract over rows, yielding (row, info, error, digest) in order."""
+            queued: deque = deque()
             
-            # Convert to RGB for consistent comparison
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
+            def items() -> Iterator[Tuple[Path, int]]:
+                for row in pending:
+                    queued.append(row)
+                    yield store.path(row), int(store.records['file_size'][row])
             
-            # Calculate average color for basic similarity check
-            img_array = np.array(img)
-            avg_color = tuple(img_array.mean(axis=(0, 1)).astype(int))
+            for _, info, error, digest in self._extract(items(), hashes):
+                yield queued.popleft(), info, error, digest
         
-        file_hash = self.get_file_hash(filepath)
-        file_size = filepath.stat().st_size
+        def without_partners(pending: np.ndarray) -> np.ndarray:
+            """Leave the rows no other image could pair with header-only; return the rest."""
+            with self._phase("analyze.header", items=len(pending)):
+                for row in pending.tolist():
+                    if store.records['known'][row] & HEADER_KNOWN:
+                        continue
+                    try:
+                        store.update(row, get_image_header(store.path(row)))
+                    except Exception as e:
+                        failed(row, str(e))
+                live = headed()
+                pending = pending[store.records['live'][pending]]
+                partnered = have_partners(store.records['aspect_ratio'][live], store.pixels(live))
+            decode = pending[partnered[np.searchsorted(live, pending)]]
+            if len(pending):
+                self.log(f"Decoding {len(decode)} of {len(pending)} images; the others cannot have "
+                         f"a scaled version, so only their headers were read")
+            return decode
         
-        return {
-            'width': width,
-            'height': height,
-            'aspect_ratio': round(width / height, 3),
-            'mode': mode,
-            'file_hash': file_hash,
-            'file_size': file_size,
-            'phash': phash,
-            'dhash': dhash,
-            'whash': whash,
-            'ahash': ahash,
-            'avg_color': avg_color,
-            'pixels': width * height
-        }
+        def fill(pending: np.ndarray, hashes: Sequence[str]) -> np.ndarray:
+            """Compute the given hashes (and the average color) where missing; return the rows that succeeded."""
+            wanted = COLOR_KNOWN | sum(1 << HASH_FIELDS.index(field) for field in hashes)
+            missing = pending[store.records['known'][pending] & wanted != wanted]
+            for row, info, error, digest in extract(missing.tolist(), hashes):
+                if error is not None:
+                    failed(row, error)
+                    continue
+                store.update(row, dict(dict.fromkeys(HASH_FIELDS), avg_color=info['avg_color'],
+                                       width=None, **{field: info[field] for field in hashes}))
+                store.set_digest(row, digest)
+            return pending[store.records['live'][pending]]
+        
+        def finished(row: int):
+            """Cache and checkpoint a row whose analysis is done."""
+            if cache:
+                cache.put(store.path(row), key(row), store.info(row))
+            checkpoint()
+        
+        def cascade(pending: np.ndarray):
+            """Finish the rows, computing pHash only where dHash leaves a possible pair."""
+            pending = fill(pending, ('dhash',))
+            with self._phase("cascade.dhash_gate", items=len(pending)):
+                # Only images with a dHash can pass the gate; header-only ones have no partner anyway
+                live = headed()
+                live = live[store.records['known'][live] & 1 << HASH_FIELDS.index('dhash') != 0]
+                dhashes = store.records['hashes'][live, HASH_FIELDS.index('dhash')].tolist()
+                candidate_index = AspectRatioIndex(
+                    store.records['aspect_ratio'][live].tolist(), store.pixels(live).tolist(), dhashes
+                )
+                # compare_images requires dHash distance <= 1.5 * threshold
+                radius = int(self.threshold * 1.5)
+                plausible = []
+                for row, k in zip(pending.tolist(), np.searchsorted(live, pending).tolist()):
+                    if candidate_index.search(k, dhashes[k], radius):
+                        plausible.append(row)
+                    else:
+                        finished(row)
+            self.log(f"Cascade: computing pHash for {len(plausible)} of {len(pending)} decoded images", also_print=False)
+            for row in fill(np.array(plausible, dtype=np.int64), ('phash',)).tolist():
+                finished(row)
+        
+        try:
+            pending: Iterable[int] = misses()
+            if lazy:
+                pending = without_partners(np.fromiter(pending, dtype=np.int64))
+                if self.cascade:
+                    cascade(pending)
+                    pending = []
+                else:
+                    pending = pending.tolist()
+            for row, info, error, digest in extract(pending):
+                if error is not None:
+                    failed(row, error)
+                    continue
+                store.update(row, info)
+                store.set_digest(row, digest)
+                finished(row)
+        except KeyboardInterrupt:
+            self.state.save("analyze", images=ScanState.encode_images(store))
+            if cache:
+                cache.close()
+            self.log(f"\nInterrupted after analyzing {len(headed())} images; run again with --resume to continue")
+            self.logger.flush()
+            raise
+        
+        if found:
+            self.log(f"Analyzed {found - failures} of {found} images found")
+        if cache:
+            removed = cache.prune()
+            cache.close()
+            self.log(f"Hash cache: {cache.hits} hits, {cache.misses} misses, {removed} stale entries removed")
+    
+    def _complete(self, info: Dict) -> bool:
+        """True if info has the average color and every hash selected with --hashes."""
+        return info['avg_color'] is not None and all(info[field] is not None for field in self.hashes)
     
     def compare_images(self, info1: Dict, info2: Dict) -> Tuple[bool, float, str]:
         """
@@ -124,53 +2284,358 @@ class ImageScanner:
             Tuple of (is_similar, confidence, reason)
         """
         # Check aspect ratio first - if different, not scaled versions
-        if abs(info1['aspect_ratio'] - info2['aspect_ratio']) > 0.01:
+        if abs(info1['aspect_ratio'] - info2['aspect_ratio']) > ASPECT_TOLERANCE:
             return False, 0.0, "Different aspect ratios"
         
-        # Calculate hash differences
-        phash_diff = imagehash.hex_to_hash(info1['phash']) - imagehash.hex_to_hash(info2['phash'])
-        dhash_diff = imagehash.hex_to_hash(info1['dhash']) - imagehash.hex_to_hash(info2['dhash'])
-        whash_diff = imagehash.hex_to_hash(info1['whash']) - imagehash.hex_to_hash(info2['whash'])
-        ahash_diff = imagehash.hex_to_hash(info1['ahash']) - imagehash.hex_to_hash(info2['ahash'])
+        # Calculate hash differences
+        phash_diff, dhash_diff, whash_diff, ahash_diff = (
+            hamming_distance(int(info1[field], 16), int(info2[field], 16)) if field in self.hashes else 0
+            for field in HASH_FIELDS
+        )
+        
+        # Calculate color difference
+        color_diff = sum(abs(c1 - c2) for c1, c2 in zip(info1['avg_color'], info2['avg_color']))
+        
+        # Weighted scoring system (ensure scores are 0-1)
+        # Lower hash difference = higher score
+        phash_score = max(0, 1 - (phash_diff / 64))  # Max hash diff is 64
+        dhash_score = max(0, 1 - (dhash_diff / 64))
+        whash_score = max(0, 1 - (whash_diff / 64))
+        ahash_score = max(0, 1 - (ahash_diff / 64))
+        
+        # Combine hash scores with weights (hashes left out with --hashes weigh 0)
+        weights = self.hash_weights
+        hash_score = (
+            phash_score * weights[0] +  # pHash is most reliable
+            dhash_score * weights[1] +
+            whash_score * weights[2] +
+            ahash_score * weights[3]
+        )
+        if len(self.hashes) < len(HASH_FIELDS):
+            hash_score /= sum(weights)
+        
+        # Normalize color difference (0-1 scale, inverted so higher is more similar)
+        color_score = max(0, 1.0 - (color_diff / 765.0))  # Max diff is 255*3
+        
+        # Combined confidence score (0-1)
+        confidence = hash_score * 0.8 + color_score * 0.2
+        
+        # Decision criteria
+        if phash_diff <= self.threshold and dhash_diff <= self.threshold * 1.5:
+            if color_score > 0.7:  # Colors are reasonably similar
+                reasons = []
+                if phash_diff <= self.threshold // 2:
+                    reasons.append("very similar perceptual hash")
+                if dhash_diff <= self.threshold // 2:
+                    reasons.append("very similar difference hash")
+                if color_score > 0.9:
+                    reasons.append("very similar colors")
+                
+                return True, confidence, f"Similar: {', '.join(reasons)}"
+        
+        return False, confidence, "Not similar enough"
+    
+    def compare_batch(self, features: 'FeatureMatrix', rows, cols) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Vectorized compare_images over rows of a FeatureMatrix.
+        
+        rows and cols are indices (scalars or arrays) that broadcast against each
+        other, so one image can be scored against a block of candidates or a
+        block against a block (e.g. rows[:, None] against cols[None, :]).
+        
+        Returns:
+            Tuple of (is_similar, confidence, reason_code) arrays; pass a reason
+            code to describe_reason() for the text compare_images would return
+        """
+        rows = np.asarray(rows)
+        cols = np.asarray(cols)
+        
+        aspect_ok = np.abs(features.aspect_ratio[rows] - features.aspect_ratio[cols]) <= ASPECT_TOLERANCE
+        diffs = popcount64(features.hashes[rows] ^ features.hashes[cols]).astype(np.int64)
+        phash_diff, dhash_diff, whash_diff, ahash_diff = (diffs[..., k] for k in range(4))
+        color_diff = np.abs(
+            features.avg_color[rows].astype(np.int64) - features.avg_color[cols].astype(np.int64)
+        ).sum(axis=-1)
+        
+        # Same arithmetic, in the same order, as compare_images
+        phash_score = np.maximum(0, 1 - (phash_diff / 64))
+        dhash_score = np.maximum(0, 1 - (dhash_diff / 64))
+        whash_score = np.maximum(0, 1 - (whash_diff / 64))
+        ahash_score = np.maximum(0, 1 - (ahash_diff / 64))
+        weights = self.hash_weights
+        hash_score = (
+            phash_score * weights[0] +
+            dhash_score * weights[1] +
+            whash_score * weights[2] +
+            ahash_score * weights[3]
+        )
+        if len(self.hashes) < len(HASH_FIELDS):
+            hash_score = hash_score / sum(weights)
+        color_score = np.maximum(0, 1.0 - (color_diff / 765.0))
+        confidence = np.where(aspect_ok, hash_score * 0.8 + color_score * 0.2, 0.0)
+        
+        is_similar = (aspect_ok & (phash_diff <= self.threshold)
+                      & (dhash_diff <= self.threshold * 1.5) & (color_score > 0.7))
+        
+        reason_code = np.where(aspect_ok, REASON_NOT_SIMILAR, REASON_ASPECT_RATIO)
+        reason_code = np.where(is_similar, REASON_SIMILAR, reason_code)
+        reason_code = reason_code | np.where(is_similar & (phash_diff <= self.threshold // 2), REASON_PHASH, 0)
+        reason_code = reason_code | np.where(is_similar & (dhash_diff <= self.threshold // 2), REASON_DHASH, 0)
+        reason_code = reason_code | np.where(is_similar & (color_score > 0.9), REASON_COLOR, 0)
+        
+        return is_similar, confidence, reason_code
+    
+    @staticmethod
+    def describe_reason(reason_code: int) -> str:
+        """Turn a compare_batch reason code into the compare_images reason text."""
+        if reason_code & REASON_ASPECT_RATIO:
+            return "Different aspect ratios"
+        if not reason_code & REASON_SIMILAR:
+            return "Not similar enough"
+        reasons = []
+        if reason_code & REASON_PHASH:
+            reasons.append("very similar perceptual hash")
+        if reason_code & REASON_DHASH:
+            reasons.append("very similar difference hash")
+        if reason_code & REASON_COLOR:
+            reasons.append("very similar colors")
+        return f"Similar: {', '.join(reasons)}"
+    
+    def find_similar_pairs(self, rows: Sequence[int], store: ImageStore
+                           ) -> Tuple[List[Tuple[int, int, float, int]], int, int]:
+        """
+        Find every pair of differently sized images that compare as similar.
+        
+        Returns:
+            Tuple of (edges, candidate pairs the index generated, candidate
+            pairs scored); each edge is (i, j, confidence, reason_code) with
+            i < j indexing rows
+        """
+        with self._phase("candidate_index", items=len(rows)):
+            features = store.features(rows)
+            
+            # compare_images rejects pairs with different aspect ratios or a
+            # pHash distance above the threshold, and equal-sized pairs are
+            # never scaled versions, so only the rest need to be scored.
+            phashes = features.hashes[:, 0].tolist()
+            candidate_index = AspectRatioIndex(
+                features.aspect_ratio.tolist(), features.pixels.tolist(), phashes
+            )
+            # Images left without a pHash (header-only, or ruled out by the
+            # --cascade dHash check) have no similar partner
+            has_phash = (store.records['known'][rows] & 1 << HASH_FIELDS.index('phash')).astype(bool)
+        
+        edges: List[Tuple[int, int, float, int]] = []
+        candidates_generated = 0
+        comparisons_made = 0
+        for i in np.flatnonzero(has_phash).tolist():
+            with self._phase("candidate_search", items=1):
+                candidates = sorted(j for j in candidate_index.search(i, phashes[i], self.threshold) if j > i)
+            candidates_generated += len(candidates)
+            candidates = [j for j in candidates if has_phash[j]]
+            if not candidates:
+                continue
+            comparisons_made += len(candidates)
+            
+            # Score all candidates at once
+            with self._phase("pair_scoring", items=len(candidates)):
+                is_similar, confidences, reason_codes = self.compare_batch(features, i, candidates)
+            for k in np.flatnonzero(is_similar):
+                edges.append((i, candidates[k], float(confidences[k]), int(reason_codes[k])))
+        
+        if self.cascade and edges:
+            edges = self._complete_edges(rows, store, edges)
+        return edges, candidates_generated, comparisons_made
+    
+    def _complete_edges(self, rows: Sequence[int], store: ImageStore,
+                        edges: List[Tuple[int, int, float, int]]) -> List[Tuple[int, int, float, int]]:
+        """
+        Compute the hashes that --cascade left out for the images of similar
+        pairs, and rescore those pairs so their confidence is the same as
+        after a full analysis. Whether a pair is similar does not change.
+        """
+        wanted = COLOR_KNOWN | sum(1 << HASH_FIELDS.index(field) for field in self.hashes)
+        members = sorted({int(rows[k]) for edge in edges for k in edge[:2]})
+        # Keepers may already carry their planned names; read them where they still are
+        incomplete = {self.plan.source(store.path(row)): row for row in members
+                      if store.records['known'][row] & wanted != wanted}
+        if not incomplete:
+            return edges
+        
+        hashes = [field for field in self.hashes if field not in GATE_HASHES]
+        self.log(f"Cascade: computing {', '.join(hashes)} for {len(incomplete)} images in similar pairs",
+                 also_print=False)
+        variant = "full" if self.full_decode else "draft"
+        cache = HashCache(self.cache_file, variant) if self.use_cache else None
+        with self._phase("cascade.confidence", items=len(incomplete)):
+            items = [(img_path, int(store.records['file_size'][row])) for img_path, row in incomplete.items()]
+            for img_path, info, error, _ in self._extract(items, hashes):
+                if error is not None:
+                    self.log(f"Error processing {img_path.name}: {error}")
+                    self.logger.record("error", path=img_path, stage="analyze", error=error)
+                    continue
+                row = incomplete[img_path]
+                store.update(row, info)
+                if cache:
+                    cache.put(img_path, HashCache.key(img_path.stat()), store.info(row))
+        if cache:
+            cache.close()
+        
+        features = store.features(rows)
+        _, confidences, _ = self.compare_batch(features, np.array([edge[0] for edge in edges]),
+                                               np.array([edge[1] for edge in edges]))
+        return [(i, j, float(confidence), reason_code)
+                for (i, j, _, reason_code), confidence in zip(edges, confidences)]
+    
+    def find_in_index(self, index: FeatureIndex, img_path: Path, info: Dict,
+                      exclude: Optional[Set[Path]] = None) -> Optional[Tuple[int, bool, float, str]]:
+        """
+        Find the best indexed copy of an image: an identical file, or else the
+        largest similar version with more pixels.
+        
+        Args:
+            index: The feature index to search
+            img_path: The image
+            info: Its image info
+            exclude: Resolved paths of indexed files that must not match; the
+                image itself never matches its own record
+        
+        Returns:
+            Tuple of (record, is_exact_duplicate, confidence, reason), or None
+        """
+        own_path = img_path.resolve()
+        
+        def usable(record: int) -> bool:
+            path = index.path_of(record).resolve()
+            return path != own_path and not (exclude and path in exclude)
         
-        # Calculate color difference
-        color_diff = sum(abs(c1 - c2) for c1, c2 in zip(info1['avg_color'], info2['avg_color']))
+        same_size = index.same_size(info['file_size'])
+        if same_size:
+            digest = index.digest(get_file_hash(img_path, index.hash_algorithm))
+            for record in same_size:
+                if index.records['digest'][record] == digest and usable(record):
+                    return record, True, 1.0, "Identical file"
         
-        # Weighted scoring system (ensure scores are 0-1)
-        # Lower hash difference = higher score
-        phash_score = max(0, 1 - (phash_diff / 64))  # Max hash diff is 64
-        dhash_score = max(0, 1 - (dhash_diff / 64))
-        whash_score = max(0, 1 - (whash_diff / 64))
-        ahash_score = max(0, 1 - (ahash_diff / 64))
+        candidates = index.candidates(info['aspect_ratio'], int(info['phash'], 16), self.threshold)
+        rows = index.records[candidates]
+        candidates = candidates[rows['width'].astype(np.int64) * rows['height'] > info['pixels']]
+        if exclude and len(candidates):
+            candidates = candidates[[usable(int(record)) for record in candidates]]
+        if len(candidates) == 0:
+            return None
+        archive = index.features(candidates)
         
-        # Combine hash scores with weights
-        hash_score = (
-            phash_score * 0.4 +  # pHash is most reliable
-            dhash_score * 0.3 +
-            whash_score * 0.2 +
-            ahash_score * 0.1
+        query = FeatureMatrix([info])
+        features = FeatureMatrix.from_arrays(
+            np.concatenate([query.hashes, archive.hashes]),
+            np.concatenate([query.avg_color, archive.avg_color]),
+            np.concatenate([query.aspect_ratio, archive.aspect_ratio]),
+            np.concatenate([query.pixels, archive.pixels]),
         )
+        is_similar, confidences, reason_codes = self.compare_batch(features, 0, np.arange(1, len(features)))
+        matches = np.flatnonzero(is_similar)
+        if len(matches) == 0:
+            return None
+        best = max(matches, key=lambda k: (archive.pixels[k], confidences[k]))
+        return (int(candidates[best]), False, float(confidences[best]),
+                self.describe_reason(int(reason_codes[best])))
+    
+    def check_against_index(self, store: ImageStore):
+        """
+        Discard images that are copies or smaller versions of images in the
+        reference index, removing them from the store.
         
-        # Normalize color difference (0-1 scale, inverted so higher is more similar)
-        color_score = max(0, 1.0 - (color_diff / 765.0))  # Max diff is 255*3
+        Indexed files that are part of this scan are never used as keepers:
+        scanning a folder against its own index would otherwise match every
+        image to itself, and discard both files of an identical pair. The
+        scan's own passes deduplicate those images among themselves.
+        """
+        index = FeatureIndex(self.against)
+        self.log(f"Index {self.against.name}: {len(index)} images under {index.root}")
+        variant = "full" if self.full_decode else "draft"
+        if index.variant != variant:
+            self.log(f"Note: the index was built with {index.variant} decoding and this scan uses {variant}")
         
-        # Combined confidence score (0-1)
-        confidence = hash_score * 0.8 + color_score * 0.2
+        scanned = {store.path(row).resolve() for row in store.rows()}
+        checked = len(store)
+        matched = 0
+        for row in store.rows():
+            if self.quit_requested:
+                break
+            img_path, info = store.path(row), store.info(row)
+            match = self.find_in_index(index, img_path, info, exclude=scanned)
+            if match is None:
+                continue
+            record, exact, confidence, reason = match
+            keeper, keeper_info = index.path_of(record), index.info(record)
+            if exact:
+                self.log(f"\n{img_path.name} is identical to indexed {keeper}")
+                self.move_to_discarded(img_path, f"exact duplicate of {keeper}", keeper=keeper, info=info)
+            else:
+                self.log(f"\n{img_path.name} ({info['width']}x{info['height']}) is a smaller version of "
+                         f"indexed {keeper} ({keeper_info['width']}x{keeper_info['height']}, "
+                         f"confidence: {confidence:.0%})")
+                self.log(f"    {reason}")
+                if self.interactive and not self.ask_user_confirmation(
+                        keeper, img_path, keeper_info, info, confidence, reason):
+                    self.log("  Skipped by user")
+                    self.logger.record("skip", path=img_path, keeper=keeper, reason="declined by user")
+                    continue
+                self.move_to_discarded(img_path, f"smaller version of {keeper}", keeper=keeper, info=info)
+            matched += 1
+            store.remove(row)
+        self.log(f"Matched {matched} of {checked} images against the index")
+    
+    def cluster_similar_images(self, rows: Sequence[int], store: ImageStore,
+                               edges: List[Tuple[int, int, float, int]]
+                               ) -> List[Tuple[int, List[Tuple[int, float, str]]]]:
+        """
+        Group similar images into connected components with union-find.
         
-        # Decision criteria
-        if phash_diff <= self.threshold and dhash_diff <= self.threshold * 1.5:
-            if color_score > 0.7:  # Colors are reasonably similar
-                reasons = []
-                if phash_diff <= self.threshold // 2:
-                    reasons.append("very similar perceptual hash")
-                if dhash_diff <= self.threshold // 2:
-                    reasons.append("very similar difference hash")
-                if color_score > 0.9:
-                    reasons.append("very similar colors")
-                
-                return True, confidence, f"Similar: {', '.join(reasons)}"
+        Each group keeps its largest image (most pixels, then largest file,
+        then first path name); the others are listed with the confidence and
+        reason of their strongest direct match with the keeper, or with any
+        group member if they only reach the keeper through others. The result
+        depends only on the set of edges, not on the order files were found.
         
-        return False, confidence, "Not similar enough"
+        Returns:
+            List of (keeper row, [(member row, confidence, reason), ...]) sorted by keeper path
+        """
+        with self._phase("clustering", items=len(edges)):
+            components = UnionFind(len(rows))
+            for i, j, _, _ in edges:
+                components.union(i, j)
+            
+            groups: Dict[int, List[int]] = {}
+            for idx in sorted({idx for i, j, _, _ in edges for idx in (i, j)}):
+                groups.setdefault(components.find(idx), []).append(idx)
+            
+            # Strongest edge per member: towards the keeper if there is one, else any
+            best_edge: Dict[Tuple[int, int], Tuple[float, int]] = {}
+            for i, j, confidence, reason_code in edges:
+                best_edge[(i, j)] = best_edge[(j, i)] = (confidence, reason_code)
+            
+            pixels = store.pixels(rows)
+            file_sizes = store.records['file_size'][rows]
+            
+            def rank(idx: int):
+                return (-int(pixels[idx]), -int(file_sizes[idx]), str(store.path(rows[idx])))
+            
+            clusters = []
+            for members in groups.values():
+                members.sort(key=rank)
+                keeper = members[0]
+                listed = []
+                for idx in members[1:]:
+                    edge = best_edge.get((keeper, idx))
+                    if edge is None:
+                        edge = max(best_edge[(idx, other)] for other in members if (idx, other) in best_edge)
+                    confidence, reason_code = edge
+                    listed.append((int(rows[idx]), confidence, self.describe_reason(reason_code)))
+                clusters.append((int(rows[keeper]), listed))
+        
+        clusters.sort(key=lambda cluster: str(store.path(cluster[0])))
+        return clusters
     
     def ask_user_confirmation(self, img1: Path, img2: Path, info1: Dict, info2: Dict, 
                             confidence: float, reason: str) -> bool:
@@ -194,68 +2659,222 @@ class ImageScanner:
                 self.interactive = False
                 return False
             elif response in ['q', 'quit']:
-                print("Quitting...")
-                exit(0)
+                print("Quitting; applying the decisions made so far...")
+                self.interactive = False
+                self.quit_requested = True
+                return False
+    
+    def iter_images(self, root: Optional[Path] = None) -> Iterator[Tuple[Path, os.stat_result]]:
+        """
+        Lazily yield (path, stat) for every image file using os.scandir.
+        
+        The stat comes from the DirEntry, so each file is stat'ed once. With
+        recursive=True subdirectories are walked depth-first, skipping any
+        'discarded' folder and directories already visited via a symlink.
+        root defaults to the scanned directory.
+        """
+        extensions = {ext.lower() for ext in self.image_extensions}
+        pending = [root or self.directory]
+        visited: Set[Tuple[int, int]] = set()
+        
+        while pending:
+            directory = pending.pop()
+            try:
+                st = os.stat(directory)
+                if (st.st_dev, st.st_ino) in visited:
+                    continue
+                visited.add((st.st_dev, st.st_ino))
+                
+                subdirs = []
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir():
+                                if self.recursive and entry.name != "discarded":
+                                    subdirs.append(Path(entry.path))
+                            elif (os.path.splitext(entry.name)[1].lower() in extensions
+                                    and entry.is_file()):
+                                yield Path(entry.path), entry.stat()
+                        except OSError as e:
+                            self.log(f"Error reading {entry.path}: {e}")
+                            self.logger.record("error", path=entry.path, stage="walk", error=str(e))
+            except OSError as e:
+                self.log(f"Error reading directory {directory}: {e}")
+                self.logger.record("error", path=directory, stage="walk", error=str(e))
+                continue
+            
+            # Reverse so subdirectories are visited in listing order
+            pending.extend(reversed(subdirs))
     
     def find_all_images(self) -> List[Path]:
         """Find all image files in the directory."""
-        images = []
-        for ext in self.image_extensions:
-            images.extend(self.directory.glob(f"*{ext}"))
-        return [img for img in images if img.is_file() and img.parent != self.discarded_dir]
-        """Find all image files in the directory."""
-        images = []
-        for ext in self.image_extensions:
-            images.extend(self.directory.glob(f"*{ext}"))
-        return [img for img in images if img.is_file() and img.parent != self.discarded_dir]
-    
-    def move_to_discarded(self, filepath: Path, reason: str):
-        """Move a file to the discarded directory."""
-        dest = self.discarded_dir / filepath.name
-        
-        # Handle filename conflicts
-        if dest.exists():
-            base = dest.stem
-            ext = dest.suffix
-            counter = 1
-            while dest.exists():
-                dest = self.discarded_dir / f"{base}_{counter}{ext}"
-                counter += 1
+        return [img_path for img_path, _ in self.iter_images()]
+    
+    def move_to_discarded(self, filepath: Path, reason: str, keeper: Optional[Path] = None,
+                          info: Optional[Dict] = None) -> Path:
+        """
+        Plan moving a file to the discarded directory; apply_plan() performs it.
+        
+        keeper and info (the file's image info) are recorded in the journal so
+        the move can be reviewed and undone later.
+        """
+        details = {}
+        if keeper is not None:
+            details['keeper'] = keeper
+        if info is not None:
+            details.update(width=info['width'], height=info['height'], file_size=info['file_size'])
+        return self.plan.move_to_discarded(filepath, reason, **details)
+    
+    def rename_with_dimensions(self, filepath: Path, width: int, height: int) -> Path:
+        """Plan renaming a file to include its dimensions and return the new path."""
+        return self.plan.rename_with_dimensions(filepath, width, height)
+    
+    def _apply_operation(self, op: Dict) -> Optional[str]:
+        """Perform one planned operation, returning an error message on failure."""
+        try:
+            with self._phase(f"file_operations.{op['op']}", items=1):
+                if op['op'] == 'move':
+                    shutil.move(str(op['source']), str(op['dest']))
+                else:
+                    op['source'].rename(op['dest'])
+        except OSError as e:
+            return str(e)
+        return None
+    
+    def apply_plan(self, resume: bool = False, checkpoint: bool = True):
+        """
+        Carry out all planned moves and renames.
+        
+        The whole plan is written to a journal before any file is touched and
+        each completed operation is appended to it, so --undo can replay the
+        journal in reverse. Operations never share a source or destination,
+        so with io_threads > 1 they run concurrently.
+        
+        With resume=True the plan is continued in the existing journal:
+        operations it records as done, or whose source is gone and destination
+        present, are not repeated. checkpoint=False skips saving the plan
+        to the scan state (used by watch mode).
+        """
+        ops = list(self.plan)
+        if not ops:
+            return
         
         if self.dry_run:
-            self.log(f"[DRY RUN] Would move: {filepath.name} -> discarded/ ({reason})")
-        else:
-            shutil.move(str(filepath), str(dest))
-            self.log(f"Moved: {filepath.name} -> discarded/ ({reason})")
+            for op in ops:
+                if op['op'] == 'move':
+                    self.log(f"[DRY RUN] Would move: {op['source'].name} -> discarded/ ({op['reason']})")
+                else:
+                    self.log(f"[DRY RUN] Would rename: {op['source'].name} -> {op['dest'].name}")
+                self.logger.record(op['op'], source=op['source'], dest=op['dest'],
+                                   reason=op.get('reason'), dry_run=True)
+            return
+        
+        done: Set[Tuple[str, str]] = set()
+        if resume:
+            with open(self.journal_file) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if entry.get('status') == 'done':
+                        done.add((entry['source'], entry['dest']))
+        
+        with open(self.journal_file, 'a') as journal:
+            if not resume:
+                journal.write(json.dumps({'journal': JOURNAL_VERSION, 'directory': str(self.directory),
+                                          'started': datetime.now().isoformat(timespec='seconds')}) + "\n")
+                for op in ops:
+                    journal.write(json.dumps(dict(op, status='planned'), default=str) + "\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+                if checkpoint:
+                    self.state.save("apply", plan=self.plan.to_records(),
+                                    journal=self.journal_file.name)
+            else:
+                pending = []
+                for op in ops:
+                    if (str(op['source']), str(op['dest'])) in done:
+                        continue
+                    if not op['source'].exists() and op['dest'].exists():
+                        # Applied before the interruption but not yet journaled
+                        journal.write(json.dumps({'op': op['op'], 'source': str(op['source']),
+                                                  'dest': str(op['dest']), 'status': 'done'}) + "\n")
+                        continue
+                    pending.append(op)
+                self.log(f"Resuming {len(pending)} of {len(ops)} planned file operations")
+                ops = pending
+            
+            def finish(op: Dict, error: Optional[str]):
+                if error is not None:
+                    self.log(f"Error applying {op['op']} of {op['source'].name}: {error}")
+                    self.logger.record("error", path=op['source'], stage=op['op'], error=error)
+                    return
+                journal.write(json.dumps({'op': op['op'], 'source': str(op['source']),
+                                          'dest': str(op['dest']), 'status': 'done'}) + "\n")
+                if op['op'] == 'move':
+                    self.log(f"Moved: {op['source'].name} -> discarded/ ({op['reason']})")
+                else:
+                    self.log(f"Renamed: {op['source'].name} -> {op['dest'].name}")
+                self.logger.record(op['op'], source=op['source'], dest=op['dest'],
+                                   reason=op.get('reason'), dry_run=False)
+            
+            if self.io_threads > 1:
+                with ThreadPoolExecutor(max_workers=self.io_threads) as executor:
+                    for op, error in zip(ops, executor.map(self._apply_operation, ops)):
+                        finish(op, error)
+            else:
+                for op in ops:
+                    finish(op, self._apply_operation(op))
+            
+            journal.flush()
+            os.fsync(journal.fileno())
+        self.plan = FileOperationPlan(self.discarded_dir)
     
-    def rename_with_dimensions(self, filepath: Path, width: int, height: int):
-        """Rename a file to include dimensions in the filename."""
-        base = filepath.stem
-        ext = filepath.suffix
+    def undo(self, journal_file: Path) -> int:
+        """
+        Reverse the completed operations recorded in a journal, newest first.
         
-        # Remove existing dimension suffix if present (e.g., "-1200x800")
-        base = re.sub(r'-\d+x\d+$', '', base)
+        An operation is only reversed if its destination still exists and its
+        source path is free. Returns the number of operations undone.
         
-        new_name = f"{base}-{width}x{height}{ext}"
-        new_path = filepath.parent / new_name
+        Journals written before paths were made absolute hold paths relative
+        to the directory the scan ran from; those are located from the
+        journal's own folder, which was the scanned directory.
+        """
+        done = []
+        directory = None
+        with open(journal_file) as f:
+            for line in f:
+                entry = json.loads(line)
+                if 'journal' in entry:
+                    directory = Path(entry['directory'])
+                elif entry.get('status') == 'done':
+                    done.append(entry)
         
-        # Handle filename conflicts
-        if new_path.exists() and new_path != filepath:
-            counter = 1
-            while new_path.exists():
-                new_name = f"{base}-{width}x{height}_{counter}{ext}"
-                new_path = filepath.parent / new_name
-                counter += 1
+        def locate(path_text: str) -> Path:
+            path = Path(path_text)
+            if path.is_absolute() or directory is None:
+                return path
+            try:
+                path = path.relative_to(directory)
+            except ValueError:
+                pass
+            return Path(journal_file).resolve().parent / path
         
-        if new_path != filepath:  # Only rename if the name is actually different
-            if self.dry_run:
-                self.log(f"[DRY RUN] Would rename: {filepath.name} -> {new_name}")
+        undone = 0
+        for entry in reversed(done):
+            source, dest = locate(entry['source']), locate(entry['dest'])
+            if not dest.exists():
+                self.log(f"Cannot undo {entry['op']} of {source.name}: {dest} no longer exists")
+            elif source.exists():
+                self.log(f"Cannot undo {entry['op']} of {source.name}: {source} already exists")
             else:
-                filepath.rename(new_path)
-                self.log(f"Renamed: {filepath.name} -> {new_name}")
-                return new_path
+                shutil.move(str(dest), str(source))
+                self.log(f"Restored: {dest.name} -> {source}")
+                self.logger.record("undo", source=dest, dest=source)
+                undone += 1
         
-        return filepath
+        self.log(f"\nUndo complete: restored {undone} of {len(done)} operations from {journal_file.name}")
+        self.logger.flush()
+        return undone
     
     def scan_for_duplicates(self):
         """Main scanning logic to find duplicates and scaled versions."""
@@ -265,123 +2884,141 @@ class ImageScanner:
         
         self.setup_discarded_directory()
         
-        images = self.find_all_images()
-        if not images:
-            self.log("No images found in the directory.")
-            return
+        state = self.state.load() if self.resume else None
+        if state is not None:
+            self.log(f"Resuming interrupted scan from {self.state.path.name} (phase: {state['phase']})")
+        elif self.resume:
+            self.log("No resumable scan with these settings was found; starting from the beginning")
+        elif self.state.exists():
+            self.log(f"Note: {self.state.path.name} holds an interrupted scan; use --resume to continue it")
+        state = state or {}
         
-        self.log(f"Found {len(images)} images to process...")
+        if state.get('phase') == 'apply':
+            self.plan.restore(state['plan'])
+            self.journal_file = self.work_dir / state['journal']
+            self.log("")
+            self.apply_plan(resume=True)
+            self._finish_scan(*state['totals'])
+            return
         
-        # Store image information
-        image_data: Dict[Path, Dict] = {}
-        file_hash_map: Dict[str, List[Path]] = {}
+        resumed = ScanState.decode_images(state['images']) if 'images' in state else None
+        if state.get('phase', 'analyze') != 'analyze':
+            # Analysis finished before the interruption
+            store = ImageStore(len(resumed))
+            for path, (_, mtime_ns, info) in resumed.items():
+                store.append(path, info, mtime_ns or 0)
+        else:
+            if self.shards:
+                # The images were analyzed by --shard, possibly on other hosts
+                self.log(f"\nMerging {len(self.shards)} shard files...")
+                with self._phase("merge"):
+                    store, duplicate_groups = self.merge_shards()
+            else:
+                # First pass: collect all image data while the directory is walked
+                self.log("\nAnalyzing images...")
+                images = self.iter_images()
+                if self.profiler:
+                    images = self.profiler.timed("analyze.walk", images)
+                with self._phase("analyze"):
+                    store, duplicate_groups = self.analyze_unique_images(images, resumed)
+                if self.profiler:
+                    self.profiler.add("analyze", 0.0, items=len(store),
+                                      nbytes=int(store.records['file_size'][store.rows()].sum()))
+            if not store:
+                self.log("No images found in the directory.")
+                self.state.clear()
+                return
+            state['duplicate_groups'] = duplicate_groups
+            self.state.save("exact_duplicates", images=ScanState.encode_images(store),
+                            duplicate_groups=duplicate_groups)
         
-        # First pass: collect all image data
-        self.log("\nAnalyzing images...")
-        for img_path in images:
-            try:
-                info = self.get_image_info(img_path)
-                image_data[img_path] = info
-                
-                # Group by file hash for exact duplicates
-                if info['file_hash'] not in file_hash_map:
-                    file_hash_map[info['file_hash']] = []
-                file_hash_map[info['file_hash']].append(img_path)
-                
-            except Exception as e:
-                self.log(f"Error processing {img_path.name}: {e}")
+        if self.against is not None:
+            self.log(f"\nChecking against {self.against}...")
+            with self._phase("against_index", items=len(store)):
+                self.check_against_index(store)
         
         # Second pass: find exact duplicates
         self.log("\nChecking for exact duplicates...")
-        processed_hashes: Set[str] = set()
-        
-        for file_hash, paths in file_hash_map.items():
-            if len(paths) > 1 and file_hash not in processed_hashes:
-                processed_hashes.add(file_hash)
-                # Keep the first one, move the rest
-                self.log(f"\nFound {len(paths)} identical images:")
-                for path in paths:
-                    self.log(f"  - {path.name}", also_print=False)
-                
-                # Rename the kept image (first one) to include dimensions
-                kept_image = paths[0]
-                kept_info = image_data[kept_image]
-                new_kept_path = self.rename_with_dimensions(kept_image, kept_info['width'], kept_info['height'])
-                
-                # Update image_data with new path if it changed
-                if new_kept_path != kept_image:
-                    image_data[new_kept_path] = image_data.pop(kept_image)
-                
-                for path in paths[1:]:
-                    self.move_to_discarded(path, "exact duplicate")
-                    # Remove from image_data to avoid processing again
-                    del image_data[path]
+        # Found before decoding; drop the rows the archive check removed
+        live = store.records['live']
+        duplicate_groups = [group for group in ([row for row in group if live[row]]
+                                                for group in state['duplicate_groups'])
+                            if len(group) > 1]
+        
+        for group in duplicate_groups:
+            if self.quit_requested:
+                break
+            # Keep the first one, move the rest
+            self.log(f"\nFound {len(group)} identical images:")
+            for row in group:
+                self.log(f"  - {store.path(row).name}", also_print=False)
+            
+            # Rename the kept image (first one) to include dimensions
+            kept_row = group[0]
+            kept_info = store.info(kept_row)
+            new_kept_path = self.rename_with_dimensions(store.path(kept_row), kept_info['width'], kept_info['height'])
+            store.rename(kept_row, new_kept_path)
+            
+            for row in group[1:]:
+                self.move_to_discarded(store.path(row), "exact duplicate", keeper=new_kept_path, info=store.info(row))
+                # Remove from the store to avoid processing again
+                store.remove(row)
         
         # Third pass: find scaled versions
         self.log("\nChecking for scaled versions...")
-        remaining_images = list(image_data.keys())
-        moved_images: Set[Path] = set()
-        comparisons_made = 0
-        similar_found = 0
+        remaining_rows = store.rows()
+        if 'edges' in state:
+            edges = [tuple(edge) for edge in state['edges']]
+            candidates_generated, comparisons_made = state['comparisons']
+        else:
+            edges, candidates_generated, comparisons_made = self.find_similar_pairs(remaining_rows, store)
+            self.state.save("plan", edges=edges, comparisons=[candidates_generated, comparisons_made])
+        clusters = self.cluster_similar_images(remaining_rows, store, edges)
         
-        for i, img1 in enumerate(remaining_images):
-            if img1 in moved_images:
-                continue
-                
-            info1 = image_data[img1]
+        for keeper_row, members in clusters:
+            if self.quit_requested:
+                break
+            keeper, keeper_info = store.path(keeper_row), store.info(keeper_row)
+            self.log(f"\nFound {len(members) + 1} scaled versions of the same image:")
+            self.log(f"  - {keeper.name} ({keeper_info['width']}x{keeper_info['height']}) [keeping]")
             
-            for img2 in remaining_images[i+1:]:
-                if img2 in moved_images:
-                    continue
-                    
-                info2 = image_data[img2]
-                comparisons_made += 1
+            discards = []
+            for member_row, confidence, reason in members:
+                if self.quit_requested:
+                    break
+                member, info = store.path(member_row), store.info(member_row)
+                self.log(f"  - {member.name} ({info['width']}x{info['height']}, confidence: {confidence:.0%})")
+                self.log(f"    {reason}")
                 
-                # Check if images are similar
-                is_similar, confidence, reason = self.compare_images(info1, info2)
+                if info['pixels'] == keeper_info['pixels']:
+                    self.log("    Kept: same size as the largest version")
+                    continue
                 
-                if is_similar and info1['pixels'] != info2['pixels']:
-                    similar_found += 1
-                    
-                    # Determine which is smaller
-                    if info1['pixels'] < info2['pixels']:
-                        smaller, larger = img1, img2
-                        smaller_info, larger_info = info1, info2
-                    else:
-                        smaller, larger = img2, img1
-                        smaller_info, larger_info = info2, info1
-                    
-                    self.log(f"\nFound scaled versions (confidence: {confidence:.0%}):")
-                    self.log(f"  - {larger.name} ({larger_info['width']}x{larger_info['height']})")
-                    self.log(f"  - {smaller.name} ({smaller_info['width']}x{smaller_info['height']})")
-                    self.log(f"  {reason}")
-                    
-                    # Ask for confirmation if in interactive mode
-                    should_move = True
-                    if self.interactive:
-                        should_move = self.ask_user_confirmation(
-                            img1, img2, info1, info2, confidence, reason
-                        )
-                    
-                    if should_move:
-                        self.move_to_discarded(smaller, f"smaller version of {larger.name}")
-                        # Rename the kept (larger) image to include dimensions
-                        new_larger_path = self.rename_with_dimensions(larger, larger_info['width'], larger_info['height'])
-                        
-                        # Update image_data with new path if it changed
-                        if new_larger_path != larger:
-                            image_data[new_larger_path] = image_data.pop(larger)
-                            # Update the remaining_images list for future iterations
-                            if larger in remaining_images:
-                                idx = remaining_images.index(larger)
-                                remaining_images[idx] = new_larger_path
-                        
-                        moved_images.add(smaller)
-                        break
-                    else:
-                        self.log("  Skipped by user")
+                # Ask for confirmation if in interactive mode
+                if self.interactive and not self.ask_user_confirmation(
+                        keeper, member, keeper_info, info, confidence, reason):
+                    self.log("  Skipped by user")
+                    self.logger.record("skip", path=member, keeper=keeper, reason="declined by user")
+                    continue
+                discards.append((member, info))
+            
+            if discards:
+                # Plan the keeper's rename first so the moves record its final name
+                keeper = self.rename_with_dimensions(keeper, keeper_info['width'], keeper_info['height'])
+                for member, info in discards:
+                    self.move_to_discarded(member, f"smaller version of {keeper.name}", keeper=keeper, info=info)
         
-        self.log(f"\nScan complete! Made {comparisons_made} comparisons, found {similar_found} similar pairs.")
+        # Apply all planned moves and renames in one batch
+        self.log("")
+        self.state.data['totals'] = [candidates_generated, comparisons_made, len(edges), len(clusters)]
+        self.apply_plan()
+        self._finish_scan(candidates_generated, comparisons_made, len(edges), len(clusters))
+    
+    def _finish_scan(self, candidates_generated: int, comparisons_made: int, pair_count: int, group_count: int):
+        """Log the final summary and drop the checkpoint of the finished scan."""
+        self.state.clear()
+        self.log(f"\nScan complete! Generated {candidates_generated} candidate pairs, "
+                 f"made {comparisons_made} comparisons, found {pair_count} similar pairs in {group_count} groups.")
         
         # Summary
         if not self.dry_run:
@@ -395,6 +3032,248 @@ class ImageScanner:
         self.log(f"  - Images moved to discarded: {discarded_count}")
         self.log(f"  - Images remaining: {remaining_count}")
         self.log(f"  - Log file: {self.log_file.name}")
+        if self.jsonl_file:
+            self.log(f"  - Action log: {self.jsonl_file.name}")
+        if self.journal_file.exists():
+            self.log(f"  - Journal (for --undo): {self.journal_file}")
+        
+        if self.profiler:
+            self.log("\nProfile:\n" + self.profiler.format_table())
+        self.logger.flush()
+    
+    def watch(self, debounce: float = 2.0, poll: bool = False):
+        """
+        Keep deduplicating images as they arrive, until interrupted.
+        
+        The existing images are indexed once (from the hash cache when it is
+        enabled). After that, each new or modified file is analyzed and
+        checked only against the index: exact duplicates through same-sized
+        files, scaled versions through an aspect ratio and pHash lookup.
+        Changes are collected until no event has arrived for debounce
+        seconds, and the moves and renames of each batch are applied
+        together. inotify is used on Linux, and the directory is re-listed
+        every debounce seconds otherwise (or with poll=True).
+        """
+        self.setup_discarded_directory()
+        index = WatchIndex()
+        existing = self.analyze_images(self.iter_images())
+        for row in existing.rows():
+            img_path = existing.path(row)
+            try:
+                index.add(img_path, existing.info(row), img_path.stat())
+            except OSError:
+                continue
+        
+        watcher = None
+        if not poll and sys.platform.startswith("linux"):
+            try:
+                watcher = InotifyWatcher()
+                for directory in self._watched_directories():
+                    watcher.add(directory)
+            except OSError as e:
+                self.log(f"inotify unavailable ({e}), falling back to polling")
+                if watcher:
+                    watcher.close()
+                watcher = None
+        mode = "inotify" if watcher else f"polling every {debounce:g}s"
+        self.log(f"\nWatching {self.directory} for new images ({len(index)} indexed, {mode}). Press Ctrl-C to stop.")
+        self.logger.flush()
+        
+        pending: Set[Path] = set()
+        snapshot = index.snapshot()
+        last_event = time.monotonic()
+        try:
+            while True:
+                if watcher:
+                    events = watcher.read(debounce if pending else 60.0)
+                else:
+                    time.sleep(debounce)
+                    events, snapshot = self._poll_changes(snapshot)
+                
+                for kind, path in events:
+                    if kind == "overflow":
+                        self.log("Event queue overflowed; re-listing the directory")
+                        events.extend(self._poll_changes(index.snapshot())[0])
+                    elif kind == "directory":
+                        if self.recursive and path.name != "discarded":
+                            watcher.add(path)
+                            pending.update(img_path for img_path, _ in self.iter_images(path))
+                    elif path.parent != self.discarded_dir:
+                        pending.add(path)
+                if events:
+                    last_event = time.monotonic()
+                
+                if pending and time.monotonic() - last_event >= debounce:
+                    self._watch_batch(sorted(pending), index)
+                    pending.clear()
+                    if self.quit_requested:
+                        self.log(f"\nWatch stopped ({len(index)} images indexed)")
+                        break
+        except KeyboardInterrupt:
+            self.log(f"\nWatch stopped ({len(index)} images indexed)")
+        finally:
+            if watcher:
+                watcher.close()
+            self.logger.flush()
+    
+    def _watched_directories(self) -> List[Path]:
+        """The scanned directory plus, when recursive, every subdirectory iter_images would enter."""
+        directories = [self.directory]
+        if self.recursive:
+            for root, dirnames, _ in os.walk(self.directory, followlinks=False):
+                dirnames[:] = [name for name in dirnames if name != "discarded"]
+                directories.extend(Path(root) / name for name in dirnames)
+        return directories
+    
+    def _poll_changes(self, previous: Dict[Path, Tuple[int, int]]
+                      ) -> Tuple[List[Tuple[str, Path]], Dict[Path, Tuple[int, int]]]:
+        """
+        Re-list the directory and compare it with a previous {path: (size, mtime_ns)} snapshot.
+        
+        A file still being written shows up as changed on every poll, so it
+        is only processed once a poll finds it unchanged.
+        
+        Returns:
+            Tuple of (events, new snapshot)
+        """
+        snapshot = {img_path: (st.st_size, st.st_mtime_ns) for img_path, st in self.iter_images()}
+        events = [("changed", img_path) for img_path, key in snapshot.items() if previous.get(img_path) != key]
+        events.extend(("removed", img_path) for img_path in previous if img_path not in snapshot)
+        return events, snapshot
+    
+    def _watch_batch(self, paths: List[Path], index: WatchIndex):
+        """Check a batch of new, modified or removed files against the index and apply the result."""
+        started = time.perf_counter()
+        extensions = {ext.lower() for ext in self.image_extensions}
+        analyzed = 0
+        for path in paths:
+            if self.quit_requested:
+                break
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                index.remove(path)
+                continue
+            if path.suffix.lower() not in extensions or index.unchanged(path, st):
+                continue
+            try:
+                info = self.get_image_info(path)
+            except Exception as e:
+                self.log(f"Error processing {path.name}: {e}")
+                self.logger.record("error", path=path, stage="analyze", error=str(e))
+                continue
+            analyzed += 1
+            try:
+                self._watch_check(index.add(path, info, st), index)
+            except OSError as e:
+                # Deleted or unreadable before it could be hashed; keep watching
+                self.log(f"Error checking {path.name}: {e}")
+                self.logger.record("error", path=path, stage="watch", error=str(e))
+        
+        self.apply_plan(checkpoint=False)
+        if analyzed:
+            elapsed = time.perf_counter() - started
+            self.log(f"Processed {analyzed} new images in {elapsed * 1000:.0f} ms "
+                     f"({len(index)} images indexed)")
+        self.logger.flush()
+    
+    def _watch_check(self, idx: int, index: WatchIndex):
+        """Plan moves and renames for one newly indexed image, keeping the existing files where equal."""
+        path, info = index.path(idx), index.info(idx)
+        
+        def file_hash(path: Path) -> str:
+            # Paths of files renamed earlier in the batch don't exist until apply_plan()
+            return self.get_file_hash(self.plan.source(path))
+        
+        for other in index.same_size(idx):
+            if index.file_hash(other, file_hash) != index.file_hash(idx, file_hash):
+                continue
+            keeper, keeper_info = index.path(other), index.info(other)
+            self.log(f"\nNew image {path.name} is identical to {keeper.name}")
+            new_keeper = self.rename_with_dimensions(keeper, keeper_info['width'], keeper_info['height'])
+            index.rename(keeper, new_keeper)
+            self.move_to_discarded(path, "exact duplicate", keeper=new_keeper, info=info)
+            index.remove(path)
+            return
+        
+        candidates = index.similar_candidates(idx, self.threshold)
+        if not candidates:
+            return
+        features = index.store.features([idx] + candidates)
+        is_similar, confidences, reason_codes = self.compare_batch(
+            features, 0, np.arange(1, len(candidates) + 1)
+        )
+        matches = [(candidates[k], float(confidences[k]), self.describe_reason(int(reason_codes[k])))
+                   for k in np.flatnonzero(is_similar)]
+        if not matches:
+            return
+        
+        group = [idx] + [j for j, _, _ in matches]
+        infos = {j: index.info(j) for j in group}
+        keeper_idx = min(group, key=lambda j: (-infos[j]['pixels'], -infos[j]['file_size'], str(index.path(j))))
+        keeper, keeper_info = index.path(keeper_idx), infos[keeper_idx]
+        if keeper_idx == idx:
+            # The new image is the largest version: discard the smaller ones already present
+            discards = [(j, confidence, reason) for j, confidence, reason in matches
+                        if infos[j]['pixels'] < keeper_info['pixels']]
+        else:
+            confidence, reason = next((c, r) for j, c, r in matches if j == keeper_idx)
+            discards = [(idx, confidence, reason)]
+        
+        self.log(f"\nNew image {path.name} ({info['width']}x{info['height']}) matches "
+                 f"{len(matches)} existing image(s); keeping {keeper.name} "
+                 f"({keeper_info['width']}x{keeper_info['height']})")
+        moves = []
+        for j, confidence, reason in discards:
+            if self.quit_requested:
+                break
+            member, member_info = index.path(j), infos[j]
+            self.log(f"  - {member.name} ({member_info['width']}x{member_info['height']}, confidence: {confidence:.0%})")
+            self.log(f"    {reason}")
+            if self.interactive and not self.ask_user_confirmation(
+                    keeper, member, keeper_info, member_info, confidence, reason):
+                self.log("  Skipped by user")
+                self.logger.record("skip", path=member, keeper=keeper, reason="declined by user")
+                continue
+            moves.append((member, member_info))
+        
+        if moves:
+            # Plan the keeper's rename first so the moves record its final name
+            new_keeper = self.rename_with_dimensions(keeper, keeper_info['width'], keeper_info['height'])
+            index.rename(keeper, new_keeper)
+            for member, member_info in moves:
+                self.move_to_discarded(member, f"smaller version of {new_keeper.name}", keeper=new_keeper,
+                                       info=member_info)
+                index.remove(member)
+    
+    def write_profile(self, path: Path):
+        """Write the profiler report plus run settings as JSON for trend tracking."""
+        report = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'directory': str(self.directory),
+            'settings': {
+                'threshold': self.threshold,
+                'workers': self.workers,
+                'full_decode': self.full_decode,
+                'hashes': list(self.hashes),
+                'cascade': self.cascade,
+                'hash_algorithm': self.hash_algorithm,
+                'recursive': self.recursive,
+                'use_cache': self.use_cache,
+                'dry_run': self.dry_run,
+            },
+        }
+        report.update(self.profiler.report())
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parse an --shard value of the form i/N, with 1 <= i <= N."""
+    match = re.fullmatch(r"(\d+)/(\d+)", value.strip())
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"expected i/N with 1 <= i <= N, got '{value}'")
+    return int(match.group(1)), int(match.group(2))
 
 
 def main():
@@ -418,6 +3297,26 @@ Examples:
   # Adjust similarity threshold (lower = more strict)
   uv run image_scanner.py --threshold 5
   
+  # Include subdirectories and WebP/TIFF files
+  uv run image_scanner.py ~/Pictures --recursive --extensions webp,tiff
+  
+  # Analyze images on 8 CPU cores
+  uv run image_scanner.py --workers 8
+  
+  # Keep running and deduplicate images as they are dropped into the folder
+  uv run image_scanner.py /srv/ingest --watch
+  
+  # Discard images that already exist (at the same or a larger size) in an archive
+  uv run image_index.py build /archive -o archive.idx
+  uv run image_scanner.py ~/Downloads --against archive.idx
+  
+  # Split the analysis of a large archive over 4 processes or hosts, then merge
+  for i in 1 2 3 4; do uv run image_scanner.py /archive -r --shard $i/4 & done; wait
+  uv run image_scanner.py /archive -r --merge --dry-run
+  
+  # Put back everything a previous run moved or renamed
+  uv run image_scanner.py --undo image_scan_20250101_120000.journal
+  
   # Combine options
   uv run image_scanner.py ~/Pictures --threshold 8 --interactive --dry-run
         """
@@ -449,21 +3348,250 @@ Examples:
         help="Ask for confirmation before moving scaled versions"
     )
     
+    parser.add_argument(
+        "--recursive", "-r",
+        action="store_true",
+        help="Also scan subdirectories (any 'discarded' folder is skipped)"
+    )
+    
+    parser.add_argument(
+        "--extensions",
+        type=lambda value: [ext.strip() for ext in value.split(",") if ext.strip()],
+        default=[],
+        help="Comma-separated extra extensions to scan, e.g. webp,tiff,heic (HEIC needs pillow-heif)"
+    )
+    
+    parser.add_argument(
+        "--workers", "-j",
+        type=int,
+        default=1,
+        help="Number of processes used to analyze images (default: 1)"
+    )
+    
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Read up to N files ahead concurrently and hash each from memory (helps on SMB/NFS; default: off)"
+    )
+    
+    parser.add_argument(
+        "--prefetch-memory",
+        type=int,
+        default=PREFETCH_MEMORY // (1024 * 1024),
+        metavar="MB",
+        help=f"Most file data held by --prefetch at once (default: {PREFETCH_MEMORY // (1024 * 1024)} MB)"
+    )
+    
+    parser.add_argument(
+        "--full-decode",
+        action="store_true",
+        help="Hash images at full resolution instead of a reduced working size (slower, exact imagehash values)"
+    )
+    
+    parser.add_argument(
+        "--hashes",
+        type=lambda value: [field.strip() for field in value.split(",") if field.strip()],
+        default=list(HASH_FIELDS),
+        help="Comma-separated perceptual hashes to compute (default: phash,dhash,whash,ahash). "
+             "phash and dhash decide similarity and are required; whash and ahash only refine the "
+             "confidence, and leaving out whash saves the most time"
+    )
+    
+    parser.add_argument(
+        "--cascade",
+        action="store_true",
+        help="Compute pHash only for images whose dHash leaves a possible match, and the other "
+             "hashes only for images in similar pairs"
+    )
+    
+    parser.add_argument(
+        "--hash-algorithm",
+        choices=HASH_ALGORITHMS,
+        default="md5",
+        help="Content hash used to confirm exact duplicates (default: md5; blake2b is faster on 64-bit CPUs)"
+    )
+    
+    parser.add_argument(
+        "--io-threads",
+        type=int,
+        default=1,
+        help="Number of threads used to move and rename files (default: 1; helps on network drives)"
+    )
+    
+    parser.add_argument(
+        "--against",
+        metavar="INDEX",
+        help="Also discard copies and smaller versions of images in a feature index built with image_index.py"
+    )
+    
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        metavar="I/N",
+        help="Only analyze the I-th of N deterministic subsets of the images and write their features "
+             "to a shard file for --merge, without moving anything"
+    )
+    
+    parser.add_argument(
+        "--shard-output",
+        metavar="FILE",
+        help="Shard file written by --shard (default: image_scan_shard_I_of_N.idx in the scanned directory)"
+    )
+    
+    parser.add_argument(
+        "--merge",
+        nargs="*",
+        metavar="SHARD",
+        help="Deduplicate using the features in the shard files of all N shards instead of analyzing "
+             "the images (default: the image_scan_shard_*.idx files in the scanned directory); "
+             "listing options, decoding and content hash are taken from the shards"
+    )
+    
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="After the scan, keep running and deduplicate new images as they arrive (Ctrl-C to stop)"
+    )
+    
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=2.0,
+        metavar="SECONDS",
+        help="In --watch mode, wait this long after the last change before processing a batch (default: 2)"
+    )
+    
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="In --watch mode, re-list the directory instead of using inotify (e.g. for network shares)"
+    )
+    
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted scan from its last checkpoint (.image_scan_state.json)"
+    )
+    
+    parser.add_argument(
+        "--undo",
+        metavar="JOURNAL",
+        help="Reverse the moves and renames recorded in a journal from a previous run, then exit"
+    )
+    
+    parser.add_argument(
+        "--json-log",
+        action="store_true",
+        help="Also write a JSON Lines record for every move, rename, skip and error"
+    )
+    
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print per-phase timing, throughput and memory statistics at the end of the scan"
+    )
+    
+    parser.add_argument(
+        "--profile-json",
+        metavar="FILE",
+        help="Write the profile report as JSON to FILE (implies --profile)"
+    )
+    
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ignore and don't update the hash cache (.image_scan_cache.sqlite)"
+    )
+    
     args = parser.parse_args()
     
+    if args.undo:
+        journal = Path(args.undo)
+        if not journal.is_file():
+            print(f"Error: '{args.undo}' is not a journal file")
+            return 1
+        ImageScanner(journal.parent, json_log=args.json_log).undo(journal)
+        return 0
+    
     # Validate directory
     if not os.path.isdir(args.directory):
         print(f"Error: '{args.directory}' is not a valid directory")
         return 1
     
+    if args.against and not os.path.isfile(args.against):
+        print(f"Error: '{args.against}' is not an index file")
+        return 1
+    
+    unknown = [field for field in args.hashes if field not in HASH_FIELDS]
+    missing = [field for field in GATE_HASHES if field not in args.hashes]
+    if unknown or missing:
+        print(f"Error: --hashes takes a subset of {','.join(HASH_FIELDS)} that includes {' and '.join(GATE_HASHES)}")
+        return 1
+    
+    if args.shard and (args.merge is not None or args.watch or args.against or args.cascade
+                       or len(args.hashes) < len(HASH_FIELDS)):
+        print("Error: --shard computes every hash and moves nothing; it cannot be combined with "
+              "--merge, --watch, --against, --cascade or --hashes")
+        return 1
+    
+    shards = None
+    if args.merge is not None:
+        shards = ([Path(path) for path in args.merge]
+                  or sorted(Path(args.directory).glob("image_scan_shard_*_of_*.idx")))
+        if not shards:
+            print(f"Error: no shard files (image_scan_shard_*.idx) found in '{args.directory}'")
+            return 1
+        try:
+            header = open_shards(shards)[0].header
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            return 1
+        args.recursive = header['recursive']
+        args.extensions = header['extensions']
+        args.full_decode = header['variant'] == 'full'
+        args.hash_algorithm = header['hash_algorithm']
+    
+    if {ext.lower().lstrip('.') for ext in args.extensions} & {'heic', 'heif'} and not enable_heif():
+        print("Warning: HEIC/HEIF files need the pillow-heif package (pip install pillow-heif)")
+    
     # Run scanner
     scanner = ImageScanner(
         args.directory, 
         threshold=args.threshold,
         dry_run=args.dry_run,
-        interactive=args.interactive
+        interactive=args.interactive,
+        use_cache=not args.no_cache,
+        workers=args.workers,
+        full_decode=args.full_decode,
+        hash_algorithm=args.hash_algorithm,
+        recursive=args.recursive,
+        extra_extensions=args.extensions,
+        json_log=args.json_log,
+        profile=args.profile or bool(args.profile_json),
+        io_threads=args.io_threads,
+        resume=args.resume,
+        against=args.against,
+        prefetch=args.prefetch,
+        prefetch_memory=args.prefetch_memory * 1024 * 1024,
+        hashes=args.hashes,
+        cascade=args.cascade,
+        shard=args.shard,
+        shards=shards
     )
+    if args.shard:
+        number, count = args.shard
+        output = args.shard_output or Path(args.directory) / f"image_scan_shard_{number}_of_{count}.idx"
+        scanner.write_shard(Path(output))
+        if args.profile_json:
+            scanner.write_profile(Path(args.profile_json))
+        return 0
     scanner.scan_for_duplicates()
+    if args.profile_json:
+        scanner.write_profile(Path(args.profile_json))
+    if args.watch and not scanner.quit_requested:
+        scanner.watch(debounce=args.debounce, poll=args.poll)
     
     return 0
 
@@ -9,75 +9,221 @@ Review Discarded Images
 Shows information about images in the discarded folder to help you verify the scanner's decisions.
 
 Usage:
-    uv run review_discarded.py [directory]
+    uv run review_discarded.py [directory] [--json] [--threads N]
 """
 
+import json
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from PIL import Image
+from typing import Dict, List, Optional, Tuple
 import argparse
 
 
-def review_discarded_folder(directory: Path):
-    """Review images in the discarded folder."""
+IMAGE_SUFFIXES = {'.png', '.jpg', '.jpeg'}
+
+
+def read_journals(directory: Path) -> Dict[str, Dict]:
+    """
+    Collect the moves into the discarded folder recorded in the scanner's journals.
+
+    Args:
+        directory: Scanned directory containing image_scan_*.journal files
+
+    Returns:
+        Dict mapping the name of each discarded file to its planned move
+        (source, keeper, reason, width, height, file_size). Only moves the
+        journal records as done are included, since an interrupted or failed
+        run leaves planned moves that never happened. Newer journals take
+        precedence when a name was used by more than one run.
+    """
+    moves = {}
+    journals = sorted(directory.glob("image_scan_*.journal"), key=lambda x: x.stat().st_mtime)
+    for journal in journals:
+        planned = {}
+        done = set()
+        try:
+            with open(journal) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if entry.get('op') != 'move':
+                        continue
+                    if entry.get('status') == 'planned':
+                        planned[entry['source'], entry['dest']] = entry
+                    elif entry.get('status') == 'done':
+                        done.add((entry['source'], entry['dest']))
+        except (OSError, ValueError) as e:
+            print(f"Error reading {journal.name}: {e}", file=sys.stderr)
+        for key, entry in planned.items():
+            if key in done:
+                moves[Path(entry['dest']).name] = entry
+    return moves
+
+
+def read_header(img_path: Path) -> Tuple[int, int, int]:
+    """Return (width, height, file_size) of an image, reading only its header."""
+    # Imported here so that --help does not load Pillow
+    from PIL import Image
+
+    with Image.open(img_path) as img:
+        width, height = img.size
+    return width, height, img_path.stat().st_size
+
+
+def collect_discarded(discarded_dir: Path, moves: Dict[str, Dict], threads: int = 8,
+                      extensions: Optional[List[str]] = None) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Describe every image in the discarded folder.
+
+    Dimensions and sizes come from the journal when it recorded the move;
+    the remaining images have their headers read on a thread pool.
+
+    Args:
+        discarded_dir: The discarded folder
+        moves: Journal moves from read_journals()
+        threads: Number of threads reading image headers
+        extensions: Extra extensions to include, e.g. ['webp']
+
+    Returns:
+        Tuple of (files, errors), both lists of dicts sorted by name
+    """
+    suffixes = IMAGE_SUFFIXES | {f".{ext.lower().lstrip('.')}" for ext in extensions or []}
+    files = []
+    unrecorded = []
+    with os.scandir(discarded_dir) as entries:
+        for entry in entries:
+            move = moves.get(entry.name)
+            if move is not None and move.get('width') is not None:
+                files.append({
+                    'name': entry.name,
+                    'width': move['width'],
+                    'height': move['height'],
+                    'file_size': move['file_size'],
+                    'source': move['source'],
+                    'keeper': move.get('keeper'),
+                    'reason': move.get('reason'),
+                })
+            elif os.path.splitext(entry.name)[1].lower() in suffixes and entry.is_file():
+                unrecorded.append(Path(entry.path))
+
+    def describe(img_path: Path) -> Dict:
+        move = moves.get(img_path.name, {})
+        try:
+            width, height, file_size = read_header(img_path)
+        except Exception as e:
+            return {'name': img_path.name, 'error': str(e)}
+        return {
+            'name': img_path.name,
+            'width': width,
+            'height': height,
+            'file_size': file_size,
+            'source': move.get('source'),
+            'keeper': move.get('keeper'),
+            'reason': move.get('reason'),
+        }
+
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        for result in executor.map(describe, unrecorded):
+            (errors if 'error' in result else files).append(result)
+
+    files.sort(key=lambda x: x['name'])
+    errors.sort(key=lambda x: x['name'])
+    return files, errors
+
+
+def group_by_resolution(files: List[Dict]) -> List[Dict]:
+    """Group file descriptions by (width, height), largest resolution first."""
+    groups: Dict[Tuple[int, int], List[Dict]] = {}
+    for info in files:
+        groups.setdefault((info['width'], info['height']), []).append(info)
+    return [
+        {'width': width, 'height': height, 'count': len(groups[width, height]),
+         'files': groups[width, height]}
+        for width, height in sorted(groups, key=lambda x: (x[0] * x[1], x), reverse=True)
+    ]
+
+
+def review_discarded_folder(directory: Path, threads: int = 8, as_json: bool = False,
+                            extensions: Optional[List[str]] = None) -> int:
+    """
+    Review images in the discarded folder.
+
+    Args:
+        directory: Directory containing the discarded folder
+        threads: Number of threads reading the headers of images the journals don't cover
+        as_json: Print the report as JSON instead of text
+        extensions: Extra extensions to include, e.g. ['webp']
+
+    Returns:
+        Exit code
+    """
     discarded_dir = directory / "discarded"
-    
+
     if not discarded_dir.exists():
-        print("No 'discarded' folder found. Run the image scanner first.")
-        return
-    
-    images = list(discarded_dir.glob("*.png")) + list(discarded_dir.glob("*.jpg")) + list(discarded_dir.glob("*.jpeg"))
-    images.extend(list(discarded_dir.glob("*.PNG")) + list(discarded_dir.glob("*.JPG")) + list(discarded_dir.glob("*.JPEG")))
-    
-    if not images:
+        print("No 'discarded' folder found. Run the image scanner first.", file=sys.stderr if as_json else None)
+        return 1 if as_json else 0
+
+    moves = read_journals(directory)
+    files, errors = collect_discarded(discarded_dir, moves, threads, extensions)
+    resolutions = group_by_resolution(files)
+    total_size = sum(info['file_size'] for info in files)
+
+    journals = list(directory.glob("image_scan_*.journal"))
+    latest_journal = max(journals, key=lambda x: x.stat().st_mtime) if journals else None
+
+    if as_json:
+        json.dump({
+            'directory': str(directory.resolve()),
+            'total_images': len(files),
+            'total_size': total_size,
+            'from_journal': sum(1 for info in files if info['reason'] is not None),
+            'resolutions': resolutions,
+            'errors': errors,
+            'journal': latest_journal.name if latest_journal else None,
+        }, sys.stdout, indent=2)
+        print()
+        return 0
+
+    if not files and not errors:
         print("No images found in the discarded folder.")
-        return
-    
-    print(f"Found {len(images)} images in discarded folder:")
+        return 0
+
+    print(f"Found {len(files) + len(errors)} images in discarded folder:")
     print("-" * 80)
-    
-    # Group by size
-    size_groups = {}
-    total_size = 0
-    
-    for img_path in sorted(images):
-        try:
-            with Image.open(img_path) as img:
-                width, height = img.size
-                pixels = width * height
-                file_size = img_path.stat().st_size
-                total_size += file_size
-                
-                size_key = f"{width}x{height}"
-                if size_key not in size_groups:
-                    size_groups[size_key] = []
-                size_groups[size_key].append((img_path.name, file_size))
-                
-        except Exception as e:
-            print(f"Error reading {img_path.name}: {e}")
-    
+    for error in errors:
+        print(f"Error reading {error['name']}: {error['error']}")
+
     # Display by resolution
     print("\nImages grouped by resolution:")
-    for size_key in sorted(size_groups.keys(), key=lambda x: int(x.split('x')[0]) * int(x.split('x')[1]), reverse=True):
-        files = size_groups[size_key]
-        print(f"\n{size_key} ({len(files)} files):")
-        for filename, file_size in sorted(files):
-            print(f"  - {filename} ({file_size/1024:.1f} KB)")
-    
+    for group in resolutions:
+        print(f"\n{group['width']}x{group['height']} ({group['count']} files):")
+        for info in group['files']:
+            print(f"  - {info['name']} ({info['file_size']/1024:.1f} KB)")
+            if info['reason'] is not None:
+                # Most reasons already name the keeper
+                keeper = info['keeper'] and Path(info['keeper']).name
+                suffix = f" of {keeper}" if keeper and keeper not in info['reason'] else ""
+                print(f"      {info['reason']}{suffix}")
+
     print("\n" + "-" * 80)
     print(f"Total space in discarded folder: {total_size/1024/1024:.1f} MB")
-    print(f"Total images: {len(images)}")
-    
+    print(f"Total images: {len(files) + len(errors)}")
+
     # Find the most recent log file
     log_files = list(directory.glob("image_scan_*.log"))
     if log_files:
         most_recent = max(log_files, key=lambda x: x.stat().st_mtime)
         print(f"\nMost recent log file: {most_recent.name}")
         print("Review this log for detailed information about why images were moved.")
-    
+
+    if latest_journal:
+        print(f"\nTo undo the most recent run (moves and renames): uv run image_scanner.py --undo {latest_journal.resolve()}")
     print("\nTo recover all images: mv discarded/* .")
     print("To recover specific image: mv discarded/IMAGE_NAME .")
     print("To permanently delete: rm -rf discarded/")
+    return 0
 
 
 def main():
@@ -85,24 +231,41 @@ def main():
         description="Review images in the discarded folder",
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
-    
+
     parser.add_argument(
         "directory",
         nargs="?",
         default=".",
         help="Directory containing the discarded folder (default: current directory)"
     )
-    
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print the report as JSON"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=8,
+        help="Threads reading headers of images not recorded in a journal (default: 8)"
+    )
+    parser.add_argument(
+        "--extensions",
+        type=lambda value: [ext.strip() for ext in value.split(",") if ext.strip()],
+        default=[],
+        help="Comma-separated extra extensions to include, e.g. webp,tiff"
+    )
+
     args = parser.parse_args()
-    
+
     directory = Path(args.directory)
     if not directory.is_dir():
         print(f"Error: '{directory}' is not a valid directory")
         return 1
-    
-    review_discarded_folder(directory)
-    return 0
+
+    return review_discarded_folder(directory, threads=args.threads, as_json=args.json,
+                                   extensions=args.extensions)
 
 
 if __name__ == "__main__":
-    exit(main())
\ No newline at end of file
+    exit(main())
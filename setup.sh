@@ -21,6 +21,8 @@ fi
 chmod +x image_scanner.py
 chmod +x compare_images.py
 chmod +x review_discarded.py
+chmod +x benchmark.py
+chmod +x image_index.py
 
 echo ""
 echo "✅ Setup complete! The scripts are ready to use."
@@ -40,7 +42,7 @@ echo "2. Compare two specific images:"
 echo "   uv run compare_images.py image1.jpg image2.jpg"
 echo ""
 echo "3. Review what was moved to discarded:"
-echo "   uv run review_discarded.py [directory]"
+echo "   uv run review_discarded.py [directory] [--json]"
 echo ""
 echo "Examples:"
 echo "---------"
@@ -0,0 +1,57 @@
+"""Shared fixtures: a small synthetic corpus built with benchmark.generate_corpus."""
+
+import shutil
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance
+
+# The tools are flat scripts in the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmark import MANIFEST, _base_image, generate_corpus  # noqa: E402
+
+CORPUS_SIZE = 40
+CORPUS_SEED = 3
+# Originals that also get edited half-size variants
+EDITED_FAMILIES = 8
+
+
+def add_edited_variants(directory: Path, seed: int):
+    """
+    Save half-size variants of some originals with a growing region replaced
+    (and some brightened), so that pairs fall on both sides of the default
+    threshold instead of only far from it as in the benchmark corpus.
+    """
+    rng = np.random.default_rng(seed)
+    for path in sorted(directory.glob("*_original.jpg"))[:EDITED_FAMILIES]:
+        family = path.stem.split("_")[0]
+        with Image.open(path) as img:
+            img = img.convert("RGB")
+        width, height = img.size
+        for step in range(1, 5):
+            edited = img.resize((width // 2, height // 2), Image.LANCZOS)
+            edited.paste(_base_image(rng, (edited.width * step // 10 + 1, edited.height)), (0, 0))
+            if step % 2:
+                edited = ImageEnhance.Brightness(edited).enhance(1.0 + 0.05 * step)
+            edited.save(directory / f"{family}_edit{step}.jpg", quality=85)
+
+
+@pytest.fixture(scope="session")
+def corpus_template(tmp_path_factory) -> Path:
+    """Corpus generated once per session; tests work on copies of it."""
+    directory = tmp_path_factory.mktemp("corpus")
+    generate_corpus(directory, CORPUS_SIZE, CORPUS_SEED)
+    (directory / MANIFEST).unlink()
+    add_edited_variants(directory, CORPUS_SEED)
+    return directory
+
+
+@pytest.fixture
+def corpus(corpus_template: Path, tmp_path: Path) -> Path:
+    """A fresh copy of the corpus that the test may modify."""
+    directory = tmp_path / "images"
+    shutil.copytree(corpus_template, directory)
+    return directory
@@ -0,0 +1,22 @@
+"""Helpers shared by the test modules."""
+
+import hashlib
+from pathlib import Path
+from typing import Dict
+
+from image_scanner import ImageScanner
+
+
+def make_scanner(directory: Path, work_dir: Path, **options) -> ImageScanner:
+    """Scanner without the hash cache, keeping its logs and journal in work_dir."""
+    work_dir.mkdir(parents=True, exist_ok=True)
+    options.setdefault('use_cache', False)
+    return ImageScanner(str(directory), work_dir=work_dir, **options)
+
+
+def layout(directory: Path) -> Dict[str, str]:
+    """Relative path -> MD5 of every file under directory."""
+    return {
+        path.relative_to(directory).as_posix(): hashlib.md5(path.read_bytes()).hexdigest()
+        for path in sorted(directory.rglob("*")) if path.is_file()
+    }
@@ -0,0 +1,45 @@
+"""Tests for analyze_unique_images and the partner check of lazy analysis."""
+
+import re
+import shutil
+
+import numpy as np
+
+from helpers import make_scanner
+from image_scanner import AspectRatioIndex, have_partners
+
+
+def test_have_partners_matches_aspect_ratio_index():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        n = int(rng.integers(1, 40))
+        # Ratios on and around the tolerance edges, as rounded by get_image_header
+        ratios = np.round(rng.choice([0.75, 1.0, 1.323, 1.333, 1.343, 1.5], n)
+                          + rng.choice([-0.001, 0.0, 0.001, 0.01], n), 3)
+        pixels = rng.choice([100, 200, 400], n).astype(np.int64)
+        index = AspectRatioIndex(ratios.tolist(), pixels.tolist())
+        expected = [index.has_partner(k) for k in range(n)]
+        assert have_partners(ratios, pixels).tolist() == expected
+
+
+def test_unique_images_renumbered_without_failures(corpus, tmp_path, capsys):
+    original = sorted(corpus.glob("*_original.jpg"))[0]
+    shutil.copy(original, corpus / "zz_copy.jpg")
+    (corpus / "broken.jpg").write_bytes(b"not an image")
+    scanner = make_scanner(corpus, tmp_path / "work")
+    listed = [path for path, _ in scanner.iter_images()]
+
+    store, groups = scanner.analyze_unique_images(scanner.iter_images())
+    # Identical copies are not analyzed, and the broken file fails
+    analyzed, found = map(int, re.search(r"Analyzed (\d+) of (\d+)", capsys.readouterr().out).groups())
+    assert analyzed == found - 1
+    assert found == len(listed) - sum(len(group) - 1 for group in groups)
+
+    assert [store.path(row) for row in store.rows()] == [path for path in listed
+                                                        if path.name != "broken.jpg"]
+    copies = [group for group in groups if corpus / "zz_copy.jpg" in map(store.path, group)]
+    assert len(copies) == 1
+    rows = copies[0]
+    assert {store.path(row) for row in rows} >= {original, corpus / "zz_copy.jpg"}
+    assert len({bytes(store.records['digest'][row]) for row in rows}) == 1
+    assert all(store.info(row) == store.info(rows[0]) for row in rows)
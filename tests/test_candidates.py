@@ -0,0 +1,61 @@
+"""find_similar_pairs must find exactly the pairs an all-pairs compare_images loop finds."""
+
+from typing import Dict, Tuple
+
+import pytest
+
+from helpers import make_scanner
+from image_scanner import ImageScanner, get_image_info
+
+
+def similar_pairs(scanner: ImageScanner) -> Dict[Tuple[str, str], Tuple[float, str]]:
+    """
+    Edges find_similar_pairs finds among the images a scan compares (one
+    file of each identical group), keyed by the two file names.
+    """
+    store, duplicate_groups = scanner.analyze_unique_images(scanner.iter_images())
+    for group in duplicate_groups:
+        for row in group[1:]:
+            store.remove(row)
+    rows = store.rows()
+    edges, _, _ = scanner.find_similar_pairs(rows, store)
+    return {
+        (store.path(rows[i]).name, store.path(rows[j]).name): (confidence, scanner.describe_reason(code))
+        for i, j, confidence, code in edges
+    }
+
+
+def all_pairs(scanner: ImageScanner, names) -> Dict[Tuple[str, str], Tuple[float, str]]:
+    """Similar pairs by comparing every pair with compare_images, as the original scan did."""
+    infos = [get_image_info(scanner.directory / name, scanner.full_decode) for name in names]
+    pairs = {}
+    for a, info1 in enumerate(infos):
+        for b in range(a + 1, len(infos)):
+            info2 = infos[b]
+            is_similar, confidence, reason = scanner.compare_images(info1, info2)
+            if is_similar and info1['pixels'] != info2['pixels']:
+                pairs[names[a], names[b]] = (confidence, reason)
+    return pairs
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {'workers': 2},
+    {'prefetch': 4},
+    {'cascade': True},
+    {'full_decode': True},
+], ids=["default", "workers", "prefetch", "cascade", "full_decode"])
+def test_similar_pairs_match_all_pairs_comparison(corpus, tmp_path, options):
+    scanner = make_scanner(corpus, tmp_path / "work", **options)
+    found = similar_pairs(scanner)
+
+    store, duplicate_groups = scanner.analyze_unique_images(scanner.iter_images())
+    copies = {row for group in duplicate_groups for row in group[1:]}
+    names = [store.path(row).name for row in store.rows() if row not in copies]
+    expected = all_pairs(scanner, names)
+
+    assert expected, "the corpus should contain scaled versions"
+    assert found.keys() == expected.keys()
+    for pair, (confidence, reason) in expected.items():
+        assert found[pair][0] == pytest.approx(confidence, abs=1e-6)
+        assert found[pair][1] == reason
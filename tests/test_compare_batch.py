@@ -0,0 +1,53 @@
+"""Tests for compare_images.py --batch and its threshold suggestion."""
+
+import csv
+import sys
+
+import numpy as np
+
+import compare_images
+from helpers import make_scanner
+from image_scanner import get_image_info
+
+
+def test_min_thresholds_follow_the_decision_rule(corpus, tmp_path):
+    paths = sorted(corpus.glob("f00000[0-5]_*.jpg"))
+    paths, features = compare_images.hash_images(paths)
+    needed = compare_images.min_thresholds(compare_images.distance_matrices(features), features)
+    infos = [get_image_info(path) for path in paths]
+    for threshold in (5, 10, 20):
+        scanner = make_scanner(corpus, tmp_path / "work", threshold=threshold)
+        for a in range(len(paths)):
+            for b in range(a + 1, len(paths)):
+                is_similar = scanner.compare_images(infos[a], infos[b])[0]
+                assert is_similar == (needed[a, b] <= threshold), (paths[a].name, paths[b].name)
+
+
+def test_suggestion_without_labels_splits_the_gap():
+    # Four pairs of versions 2-3 apart and two unrelated images 30 apart
+    needed = np.full((10, 10), 40, dtype=np.uint8)
+    for k, distance in enumerate((2, 3, 2, 3, 30)):
+        needed[2 * k, 2 * k + 1] = needed[2 * k + 1, 2 * k] = distance
+    threshold, method, scores = compare_images.suggest_threshold(needed)
+    assert threshold == (3 + 30) // 2
+    assert "no labels" in method and scores is None
+
+
+def test_batch_with_labels(corpus, tmp_path, monkeypatch, capsys):
+    labels = tmp_path / "labels.csv"
+    with open(labels, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "label"])
+        writer.writerows((path.name, path.name.split("_")[0]) for path in sorted(corpus.glob("*.jpg")))
+    output = tmp_path / "distances.csv"
+    monkeypatch.setattr(sys, "argv", ["compare_images.py", "--batch", str(corpus),
+                                      "--labels", str(labels), "-o", str(output)])
+    assert compare_images.main() == 0
+
+    printed = capsys.readouterr().out
+    assert "Suggested threshold: --threshold" in printed and "labelled pairs" in printed
+    with open(output, newline='') as f:
+        rows = list(csv.DictReader(f))
+    count = len(list(corpus.glob("*.jpg")))
+    assert len(rows) == count * (count - 1) // 2
+    assert all(0 <= int(row['min_threshold']) <= 255 for row in rows)
@@ -0,0 +1,69 @@
+"""Tests for feature index files and scanning against them (--against)."""
+
+import os
+import shutil
+
+from helpers import make_scanner
+from image_scanner import FeatureIndex
+
+
+def test_feature_index_round_trip(corpus, tmp_path):
+    (corpus / "sub").mkdir()
+    first = sorted(corpus.glob("*.jpg"))[0]
+    first.rename(corpus / "sub" / os.fsdecode(b"caf\xe9.jpg"))
+
+    scanner = make_scanner(corpus, tmp_path / "work", recursive=True)
+    store = scanner.analyze_images(scanner.iter_images())
+    entries = scanner.index_entries(store)
+    index_path = tmp_path / "archive.idx"
+    written = FeatureIndex.write(index_path, corpus, entries, 'md5', 'draft', extra={'note': 'test'})
+
+    index = FeatureIndex(index_path)
+    assert written == len(index) == len(entries) == len(store)
+    assert index.header['note'] == 'test'
+    assert index.root == corpus
+    by_name = {index.name(record): record for record in range(len(index))}
+    for img_path, info, digest, mtime_ns in entries:
+        record = by_name[img_path.relative_to(corpus).as_posix()]
+        assert index.path_of(record) == img_path
+        assert index.info(record) == info
+        assert int(index.mtime_ns[record]) == mtime_ns
+        assert bytes(index.records['digest'][record]) == FeatureIndex.digest(digest)
+        assert record in index.same_size(info['file_size'])
+        assert record in index.candidates(info['aspect_ratio'], int(info['phash'], 16), 0)
+
+
+def test_scan_against_own_index_plans_like_a_plain_scan(corpus, tmp_path):
+    indexer = make_scanner(corpus, tmp_path / "index")
+    index_path = tmp_path / "own.idx"
+    FeatureIndex.write(index_path, corpus, indexer.index_entries(indexer.analyze_images(indexer.iter_images())),
+                       'md5', 'draft')
+
+    plain = make_scanner(corpus, tmp_path / "plain", dry_run=True)
+    plain.scan_for_duplicates()
+
+    against = make_scanner(corpus, tmp_path / "against", dry_run=True, against=index_path)
+    against.scan_for_duplicates()
+    assert not any("indexed" in op.get('reason', '') for op in against.plan)
+    assert against.plan.to_records() == plain.plan.to_records()
+
+
+def test_declined_matches_are_not_counted(corpus, tmp_path, monkeypatch, capsys):
+    archive = tmp_path / "archive"
+    archive.mkdir()
+    for path in corpus.glob("*_original.jpg"):
+        shutil.copy2(path, archive / path.name)
+    indexer = make_scanner(archive, tmp_path / "index")
+    index_path = tmp_path / "archive.idx"
+    FeatureIndex.write(index_path, archive, indexer.index_entries(indexer.analyze_images(indexer.iter_images())),
+                       'md5', 'draft')
+
+    prompts = []
+    monkeypatch.setattr('builtins.input', lambda prompt: prompts.append(prompt) or 'n')
+    scanner = make_scanner(corpus, tmp_path / "work", dry_run=True, interactive=True, against=index_path)
+    scanner.scan_for_duplicates()
+
+    planned = sum(1 for op in scanner.plan if op['op'] == 'move' and op['keeper'].parent == archive)
+    images = sum(1 for _ in scanner.iter_images())
+    assert prompts and planned
+    assert f"Matched {planned} of {images} images against the index" in capsys.readouterr().out
@@ -0,0 +1,63 @@
+"""Tests for HashCache, the persistent cache of get_image_info results."""
+
+import os
+import sqlite3
+from pathlib import Path
+
+import image_scanner
+from helpers import make_scanner
+from image_scanner import HashCache
+from test_resume import count_calls
+
+
+def cached_paths(scanner):
+    """Paths of the entries in the scanner's hash cache, sorted."""
+    conn = sqlite3.connect(scanner.cache_file)
+    try:
+        return [Path(path) for path, in conn.execute("SELECT path FROM images ORDER BY path")]
+    finally:
+        conn.close()
+
+
+def test_cache_entries_follow_renames_and_drop_changes(corpus, tmp_path):
+    path = sorted(corpus.glob("*.jpg"))[0]
+    info = image_scanner.get_image_info(path)
+    cache = HashCache(tmp_path / "cache.sqlite", variant="reduced")
+    cache.put(path, HashCache.key(path.stat()), info)
+    assert HashCache(tmp_path / "cache.sqlite", variant="full").get(path, HashCache.key(path.stat())) is None
+
+    renamed = path.with_name("renamed.jpg")
+    path.rename(renamed)
+    assert cache.get(renamed, HashCache.key(renamed.stat())) == info
+
+    with open(renamed, 'ab') as f:
+        f.write(b"\0")
+    assert cache.get(renamed, HashCache.key(renamed.stat())) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_second_scan_is_served_from_cache_and_prunes(corpus, tmp_path, monkeypatch):
+    work = tmp_path / "work"
+    with monkeypatch.context() as patch:
+        decoded = count_calls(patch, image_scanner, '_extract_worker')
+        make_scanner(corpus, work, dry_run=True, use_cache=True).scan_for_duplicates()
+    assert decoded
+    scanner = make_scanner(corpus, work, dry_run=True, use_cache=True)
+    cached = cached_paths(scanner)
+    assert len(cached) == len(decoded)
+
+    with monkeypatch.context() as patch:
+        decoded = count_calls(patch, image_scanner, '_extract_worker')
+        scanner.scan_for_duplicates()
+    assert not decoded
+
+    # A changed file is decoded again; the entries of changed and deleted files are pruned
+    changed, deleted = cached[:2]
+    st = changed.stat()
+    os.utime(changed, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    deleted.unlink()
+    with monkeypatch.context() as patch:
+        decoded = count_calls(patch, image_scanner, '_extract_worker')
+        make_scanner(corpus, work, dry_run=True, use_cache=True).scan_for_duplicates()
+    assert [os.path.basename(call[0]) for call in decoded] == [changed.name]
+    assert cached_paths(scanner) == [path for path in cached if path != deleted]
@@ -0,0 +1,44 @@
+"""Worker processes must register the HEIF opener themselves when HEIC files are scanned."""
+
+import os
+import shutil
+
+import pytest
+
+import compare_images
+from helpers import make_scanner
+
+
+@pytest.fixture
+def registrations(tmp_path, monkeypatch):
+    """A stand-in pillow_heif whose register_heif_opener records the calling process."""
+    log = tmp_path / "registrations"
+    package = tmp_path / "stub"
+    package.mkdir()
+    (package / "pillow_heif.py").write_text(
+        "import os\n\n"
+        "def register_heif_opener():\n"
+        f"    with open({str(log)!r}, 'a') as f:\n"
+        "        f.write(f'{os.getpid()}\\n')\n"
+    )
+    monkeypatch.syspath_prepend(str(package))
+    # Workers started with spawn rebuild sys.path from the environment
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join(filter(None, [str(package), os.environ.get("PYTHONPATH")])))
+
+    def processes():
+        return set(log.read_text().split()) - {str(os.getpid())} if log.exists() else set()
+    return processes
+
+
+@pytest.mark.parametrize("extensions", [(), ("heic",)], ids=["jpeg", "heic"])
+def test_scanner_workers_register_heif(corpus, tmp_path, registrations, extensions):
+    make_scanner(corpus, tmp_path / "work", dry_run=True, workers=2,
+                 extra_extensions=extensions).scan_for_duplicates()
+    assert bool(registrations()) == bool(extensions)
+
+
+def test_compare_batch_workers_register_heif(corpus, registrations):
+    paths = sorted(corpus.glob("*.jpg"))[:4]
+    shutil.copy(paths[0], corpus / "photo.heic")
+    compare_images.hash_images(paths + [corpus / "photo.heic"], workers=2)
+    assert registrations()
@@ -0,0 +1,34 @@
+"""Tests for ImageStore, the columnar store of image info."""
+
+import hashlib
+import os
+
+from helpers import make_scanner
+from image_scanner import ImageStore
+
+
+def test_image_store_round_trip(corpus, tmp_path):
+    scanner = make_scanner(corpus, tmp_path / "work")
+    paths = [path for path, _ in scanner.iter_images()]
+    infos = [scanner.get_image_info(path) for path in paths]
+    # Header-only info, as lazy analysis leaves it
+    infos[0] = dict(infos[0], phash=None, dhash=None, whash=None, ahash=None, avg_color=None)
+    # A file name that is not valid UTF-8
+    paths[1] = paths[1].with_name(os.fsdecode(b"caf\xe9.jpg"))
+
+    store = ImageStore(capacity=4)
+    for k, (path, info) in enumerate(zip(paths, infos)):
+        digest = hashlib.md5(path.name.encode('utf-8', 'surrogateescape')).hexdigest()
+        assert store.append(path, info, mtime_ns=k, digest=digest) == k
+    store.remove(2)
+
+    assert len(store) == len(paths) - 1
+    assert store.rows().tolist() == [k for k in range(len(paths)) if k != 2]
+    for k, (path, info) in enumerate(zip(paths, infos)):
+        assert store.path(k) == path
+        assert store.info(k) == info
+        assert int(store.records['mtime_ns'][k]) == k
+
+    store.rename(3, paths[3].with_name("renamed.jpg"))
+    assert store.path(3).name == "renamed.jpg"
+    assert store.info(3) == infos[3]
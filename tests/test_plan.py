@@ -0,0 +1,69 @@
+"""Tests for FileOperationPlan, apply_plan and --undo."""
+
+import json
+import os
+from pathlib import Path
+
+from helpers import layout, make_scanner
+from image_scanner import FileOperationPlan, ImageScanner
+
+
+def test_plan_round_trip_and_undo(corpus, tmp_path):
+    before = layout(corpus)
+
+    scanner = make_scanner(corpus, tmp_path / "dry_run", dry_run=True)
+    scanner.scan_for_duplicates()
+    ops = list(scanner.plan)
+    assert any(op['op'] == 'move' for op in ops)
+    assert any(op['op'] == 'rename' for op in ops)
+    assert layout(corpus) == before
+
+    # The plan survives the JSON checkpoint that --resume reads back
+    restored = FileOperationPlan(scanner.discarded_dir)
+    restored.restore(json.loads(json.dumps(scanner.plan.to_records())))
+    assert list(restored) == ops
+
+    applier = make_scanner(corpus, tmp_path / "apply")
+    applier.plan = restored
+    applier.setup_discarded_directory()
+    applier.apply_plan(checkpoint=False)
+    after = layout(corpus)
+    for op in ops:
+        assert op['source'].relative_to(corpus).as_posix() not in after
+        assert op['dest'].relative_to(corpus).as_posix() in after
+
+    undone = applier.undo(applier.journal_file)
+    assert undone == len(ops)
+    assert layout(corpus) == before
+
+
+def test_undo_from_another_directory(corpus, tmp_path, monkeypatch):
+    before = layout(corpus)
+    monkeypatch.chdir(corpus.parent)
+    scanner = make_scanner(Path(corpus.name), tmp_path / "work")
+    scanner.scan_for_duplicates()
+    assert layout(corpus) != before
+
+    monkeypatch.chdir(tmp_path / "work")
+    journal = Path(scanner.journal_file.name)
+    undone = ImageScanner(journal.parent, use_cache=False).undo(journal)
+    assert undone > 0
+    assert layout(corpus) == before
+
+
+def test_undo_journal_with_relative_paths(corpus, tmp_path, monkeypatch):
+    # Journals used to record paths relative to where the scan ran
+    before = layout(corpus)
+    scanner = make_scanner(corpus, corpus)
+    scanner.scan_for_duplicates()
+    lines = scanner.journal_file.read_text().splitlines()
+    with open(scanner.journal_file, 'w') as f:
+        for line in lines:
+            f.write(line.replace(str(corpus.parent) + os.sep, "") + "\n")
+    assert '"directory": "images"' in lines[0].replace(str(corpus.parent) + os.sep, "")
+
+    monkeypatch.chdir(corpus.parent.parent)
+    undone = ImageScanner(corpus, use_cache=False).undo(scanner.journal_file)
+    assert undone > 0
+    assert {name: digest for name, digest in layout(corpus).items()
+            if not name.startswith("image_scan_")} == before
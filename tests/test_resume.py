@@ -0,0 +1,94 @@
+"""Tests for --resume: continuing interrupted scans from their checkpoints."""
+
+import shutil
+
+import pytest
+
+import image_scanner
+from helpers import layout, make_scanner
+
+
+def interrupt_after(monkeypatch, target, name: str, count: int):
+    """Make target.name raise KeyboardInterrupt once it has been called count times."""
+    original = getattr(target, name)
+    calls = []
+
+    def wrapper(*args, **kwargs):
+        if len(calls) >= count:
+            raise KeyboardInterrupt
+        calls.append(args)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(target, name, wrapper)
+    return calls
+
+
+def count_calls(monkeypatch, target, name: str):
+    original = getattr(target, name)
+    calls = []
+
+    def wrapper(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(target, name, wrapper)
+    return calls
+
+
+def expected_layout(corpus_template, tmp_path):
+    """Layout after an uninterrupted scan of a fresh copy of the corpus."""
+    reference = tmp_path / "reference"
+    shutil.copytree(corpus_template, reference)
+    make_scanner(reference, tmp_path / "reference_work").scan_for_duplicates()
+    return layout(reference)
+
+
+def test_resume_analysis_under_another_spelling(corpus, corpus_template, tmp_path, monkeypatch):
+    expected = expected_layout(corpus_template, tmp_path)
+    with monkeypatch.context() as patch:
+        decoded = count_calls(patch, image_scanner, '_extract_worker')
+        make_scanner(corpus_template, tmp_path / "count", dry_run=True).scan_for_duplicates()
+    assert len(decoded) > 10
+
+    monkeypatch.chdir(corpus.parent)
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, image_scanner, '_extract_worker', 10)
+        with pytest.raises(KeyboardInterrupt):
+            make_scanner(corpus.name, tmp_path / "work").scan_for_duplicates()
+
+    monkeypatch.chdir(tmp_path / "work")
+    with monkeypatch.context() as patch:
+        resumed = count_calls(patch, image_scanner, '_extract_worker')
+        make_scanner(corpus, tmp_path / "work", resume=True).scan_for_duplicates()
+    assert len(resumed) == len(decoded) - 10
+    assert layout(corpus) == expected
+    assert not (tmp_path / "work" / ".image_scan_state.json").exists()
+
+
+def test_resume_apply_from_another_directory(corpus, corpus_template, tmp_path, monkeypatch):
+    expected = expected_layout(corpus_template, tmp_path)
+    monkeypatch.chdir(corpus.parent)
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, image_scanner.ImageScanner, '_apply_operation', 5)
+        with pytest.raises(KeyboardInterrupt):
+            make_scanner(corpus.name, tmp_path / "work").scan_for_duplicates()
+    assert layout(corpus) != expected
+
+    monkeypatch.chdir(tmp_path / "work")
+    scanner = make_scanner(corpus, tmp_path / "work", resume=True)
+    with monkeypatch.context() as patch:
+        retried = count_calls(patch, image_scanner.ImageScanner, '_apply_operation')
+        scanner.scan_for_duplicates()
+    assert retried
+    assert layout(corpus) == expected
+
+
+def test_checkpoint_of_another_directory_is_ignored(corpus, corpus_template, tmp_path, monkeypatch):
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, image_scanner, '_extract_worker', 5)
+        with pytest.raises(KeyboardInterrupt):
+            make_scanner(corpus_template, tmp_path / "work", dry_run=True).scan_for_duplicates()
+
+    scanner = make_scanner(corpus, tmp_path / "work", resume=True, dry_run=True)
+    assert scanner.state.exists()
+    assert scanner.state.load() is None
@@ -0,0 +1,31 @@
+"""Tests for review_discarded.py's reading of the scanner's journals."""
+
+import pytest
+
+import image_scanner
+from helpers import make_scanner
+from review_discarded import collect_discarded, read_journals
+from test_resume import interrupt_after
+
+
+def test_only_completed_moves_are_read(corpus, tmp_path, monkeypatch):
+    scanner = make_scanner(corpus, corpus)
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, image_scanner.ImageScanner, '_apply_operation', 3)
+        with pytest.raises(KeyboardInterrupt):
+            scanner.scan_for_duplicates()
+    planned = [op for op in scanner.plan if op['op'] == 'move']
+    discarded = {path.name for path in scanner.discarded_dir.iterdir()}
+    assert 0 < len(discarded) < len(planned)
+
+    moves = read_journals(corpus)
+    assert set(moves) == discarded
+    for name, move in moves.items():
+        op = next(op for op in planned if op['dest'].name == name)
+        assert move['source'] == str(op['source'])
+        assert move['reason'] == op['reason']
+
+    files, errors = collect_discarded(scanner.discarded_dir, moves)
+    assert not errors
+    assert {info['name'] for info in files} == discarded
+    assert all(info['source'] == moves[info['name']]['source'] for info in files)
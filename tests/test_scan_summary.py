@@ -0,0 +1,32 @@
+"""Tests for the counts in the summary of a scan."""
+
+import re
+
+import pytest
+
+import image_scanner
+from helpers import make_scanner
+from test_resume import interrupt_after
+
+SUMMARY = re.compile(r"Generated (\d+) candidate pairs, made (\d+) comparisons, "
+                     r"found (\d+) similar pairs in (\d+) groups")
+
+
+def summary(output: str):
+    return tuple(int(count) for count in SUMMARY.search(output).groups())
+
+
+def test_summary_counts_survive_resume(corpus, tmp_path, monkeypatch, capsys):
+    make_scanner(corpus, tmp_path / "dry_run", dry_run=True, cascade=True).scan_for_duplicates()
+    generated, compared, pairs, groups = expected = summary(capsys.readouterr().out)
+    # Candidates that --cascade left without a pHash are not scored
+    assert generated >= compared > 0
+    assert pairs >= groups > 0
+
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, image_scanner.ImageScanner, '_apply_operation', 3)
+        with pytest.raises(KeyboardInterrupt):
+            make_scanner(corpus, tmp_path / "work", cascade=True).scan_for_duplicates()
+    capsys.readouterr()
+    make_scanner(corpus, tmp_path / "work", cascade=True, resume=True).scan_for_duplicates()
+    assert summary(capsys.readouterr().out) == expected
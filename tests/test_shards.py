@@ -0,0 +1,30 @@
+"""Tests for --shard and --merge."""
+
+from helpers import make_scanner
+
+
+def test_merged_shards_plan_like_a_single_scan(corpus, tmp_path):
+    # Spread the corpus over two folders so the shards store relative paths
+    (corpus / "sub").mkdir()
+    for path in sorted(corpus.glob("*.jpg"))[::3]:
+        path.rename(corpus / "sub" / path.name)
+
+    single = make_scanner(corpus, tmp_path / "single", dry_run=True, recursive=True)
+    single.scan_for_duplicates()
+    expected = single.plan.to_records()
+    assert expected
+
+    count = 3
+    shard_files = []
+    written = 0
+    for number in range(1, count + 1):
+        shard_file = tmp_path / f"shard_{number}.idx"
+        scanner = make_scanner(corpus, tmp_path / f"shard_{number}", recursive=True, shard=(number, count))
+        written += scanner.write_shard(shard_file)
+        shard_files.append(shard_file)
+    assert written == sum(1 for _ in single.iter_images())
+
+    merged = make_scanner(corpus, tmp_path / "merged", dry_run=True, recursive=True,
+                          shards=list(reversed(shard_files)))
+    merged.scan_for_duplicates()
+    assert merged.plan.to_records() == expected
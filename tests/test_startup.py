@@ -0,0 +1,40 @@
+"""The command-line tools must start without Pillow, imagehash, SciPy or PyWavelets."""
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from benchmark import LAZY_MODULES, STARTUP_SCRIPTS
+from helpers import make_scanner
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def loaded_after(code: str) -> list:
+    """The LAZY_MODULES that are imported after running code in a fresh interpreter."""
+    probe = f"{code}\nimport sys, json; print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"
+    result = subprocess.run([sys.executable, "-c", probe], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+@pytest.mark.parametrize("script", STARTUP_SCRIPTS)
+def test_import_and_help_are_lazy(script):
+    assert loaded_after(f"import {Path(script).stem}") == []
+    result = subprocess.run([sys.executable, script, "--help"], cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0
+    assert "usage:" in result.stdout
+
+
+def test_cached_scan_and_undo_are_lazy(corpus, tmp_path):
+    work = tmp_path / "work"
+    setup = (f"from pathlib import Path\nfrom image_scanner import ImageScanner\n"
+             f"scanner = ImageScanner({str(corpus)!r}, work_dir={str(work)!r}, dry_run=True)\n")
+    make_scanner(corpus, work, dry_run=True, use_cache=True).scan_for_duplicates()
+    assert loaded_after(setup + "scanner.scan_for_duplicates()") == []
+
+    scanner = make_scanner(corpus, work)
+    scanner.scan_for_duplicates()
+    assert loaded_after(setup + f"scanner.undo(Path({str(scanner.journal_file)!r}))") == []
@@ -0,0 +1,33 @@
+"""Tests for --watch: deduplicating images as they arrive."""
+
+import shutil
+
+import image_scanner
+from helpers import make_scanner
+
+
+def test_new_images_are_checked_against_the_index(corpus, tmp_path, monkeypatch):
+    watched = tmp_path / "watched"
+    watched.mkdir()
+    for name in ("f000002_original.jpg", "f000005_scaled50.jpg"):
+        shutil.copy(corpus / name, watched / name)
+
+    sleeps = []
+
+    def sleep(seconds):
+        # The first poll finds the new files; the second stops the watch
+        if sleeps:
+            raise KeyboardInterrupt
+        sleeps.append(seconds)
+        shutil.copy(corpus / "f000002_original.jpg", watched / "copy.jpg")
+        shutil.copy(corpus / "f000002_scaled25.jpg", watched / "f000002_scaled25.jpg")
+        shutil.copy(corpus / "f000005_original.jpg", watched / "f000005_original.jpg")
+
+    monkeypatch.setattr(image_scanner.time, "sleep", sleep)
+    make_scanner(watched, tmp_path / "work").watch(debounce=0, poll=True)
+
+    assert sorted(path.name for path in (watched / "discarded").iterdir()) == [
+        "copy.jpg", "f000002_scaled25.jpg", "f000005_scaled50.jpg"]
+    kept = sorted(path.name for path in watched.iterdir() if path.is_file())
+    assert len(kept) == 2
+    assert kept[0].startswith("f000002_original") and kept[1].startswith("f000005_original")